@@ -0,0 +1,206 @@
+'''
+    End to end benchmark: runs full collection cycles against a simulated
+    cluster and a local Carbon sink at a few cluster sizes, and reports the
+    cycle time, peak RSS of the collector and datapoints sent per second.
+
+        python -m benchmarks.bench --agents 100,1000,10000
+
+    The simulator and the collector run in separate processes so they
+    don't share the GIL, and every cluster size gets a fresh collector
+    process so its peak RSS is its own.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import queue
+import statistics
+import multiprocessing
+
+from mesos_stats.carbon import Carbon
+from mesos_stats.memory import peak_rss_mb
+from mesos_stats.mesos import Mesos
+from mesos_stats.scheduler import Scheduler
+from mesos_stats.sender import Sender
+from mesos_stats.singularity import Singularity
+from mesos_stats.tiers import TIERS, TierGroup
+from benchmarks.simulator import ClusterSpec, Simulator
+from benchmarks.carbon_sink import CarbonSink
+
+
+def serve_simulator(spec, ports):
+    simulator = Simulator(spec, port=0)
+    ports.put(simulator.port)
+    simulator.serve_forever()
+
+
+def run_collector(master, singularity, carbon_port, args, results):
+    ''' Runs args.cycles full cycles, in its own process '''
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w')
+    mesos = Mesos([master])
+    sing = Singularity(singularity, update=False) if singularity else None
+    carbon = Carbon('127.0.0.1', 'bench', pickle=args.pickle,
+                    port=carbon_port, pickle_port=carbon_port)
+    group = TierGroup(list(TIERS), Scheduler(60), mesos, sing, args.pickle,
+                      stagger=args.stagger, processes=args.processes,
+                      agent_source=args.agent_source)
+    sender = Sender(carbon, args.pickle)
+    if group.shard_pool:
+        group.shard_pool.start(group.mesos_carbon, sender.encoding())
+    cycles = []
+    for i in range(args.cycles):
+        tick = int(time.time())
+        deadline = tick + 3600
+        sent = [0]
+
+        def send(final=True):
+            sent[0] += sender.send(group.queue, tick, deadline, final,
+                                   group.payloads)[0]
+
+        t = time.time()
+        error = None
+        collected = None
+        try:
+            group.collect(tick, send)
+            collected = time.time()
+            send()
+        except Exception as e:
+            # the real cycle loop carries on too, count it and move on
+            error = '{}: {}'.format(type(e).__name__, e)
+            group.queue.queue.clear()
+            del group.payloads[:]
+        done = time.time()
+        cycles.append({'collect': (collected or done) - t,
+                       'send': done - (collected or done),
+                       'cycle': done - t,
+                       'datapoints': sent[0],
+                       'error': error})
+    results.put({'cycles': cycles, 'peak_rss_mb': peak_rss_mb()})
+
+
+def bench(agents, args):
+    spec = ClusterSpec(agents, args.executors, args.frameworks, args.tasks,
+                       args.latency, args.jitter, args.failure_rate,
+                       args.slow_agents, args.slow_latency)
+    ports = multiprocessing.Queue()
+    simulator = multiprocessing.Process(target=serve_simulator,
+                                        args=(spec, ports), daemon=True)
+    simulator.start()
+    sink = CarbonSink(pickle=args.pickle)
+    sink.start()
+    try:
+        port = ports.get(timeout=30)
+        master = '127.0.0.1:{}'.format(port)
+        singularity = None if args.no_singularity else master
+        results = multiprocessing.Queue()
+        collector = multiprocessing.Process(
+            target=run_collector,
+            args=(master, singularity, sink.port, args, results))
+        collector.start()
+        res = None
+        while res is None:
+            try:
+                res = results.get(timeout=1)
+            except queue.Empty:
+                if not collector.is_alive():
+                    raise RuntimeError('The collector process died')
+        collector.join()
+        # the sink may still be reading the tail of the last send
+        sent = sum(c['datapoints'] for c in res['cycles'])
+        waited = 0
+        while sink.stats.datapoints + sink.stats.invalid < sent and \
+                waited < 5:
+            time.sleep(0.1)
+            waited += 0.1
+    finally:
+        simulator.terminate()
+        sink.shutdown()
+        sink.server_close()
+
+    cycles = res['cycles']
+    cycle_time = statistics.median(c['cycle'] for c in cycles)
+    datapoints = cycles[-1]['datapoints']
+    return {
+        'agents': agents,
+        'executors': args.executors,
+        'cycles': len(cycles),
+        'cycle_median': cycle_time,
+        'cycle_max': max(c['cycle'] for c in cycles),
+        'collect_median': statistics.median(c['collect'] for c in cycles),
+        'send_median': statistics.median(c['send'] for c in cycles),
+        'datapoints': datapoints,
+        'datapoints_per_second': datapoints / cycle_time
+        if cycle_time else 0.0,
+        'peak_rss_mb': res['peak_rss_mb'],
+        'sent': sent,
+        'failed_cycles': sum(1 for c in cycles if c['error']),
+        'sink_datapoints': sink.stats.datapoints,
+        'sink_invalid': sink.stats.invalid,
+        'sink_series': len(sink.stats.paths),
+    }
+
+
+def print_results(rows):
+    header = ('agents', 'cycle s', 'max s', 'collect s', 'send s',
+              'datapoints', 'dp/s', 'peak RSS MB', 'invalid', 'failed')
+    print(('{:>12}' * len(header)).format(*header))
+    for r in rows:
+        print('{:>12}{:>12.2f}{:>12.2f}{:>12.2f}{:>12.2f}{:>12}{:>12.0f}'
+              '{:>12.1f}{:>12}{:>12}'.format(
+                  r['agents'], r['cycle_median'], r['cycle_max'],
+                  r['collect_median'], r['send_median'], r['datapoints'],
+                  r['datapoints_per_second'], r['peak_rss_mb'],
+                  r['sink_invalid'], r['failed_cycles']))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--agents', default='100,1000,10000',
+                        help='comma separated cluster sizes to run')
+    parser.add_argument('--executors', type=int, default=10,
+                        help='executors per agent')
+    parser.add_argument('--frameworks', type=int, default=5)
+    parser.add_argument('--tasks', type=int, default=10,
+                        help='tasks per framework')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many more seconds, at random')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of agent requests failing with a 503')
+    parser.add_argument('--slow-agents', type=int, default=0)
+    parser.add_argument('--slow-latency', type=float, default=5.0)
+    parser.add_argument('--stagger', type=float, default=0,
+                        help='seconds to spread agent polls over')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='worker processes to collect agents with')
+    parser.add_argument('--agent-source', default='agent',
+                        choices=('agent', 'master', 'master_only'),
+                        help='where agent resource metrics come from')
+    parser.add_argument('--pickle', action='store_true',
+                        help='send with the pickle protocol')
+    parser.add_argument('--no-singularity', action='store_true')
+    parser.add_argument('--json', help='also write the results here')
+    parser.add_argument('--verbose', action='store_true',
+                        help="show the collector's log")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rows = []
+    for agents in [int(a) for a in args.agents.split(',')]:
+        print('Benchmarking {} agents...'.format(agents), file=sys.stderr)
+        rows.append(bench(agents, args))
+    print_results(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+    return rows
+
+
+if __name__ == '__main__':
+    main()
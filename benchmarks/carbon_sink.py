@@ -0,0 +1,93 @@
+'''
+    A local stand-in for Carbon that counts and validates what it receives,
+    over the plaintext or the pickle protocol. Only meant for benchmarks
+    and tests: the pickle protocol unpickles whatever it is sent.
+'''
+import math
+import pickle
+import struct
+import threading
+from socketserver import StreamRequestHandler, TCPServer, ThreadingMixIn
+
+
+class SinkStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.datapoints = 0
+        self.invalid = 0
+        self.bytes = 0
+        self.paths = set()
+        self.errors = []  # a few of the invalid datapoints, for debugging
+
+    def add(self, datapoints, nbytes):
+        ''' Validates and counts [(path, value, timestamp), ...] '''
+        invalid = []
+        paths = []
+        for path, value, ts in datapoints:
+            if _valid(path, value, ts):
+                paths.append(path)
+            else:
+                invalid.append((path, value, ts))
+        with self.lock:
+            self.datapoints += len(paths)
+            self.paths.update(paths)
+            self.invalid += len(invalid)
+            self.errors.extend(invalid[:10 - len(self.errors)])
+            self.bytes += nbytes
+
+
+def _valid(path, value, ts):
+    if not isinstance(path, str) or not path or ' ' in path \
+            or '..' in path or path.startswith('.') or path.endswith('.'):
+        return False
+    try:
+        value = float(value)
+        ts = int(ts)
+    except (TypeError, ValueError):
+        return False
+    return not math.isnan(value) and 1e9 <= ts < 1e10
+
+
+class PlaintextHandler(StreamRequestHandler):
+    def handle(self):
+        stats = self.server.stats
+        for line in self.rfile:
+            fields = line.decode(errors='replace').split()
+            if len(fields) != 3:
+                stats.add([(line, None, None)], len(line))
+                continue
+            stats.add([tuple(fields)], len(line))
+
+
+class PickleHandler(StreamRequestHandler):
+    def handle(self):
+        stats = self.server.stats
+        while True:
+            header = self.rfile.read(4)
+            if len(header) < 4:
+                return
+            size, = struct.unpack('!L', header)
+            payload = self.rfile.read(size)
+            datapoints = [(path, value, ts)
+                          for path, (ts, value) in pickle.loads(payload)]
+            stats.add(datapoints, size + 4)
+
+
+class CarbonSink(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, pickle=False, host='127.0.0.1'):
+        handler = PickleHandler if pickle else PlaintextHandler
+        TCPServer.__init__(self, (host, port), handler)
+        self.stats = SinkStats()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever, name='carbon_sink',
+                             daemon=True)
+        t.start()
+        return t
@@ -0,0 +1,300 @@
+'''
+    Microbenchmarks of the flush and encode hot paths, on in-memory
+    fixtures generated by the simulator, without any network.
+
+        python -m benchmarks.micro              # compare with the baselines
+        python -m benchmarks.micro --save       # record new baselines
+
+    For every stage it reports:
+    - ns/dp:      CPU time per datapoint, best of --repeat runs
+    - blocks/dp:  memory blocks still allocated per datapoint afterwards,
+                  i.e. what the stage leaves in the queue
+    - bytes/dp:   peak of the memory traced by tracemalloc during the
+                  stage per datapoint, which also covers the garbage held
+                  at once (a chunk's worth for the Carbon stages)
+
+    Stages more than --threshold slower than their baseline are flagged
+    and the exit status is 1. Baselines are machine specific, record them
+    on the machine you compare on.
+'''
+import os
+import sys
+import gc
+import json
+import time
+import queue
+import argparse
+import tracemalloc
+from contextlib import redirect_stdout
+
+from mesos_stats.carbon import Carbon
+from mesos_stats.mesos import MesosCarbon, parse_executors
+from mesos_stats.singularity import SingularityCarbon
+from benchmarks.simulator import ClusterSpec, Cluster, MASTER
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+TIMESTAMP = 1500000000
+
+
+class FakeMesos:
+    update_ts = TIMESTAMP
+
+
+class FakeSingularity:
+    update_ts = TIMESTAMP
+
+    def get_singularity_lookup(self):
+        lookup = {}
+        for t in self.active_tasks:
+            lookup[t['mesosTask']['taskId']['value']] = '{}_{}'.format(
+                t['taskId']['requestId'], t['taskId']['instanceNo'])
+        return lookup
+
+
+class NullSocket:
+    def sendall(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class Fixtures:
+    ''' The decoded API responses of a simulated cluster '''
+    def __init__(self, spec):
+        cluster = Cluster(spec, 5051)
+        self.slave_metrics = {a: cluster._render(a, '/metrics/snapshot')
+                              for a in cluster.agents}
+        # parsed as the poll threads do
+        self.executors = {
+            a: parse_executors(cluster._render(a, '/monitor/statistics.json'))
+            for a in cluster.agents}
+        self.frameworks = cluster._render(MASTER, '/frameworks')
+        self.singularity_state = cluster._singularity('/state')
+        self.disasters = cluster._singularity('/disasters/stats')
+        self.active_tasks = cluster._singularity('/tasks/active')
+
+    def mesos_carbon(self, q, pickle=False):
+        mesos = FakeMesos()
+        mesos.slave_metrics = dict(self.slave_metrics)
+        mesos.executors = self.executors
+        mesos.framework_metrics = self.frameworks
+        singularity = FakeSingularity()
+        singularity.active_tasks = self.active_tasks
+        return MesosCarbon(mesos, q, singularity, pickle)
+
+    def singularity_carbon(self, q):
+        singularity = FakeSingularity()
+        singularity.state = self.singularity_state
+        singularity.disasters_stats = self.disasters
+        return SingularityCarbon(singularity, q)
+
+    def queued(self, pickle=False):
+        ''' A queue of everything the flushers would produce '''
+        q = queue.Queue()
+        mc = self.mesos_carbon(q, pickle)
+        mc.flush_slave_metrics()
+        mc.flush_executor_metrics()
+        return list(q.queue)
+
+
+def flusher(fixtures, name):
+    def setup():
+        q = queue.Queue()
+        mc = fixtures.mesos_carbon(q)
+        if name in ('send_alternate_executor_metrics',
+                    'flush_all_executors'):
+            mc.send_alternate_executor_metrics()  # warm the name cache
+            q.queue.clear()
+        return q, (getattr(mc, name),)
+
+    def run(fn):
+        fn()
+    return setup, run
+
+
+def singularity_flush_all(fixtures):
+    def setup():
+        q = queue.Queue()
+        return q, (fixtures.singularity_carbon(q).flush_all,)
+
+    def run(fn):
+        fn()
+    return setup, run
+
+
+def get_chunks(fixtures):
+    metrics = fixtures.queued()
+
+    def setup():
+        q = queue.Queue()
+        q.queue.extend(metrics)
+        carbon = Carbon('localhost', 'prefix')
+        return None, (carbon, q, len(metrics))
+
+    def run(carbon, q, n):
+        while carbon._get_chunk_from_queue(q, 500):
+            pass
+    return setup, run
+
+
+def send(fixtures, pickle):
+    metrics = fixtures.queued(pickle)
+    chunks = [metrics[i:i + 500] for i in range(0, len(metrics), 500)]
+
+    def setup():
+        carbon = Carbon('localhost', 'prefix', pickle=pickle)
+        carbon.sock = NullSocket()
+        if pickle:
+            carbon.port = carbon.pickle_port
+        return None, (carbon, chunks, len(metrics))
+
+    def run(carbon, chunks, n):
+        fn = carbon.send_metrics_pickle if pickle \
+            else carbon.send_metrics_plaintext
+        for chunk in chunks:
+            fn(chunk)
+    return setup, run
+
+
+def stages(fixtures):
+    return [
+        ('flush_slave_metrics', flusher(fixtures, 'flush_slave_metrics')),
+        ('flush_executor_metrics',
+         flusher(fixtures, 'flush_executor_metrics')),
+        ('send_alternate_executor_metrics',
+         flusher(fixtures, 'send_alternate_executor_metrics')),
+        ('flush_all_executors', flusher(fixtures, 'flush_all_executors')),
+        ('flush_framework_task_metrics',
+         flusher(fixtures, 'flush_framework_task_metrics')),
+        ('singularity_flush_all', singularity_flush_all(fixtures)),
+        ('carbon_get_chunk_from_queue', get_chunks(fixtures)),
+        ('carbon_send_plaintext', send(fixtures, False)),
+        ('carbon_send_pickle', send(fixtures, True)),
+    ]
+
+
+def measure(setup, run, repeat):
+    '''
+        Runs a stage `repeat` times, returns (datapoints, ns/dp, blocks/dp,
+        bytes/dp). Flushers count the datapoints they queue, the other
+        stages the datapoints they were handed.
+    '''
+    best = None
+    for _ in range(repeat):
+        q, args = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            t = time.perf_counter()
+            run(*args)
+            elapsed = time.perf_counter() - t
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    datapoints = q.qsize() if q is not None else args[-1]
+
+    # allocations are measured on a separate run, tracing slows it down
+    q, args = setup()
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        blocks = sys.getallocatedblocks()
+        start = tracemalloc.get_traced_memory()[0]
+        run(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        blocks = sys.getallocatedblocks() - blocks
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    n = max(datapoints, 1)
+    return datapoints, best * 1e9 / n, blocks / n, (peak - start) / n
+
+
+def run_suite(spec, repeat=10, only=None):
+    results = {}
+    # the flushers log a line every run
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for name, (setup, run) in stages(Fixtures(spec)):
+            if only and name not in only:
+                continue
+            datapoints, ns, blocks, nbytes = measure(setup, run, repeat)
+            results[name] = {'datapoints': datapoints, 'ns_per_dp': ns,
+                             'blocks_per_dp': blocks,
+                             'bytes_per_dp': nbytes}
+    return results
+
+
+def compare(results, baselines, threshold):
+    ''' Names of the stages more than `threshold` slower than baseline '''
+    slower = []
+    for name, r in results.items():
+        base = baselines.get(name)
+        if base and r['ns_per_dp'] > base['ns_per_dp'] * (1 + threshold):
+            slower.append(name)
+    return slower
+
+
+def print_results(results, baselines, slower):
+    print('{:<34}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+        'stage', 'dp', 'ns/dp', 'base', 'blocks/dp', 'bytes/dp'))
+    for name, r in results.items():
+        base = baselines.get(name, {}).get('ns_per_dp')
+        print('{:<34}{:>10}{:>10.0f}{:>10}{:>10.2f}{:>10.0f}{}'.format(
+            name, r['datapoints'], r['ns_per_dp'],
+            '{:.0f}'.format(base) if base else '-', r['blocks_per_dp'],
+            r['bytes_per_dp'], '  SLOWER' if name in slower else ''))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--agents', type=int, default=1000)
+    parser.add_argument('--executors', type=int, default=10)
+    parser.add_argument('--frameworks', type=int, default=20)
+    parser.add_argument('--tasks', type=int, default=50,
+                        help='tasks per framework')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='flag stages this much slower than baseline')
+    parser.add_argument('--stage', action='append',
+                        help='only run this stage, can be repeated')
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the new baselines')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    spec = ClusterSpec(args.agents, args.executors, args.frameworks,
+                       args.tasks)
+    results = run_suite(spec, args.repeat, args.stage)
+    baselines = {}
+    try:
+        with open(args.baselines) as f:
+            saved = json.load(f)
+        baselines = saved['stages']
+        if (saved['agents'], saved['executors']) != \
+                (args.agents, args.executors):
+            print('WARNING: baselines were recorded with {} agents and {} '
+                  'executors'.format(saved['agents'], saved['executors']))
+    except FileNotFoundError:
+        pass
+    slower = compare(results, baselines, args.threshold)
+    print_results(results, baselines, slower)
+    if args.save:
+        with open(args.baselines, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'agents': args.agents, 'executors': args.executors,
+                       'stages': results}, f, indent=2, sort_keys=True)
+        print('Saved baselines to {}'.format(args.baselines))
+    elif slower:
+        print('{} stage(s) more than {:.0%} slower than baseline'
+              .format(len(slower), args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
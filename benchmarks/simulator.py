@@ -0,0 +1,267 @@
+'''
+    Serves a synthetic Mesos cluster (master, agents) and Singularity from
+    one local HTTP server.
+
+    Every agent gets its own loopback address (127.1.0.1, 127.1.0.2, ...)
+    so the collector polls them like distinct hosts, the server tells them
+    apart by the address a request came in on. Linux routes all of 127/8
+    to the loopback interface, elsewhere the addresses need to be aliased.
+'''
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+MASTER = '127.0.0.1'
+
+
+def agent_address(i):
+    ''' Loopback address of the i-th agent '''
+    n = i + 1
+    return '127.{}.{}.{}'.format(1 + n // 65536, (n // 256) % 256, n % 256)
+
+
+class ClusterSpec:
+    '''
+        Shape and behaviour of the simulated cluster
+
+        latency:      seconds every response is delayed by
+        jitter:       up to this many more seconds, at random
+        failure_rate: fraction of agent requests answered with a 503
+        slow_agents:  number of agents answering after slow_latency
+    '''
+    def __init__(self, agents=100, executors=10, frameworks=5,
+                 tasks_per_framework=10, latency=0.0, jitter=0.0,
+                 failure_rate=0.0, slow_agents=0, slow_latency=5.0,
+                 seed=0):
+        self.agents = agents
+        self.executors = executors
+        self.frameworks = frameworks
+        self.tasks_per_framework = tasks_per_framework
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.slow_agents = slow_agents
+        self.slow_latency = slow_latency
+        self.seed = seed
+
+
+class Cluster:
+    ''' Renders the API responses of a ClusterSpec, once each '''
+    def __init__(self, spec, port):
+        self.spec = spec
+        self.port = port
+        rnd = random.Random(spec.seed)
+        self.agents = [agent_address(i) for i in range(spec.agents)]
+        self.index = {a: i for i, a in enumerate(self.agents)}
+        self.slow = set(rnd.sample(self.agents,
+                                   min(spec.slow_agents, spec.agents)))
+        self.lock = threading.Lock()
+        self._cache = {}
+
+    def task_id(self, agent, e):
+        return 'task{}-{}-mesos-slave{}'.format(e, self.index[agent],
+                                                 self.index[agent])
+
+    def response(self, host, path):
+        ''' The JSON body for a request or None if there isn't one '''
+        key = (host, path)
+        body = self._cache.get(key)
+        if body is None:
+            res = self._render(host, path)
+            if res is None:
+                return None
+            body = json.dumps(res).encode()
+            with self.lock:
+                self._cache[key] = body
+        return body
+
+    def _render(self, host, path):
+        spec = self.spec
+        if path.startswith('/api/'):
+            return self._singularity(path[4:])
+        if host == MASTER:
+            if path == '/metrics/snapshot':
+                return self._master_metrics()
+            if path == '/slaves':
+                return {'slaves': [self._slave(i, a)
+                                   for i, a in enumerate(self.agents)]}
+            if path == '/state-summary':
+                return {'hostname': MASTER, 'cluster': 'simulator',
+                        'slaves': [self._slave(i, a)
+                                   for i, a in enumerate(self.agents)],
+                        'frameworks': [
+                            {k: v for k, v in self._framework(f).items()
+                             if k != 'tasks'}
+                            for f in range(spec.frameworks)]}
+            if path == '/frameworks':
+                return {'frameworks': [self._framework(f)
+                                       for f in range(spec.frameworks)]}
+            return None
+        if host not in self.index:
+            return None
+        if path == '/metrics/snapshot':
+            return self._agent_metrics(self.index[host])
+        if path == '/monitor/statistics.json':
+            return [self._executor(host, e) for e in range(spec.executors)]
+        return None
+
+    def _master_metrics(self):
+        n = self.spec.agents
+        return {
+            'master/elected': 1,
+            'master/cpus_total': 32 * n, 'master/cpus_used': 16 * n,
+            'master/cpus_percent': 0.5,
+            'master/mem_total': 65536 * n, 'master/mem_used': 32768 * n,
+            'master/mem_percent': 0.5,
+            'master/disk_total': 1e6 * n, 'master/disk_used': 1e5 * n,
+            'master/disk_percent': 0.1,
+            'master/slaves_connected': n,
+            'master/tasks_running': n * self.spec.executors,
+            'master/tasks_failed': 3, 'master/tasks_lost': 0,
+            'master/dropped_messages': 0,
+        }
+
+    def _slave(self, i, agent):
+        metrics = self._agent_metrics(i)
+        return {
+            'id': 'S{}'.format(i), 'hostname': agent, 'port': self.port,
+            'resources': {r: metrics['slave/{}_total'.format(r)]
+                          for r in ('cpus', 'mem', 'disk')},
+            'used_resources': {r: metrics['slave/{}_used'.format(r)]
+                               for r in ('cpus', 'mem', 'disk')},
+        }
+
+    def _agent_metrics(self, i):
+        return {
+            'slave/cpus_total': 32, 'slave/cpus_used': i % 32,
+            'slave/cpus_percent': (i % 32) / 32.0,
+            'slave/mem_total': 65536, 'slave/mem_used': 1024 * (i % 64),
+            'slave/mem_percent': (i % 64) / 64.0,
+            'slave/disk_total': 1e6, 'slave/disk_used': 1e5,
+            'slave/tasks_running': self.spec.executors,
+            'slave/tasks_staging': 0,
+            'system/load_1min': 1.5, 'system/load_5min': 1.2,
+            'system/load_15min': 1.0,
+            'system/mem_free_bytes': 2 ** 34,
+            'system/mem_total_bytes': 2 ** 36,
+            # not mapped, agents report plenty of these
+            'slave/executors_running': self.spec.executors,
+            'slave/valid_status_updates': 12345,
+        }
+
+    def _executor(self, agent, e):
+        return {
+            'executor_id': self.task_id(agent, e),
+            'executor_name': 'task{} command'.format(e),
+            'framework_id': 'Singularity',
+            'source': self.task_id(agent, e),
+            'statistics': {
+                'cpus_limit': 1.1, 'cpus_system_time_secs': 12.5 + e,
+                'cpus_user_time_secs': 100.25 + e,
+                'mem_limit_bytes': 2 ** 30, 'mem_rss_bytes': 2 ** 28 + e,
+                'timestamp': 1500000000.0,
+            },
+        }
+
+    def _framework(self, f):
+        name = 'framework{}'.format(f)
+        resources = {'cpus': 1.0, 'mem': 1024.0, 'disk': 0.0}
+        return {
+            'id': 'Singularity' if f == 0 else name,
+            'name': name,
+            'used_resources': resources,
+            'tasks': [{'name': '{}-task{}'.format(name, t),
+                       'resources': resources}
+                      for t in range(self.spec.tasks_per_framework)],
+        }
+
+    def _singularity(self, path):
+        spec = self.spec
+        if path == '/state':
+            state = dict.fromkeys([
+                'scheduledTasks', 'lateTasks', 'launchingTasks',
+                'cleaningTasks', 'futureTasks', 'maxTaskLag',
+                'cooldownRequests', 'pausedRequests', 'pendingRequests',
+                'cleaningRequests', 'deadSlaves', 'decommissioningSlaves',
+                'avgStatusUpdateDelayMs'], 0)
+            state.update({'activeTasks': spec.agents * spec.executors,
+                          'activeRequests': spec.executors,
+                          'activeSlaves': spec.agents})
+            return state
+        if path == '/requests':
+            return [{'request': {'id': 'task{}'.format(e)}}
+                    for e in range(spec.executors)]
+        if path == '/disasters/stats':
+            return {'stats': [{'numLostTasks': 0, 'numLostSlaves': 0,
+                               'timestamp': int(time.time() * 1000)}]}
+        if path == '/tasks/active':
+            return [{'taskId': {'requestId': 'task{}'.format(e),
+                                'instanceNo': self.index[a] + 1},
+                     'mesosTask': {'taskId': {'value': self.task_id(a, e)}}}
+                    for a in self.agents for e in range(spec.executors)]
+        if path.startswith('/slaves'):
+            return []
+        return None
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        cluster = self.server.cluster
+        spec = cluster.spec
+        host = self.connection.getsockname()[0]
+        url = urlparse(self.path)
+        path = url.path + ('?' + url.query if url.query else '')
+
+        delay = spec.latency + random.random() * spec.jitter
+        if host in cluster.slow:
+            delay = max(delay, spec.slow_latency)
+        if delay:
+            time.sleep(delay)
+        if spec.failure_rate and host in cluster.index and \
+                random.random() < spec.failure_rate:
+            return self._reply(503, b'{"error": "injected failure"}')
+        body = cluster.response(host, path)
+        if body is None:
+            return self._reply(404, b'{"error": "not found"}')
+        self._reply(200, body)
+
+    def _reply(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Simulator(ThreadingMixIn, HTTPServer):
+    '''
+        Listens on every address so the master (127.0.0.1), the agents and
+        Singularity share one port
+    '''
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, spec, port=5050):
+        HTTPServer.__init__(self, ('', port), SimulatorHandler)
+        self.cluster = Cluster(spec, self.port)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def master(self):
+        return '{}:{}'.format(MASTER, self.port)
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever, name='simulator',
+                             daemon=True)
+        t.start()
+        return t
@@ -2,17 +2,30 @@ import os
 import sys
 import time
 import traceback
-import queue
+import signal
+import threading
 from datetime import datetime
 
 from mesos_stats.util import log, Timer
-from mesos_stats.mesos import (
-    Mesos,
-    MesosCarbon,
-    MesosStatsException,
-)
+from mesos_stats.mesos import Mesos, MesosStatsException
 from mesos_stats.carbon import Carbon
-from mesos_stats.singularity import Singularity, SingularityCarbon
+from mesos_stats.dedup import ChangeSuppressor
+from mesos_stats.registry import SeriesRegistry
+from mesos_stats.state import StateStore, SAVE_TIMEOUT
+from mesos_stats.scheduler import Scheduler
+from mesos_stats.singularity import Singularity
+from mesos_stats.tiers import TIERS, TierGroup
+from mesos_stats.sender import Sender
+from mesos_stats.instrument import Instrumentation
+from mesos_stats.status import CycleStatus, StatusServer
+from mesos_stats.profiling import CycleProfiler
+from mesos_stats.replay import Recorder, Replayer
+from mesos_stats.memory import MemoryGuard
+from mesos_stats.cache import ResponseCache
+from mesos_stats.adaptive import RequestController
+from mesos_stats.shedding import LoadShedder
+from mesos_stats.clusters import Cluster, cluster_names, env_suffix
+from mesos_stats.sinks import FanOut, sink_from_url
 
 
 def str_to_bool(s):
@@ -24,6 +37,17 @@ def str_to_bool(s):
         raise ValueError
 
 
+def str_to_dict(s):
+    ''' Parses "a=1,b=2" into {'a': 1, 'b': 2} '''
+    res = {}
+    for item in s.split(','):
+        if not item:
+            continue
+        k, v = item.split('=')
+        res[k.strip()] = int(v)
+    return res
+
+
 def init_env():
     master_list = os.environ.get('MESOS_MASTER', '').split(',')
     carbon_host = os.environ.get('CARBON_HOST', None)
@@ -32,98 +56,340 @@ def init_env():
     singularity_host = os.environ.get('SINGULARITY_HOST', None)
     carbon_port = os.environ.get('CARBON_PORT', '2003')
     dry_run = os.environ.get('DRY_RUN', 'False')
+    dedup_heartbeat = os.environ.get('DEDUP_HEARTBEAT', '0')
+    series_registry = os.environ.get('SERIES_REGISTRY', 'False')
+    series_budgets = os.environ.get('SERIES_BUDGETS', '')
+    series_ttl = os.environ.get('SERIES_TTL', '86400')
+    series_fold = os.environ.get('SERIES_FOLD', 'True')
+    state_file = os.environ.get('STATE_FILE', None)
+    state_checkpoint = os.environ.get('STATE_CHECKPOINT_CYCLES', '10')
+    interval = os.environ.get('INTERVAL', '60')
+    overrun_policy = os.environ.get('OVERRUN_POLICY', 'skip')
+    tier_intervals = os.environ.get('TIER_INTERVALS', '')
+    stagger_spread = os.environ.get('STAGGER_SPREAD', '0')
+    agent_deadline = os.environ.get('AGENT_DEADLINE', '0')
+    stale_cycles = os.environ.get('STALE_CYCLES', '0')
+    load_shedding = os.environ.get('LOAD_SHEDDING', 'True')
+    output_sinks = os.environ.get('OUTPUT_SINKS', '')
+    sink_buffer = os.environ.get('SINK_BUFFER', '2000000')
+    clusters = cluster_names(os.environ.get('CLUSTERS', ''))
+    cluster_envs = {}
+    for name in clusters:
+        suffix = env_suffix(name)
+        cluster_envs[name] = (
+            os.environ.get('MESOS_MASTER' + suffix, ''),
+            os.environ.get('SINGULARITY_HOST' + suffix, None),
+            os.environ.get('GRAPHITE_PREFIX' + suffix, None))
+    shard_index = os.environ.get('MESOS_SHARD_INDEX', '0')
+    shard_count = os.environ.get('MESOS_SHARD_COUNT', '1')
+    collector_namespace = os.environ.get('COLLECTOR_NAMESPACE', None)
+    status_port = os.environ.get('STATUS_PORT', '0')
+    status_history = os.environ.get('STATUS_HISTORY', '20')
+    profile_dir = os.environ.get('PROFILE_DIR', None)
+    profile_cycles = os.environ.get('PROFILE_CYCLES', '0')
+    record_file = os.environ.get('RECORD_FILE', None)
+    record_cycles = os.environ.get('RECORD_CYCLES', '1')
+    replay_file = os.environ.get('REPLAY_FILE', None)
+    replay_latency_scale = os.environ.get('REPLAY_LATENCY_SCALE', '1.0')
+    memory_limit_mb = os.environ.get('MEMORY_LIMIT_MB', '0')
+    collector_processes = os.environ.get('COLLECTOR_PROCESSES', '1')
+    agent_metrics_source = os.environ.get('AGENT_METRICS_SOURCE', 'agent')
+    framework_task_metrics = os.environ.get('FRAMEWORK_TASK_METRICS', 'True')
+    cache_ttls = os.environ.get('CACHE_TTLS', '')
+    cache_memo = os.environ.get('CACHE_MEMO', 'True')
+    adaptive_requests = os.environ.get('ADAPTIVE_REQUESTS', 'False')
+    adaptive_timeout_min = os.environ.get('ADAPTIVE_TIMEOUT_MIN', '1')
+    adaptive_timeout_max = os.environ.get('ADAPTIVE_TIMEOUT_MAX', '60')
+    adaptive_max_concurrency = os.environ.get('ADAPTIVE_MAX_CONCURRENCY',
+                                              '50')
 
     dry_run = str_to_bool(dry_run)
     carbon_pickle = str_to_bool(carbon_pickle)
+    dedup_heartbeat = int(dedup_heartbeat)
+    series_registry = str_to_bool(series_registry)
+    series_budgets = str_to_dict(series_budgets)
+    series_ttl = int(series_ttl)
+    series_fold = str_to_bool(series_fold)
+    state_checkpoint = int(state_checkpoint)
+    interval = int(interval)
+    tier_intervals = str_to_dict(tier_intervals)
+    stagger_spread = float(stagger_spread)
+    agent_deadline = float(agent_deadline)
+    stale_cycles = int(stale_cycles)
+    load_shedding = str_to_bool(load_shedding)
+    output_sinks = [url.strip() for url in output_sinks.split(',')
+                    if url.strip()]
+    sink_buffer = int(sink_buffer)
+    status_port = int(status_port)
+    status_history = int(status_history)
+    profile_cycles = int(profile_cycles)
+    record_cycles = int(record_cycles)
+    replay_latency_scale = float(replay_latency_scale)
+    memory_limit_mb = float(memory_limit_mb)
+    collector_processes = int(collector_processes)
+    framework_task_metrics = str_to_bool(framework_task_metrics)
+    cache_ttls = str_to_dict(cache_ttls)
+    cache_memo = str_to_bool(cache_memo)
+    adaptive_requests = str_to_bool(adaptive_requests)
+    adaptive_timeout_min = float(adaptive_timeout_min)
+    adaptive_timeout_max = float(adaptive_timeout_max)
+    adaptive_max_concurrency = int(adaptive_max_concurrency)
+    shard_index = int(shard_index)
+    shard_count = int(shard_count)
+    # Replicas report on themselves under their own shard by default
+    if collector_namespace is None:
+        collector_namespace = 'collector'
+        if shard_count > 1:
+            collector_namespace += '.shard%s' % shard_index
+    # Only the first shard collects what isn't split by agent
+    tiers = TIERS if shard_index == 0 else ('agent', 'executor')
+    for name, (masters, host, prefix) in cluster_envs.items():
+        cluster_envs[name] = (masters.split(',') if masters else [], host,
+                              prefix or '%s.%s' % (graphite_prefix, name))
 
     def config_print():
         print("=" * 80)
         print("MESOS MASTERS:     %s" % master_list)
         print("CARBON:           %s" % carbon_host)
+        if output_sinks:
+            print("OUTPUT SINKS:     %s (buffer %s datapoints)" % (
+                ', '.join(output_sinks), sink_buffer))
         print("GRAPHITE PREFIX:  %s" % graphite_prefix)
         print("CARBON PICKLE:  %s" % carbon_pickle)
         print("SINGULARITY HOST: %s" % singularity_host)
+        for name in clusters:
+            print("CLUSTER %s:  %s, singularity %s, prefix %s" % (
+                name, *cluster_envs[name]))
         print("DRY RUN (TEST MODE): %s" % dry_run)
+        print("DEDUP HEARTBEAT:  %s" % dedup_heartbeat)
+        print("SERIES REGISTRY:  %s" % series_registry)
+        if series_registry:
+            print("SERIES BUDGETS:   %s" % series_budgets)
+            print("SERIES TTL:       %ss" % series_ttl)
+            print("SERIES FOLD:      %s" % series_fold)
+        print("INTERVAL:         %ss" % interval)
+        print("OVERRUN POLICY:   %s" % overrun_policy)
+        print("TIER INTERVALS:   %s" % tier_intervals)
+        print("STAGGER SPREAD:   %s" % stagger_spread)
+        print("AGENT DEADLINE:   %s" % (agent_deadline or 'none'))
+        print("STALE CYCLES:     %s" % stale_cycles)
+        print("LOAD SHEDDING:    %s" % load_shedding)
+        print("COLLECTOR PROCESSES: %s" % collector_processes)
+        print("AGENT METRICS SOURCE: %s" % agent_metrics_source)
+        print("FRAMEWORK TASK METRICS: %s" % framework_task_metrics)
+        print("CACHE TTLS:       %s" % cache_ttls)
+        print("CACHE MEMO:       %s" % cache_memo)
+        print("ADAPTIVE REQUESTS: %s" % adaptive_requests)
+        if adaptive_requests:
+            print("ADAPTIVE TIMEOUTS: %s-%ss" % (adaptive_timeout_min,
+                                                 adaptive_timeout_max))
+            print("ADAPTIVE MAX CONCURRENCY: %s" % adaptive_max_concurrency)
+        if shard_count > 1:
+            print("MESOS SHARD:      %s of %s (%s)" % (
+                shard_index, shard_count, ', '.join(tiers)))
+        print("COLLECTOR NAMESPACE: %s" % collector_namespace)
+        print("STATUS PORT:      %s" % (status_port or 'disabled'))
+        print("PROFILE DIR:      %s" % profile_dir)
+        if profile_dir:
+            print("PROFILE CYCLES:   %s" % profile_cycles)
+        if record_file:
+            print("RECORD FILE:      %s (%s cycles)" % (record_file,
+                                                        record_cycles))
+        if replay_file:
+            print("REPLAY FILE:      %s (latency x%s)" % (
+                replay_file, replay_latency_scale))
+        print("MEMORY LIMIT:     %s" % (
+            '%sMB' % memory_limit_mb if memory_limit_mb else 'none'))
+        print("STATE FILE:       %s" % state_file)
+        if state_file:
+            print("STATE CHECKPOINT: every %s cycles" % state_checkpoint)
         print("=" * 80)
 
-    if not all([master_list, carbon_host, graphite_prefix]):
+    if not all([master_list, carbon_host or output_sinks, graphite_prefix]):
         print('ERROR : One or more configuration env not set')
-        print('MESOS_MASTERS, CARBON, and GRAPHITE_PREFIX needs to be set')
+        print('MESOS_MASTERS, CARBON (or OUTPUT_SINKS), and GRAPHITE_PREFIX '
+              'needs to be set')
+        config_print()
+        sys.exit(0)
+
+    missing = [name for name in clusters if not cluster_envs[name][0]]
+    if missing:
+        print('ERROR : MESOS_MASTER_<CLUSTER> needs to be set for every '
+              'cluster in CLUSTERS, missing for %s' % ', '.join(missing))
+        config_print()
+        sys.exit(0)
+
+    if agent_deadline and agent_deadline <= stagger_spread:
+        print('ERROR : AGENT_DEADLINE needs to be after the STAGGER_SPREAD '
+              'window')
+        config_print()
+        sys.exit(0)
+
+    if not 0 <= shard_index < shard_count:
+        print('ERROR : MESOS_SHARD_INDEX needs to be between 0 and '
+              'MESOS_SHARD_COUNT - 1')
         config_print()
         sys.exit(0)
 
     config_print()
 
     assert(isinstance(master_list, list))
-    mesos = Mesos(master_list)
-    carbon = Carbon(carbon_host, graphite_prefix, port=int(carbon_port),
-                    pickle=carbon_pickle, dry_run=dry_run)
+    # Replaying and recording hook into try_get_json, so they go in before
+    # anything talks to Mesos or Singularity
+    if replay_file:
+        replayer = Replayer(replay_file, replay_latency_scale)
+        replayer.load()
+        replayer.install()
+    recorder = None
+    if record_file:
+        recorder = Recorder(record_file, record_cycles)
+        recorder.install()
+    controller = None
+    if adaptive_requests:
+        controller = RequestController(adaptive_timeout_min,
+                                       adaptive_timeout_max,
+                                       adaptive_max_concurrency)
+        controller.install()
+    cache = None
+    if cache_ttls or cache_memo:
+        cache = ResponseCache(cache_ttls, cache_memo)
+        cache.install()
+
+    # With a state snapshot to restore from, network discovery is deferred
+    # to the first cycle so start up doesn't block on the masters
+    discover = state_file is None
+    mesos = Mesos(master_list, discover=discover, shard=shard_index,
+                  shards=shard_count)
+    if output_sinks:
+        # Sinks are handed the queue in the pickle form, whatever their
+        # encoding
+        carbon = FanOut([sink_from_url(url, sink_buffer)
+                         for url in output_sinks], graphite_prefix, dry_run)
+        carbon_pickle = True
+    else:
+        carbon = Carbon(carbon_host, graphite_prefix, port=int(carbon_port),
+                        pickle=carbon_pickle, dry_run=dry_run)
 
+    singularity = None
     if singularity_host:
-        singularity = Singularity(singularity_host)
+        singularity = Singularity(singularity_host, update=discover)
 
-    return (mesos, carbon, singularity, carbon_pickle)
+    state = None
+    if state_file:
+        state = StateStore(state_file, state_checkpoint)
+        state.load()
+        state.register('mesos', mesos)
 
+    def make_filters(name=None):
+        '''
+            The queue filters of a cluster, their state is kept under the
+            cluster's name
+        '''
+        suffix = '.' + name if name else ''
+        # Filters run over the queue between the flushers and Carbon
+        filters = []
+        if series_registry:
+            registry = SeriesRegistry(series_budgets, series_ttl,
+                                      series_fold, carbon_pickle,
+                                      collector_namespace)
+            filters.append(registry)
+            if state:
+                state.register('registry' + suffix, registry)
+        if dedup_heartbeat > 0:
+            slowest = max(list(tier_intervals.values()) + [interval])
+            suppressor = ChangeSuppressor(dedup_heartbeat, carbon_pickle,
+                                          ttl=dedup_heartbeat * slowest,
+                                          namespace=collector_namespace)
+            filters.append(suppressor)
+            if state:
+                state.register('dedup' + suffix, suppressor)
+        return filters
 
-def wait_until_beginning_of_clock_minute():
-    iter_start = time.time()
-    now = datetime.fromtimestamp(iter_start)
-    sleep_time = 60.0 - ((now.microsecond/1000000.0) + now.second)
-    log("Sleeping for %ss" % sleep_time)
-    time.sleep(sleep_time)
+    filters = make_filters()
+    # Every other cluster gets its own Mesos, Singularity and filters
+    others = []
+    for name in clusters:
+        masters, host, prefix = cluster_envs[name]
+        other = Mesos(masters, discover=discover, shard=shard_index,
+                      shards=shard_count)
+        if state:
+            state.register('mesos.' + name, other)
+        others.append(Cluster(
+            name, other,
+            Singularity(host, update=discover) if host else None,
+            prefix, make_filters(name)))
 
+    scheduler = Scheduler(interval, overrun_policy)
 
-def main_loop(mesos, carbon, singularity, pickle):
-    should_exit = False
-    # self-monitoring
-    assert all([mesos, carbon])  # Mesos and Carbon is mandatory
+    instrumentation = Instrumentation(collector_namespace, carbon_pickle)
 
-    metrics_queue = queue.Queue()
-    if singularity:
-        singularity_carbon = SingularityCarbon(singularity, metrics_queue,
-                                               pickle)
-        mesos_carbon = MesosCarbon(mesos, metrics_queue, singularity, pickle)
-    else:
-        mesos_carbon = MesosCarbon(mesos, metrics_queue, pickle=pickle)
+    # Everything else main_loop needs
+    options = {
+        'filters': filters,
+        'state': state,
+        'scheduler': scheduler,
+        'tier_intervals': tier_intervals,
+        'stagger_spread': stagger_spread,
+        'instrumentation': instrumentation,
+        'status_port': status_port,
+        'status_history': status_history,
+        'profile_dir': profile_dir,
+        'profile_cycles': profile_cycles,
+        'recorder': recorder,
+        'memory_limit_mb': memory_limit_mb,
+        'processes': collector_processes,
+        'tiers': tiers,
+        'agent_source': agent_metrics_source,
+        'framework_tasks': framework_task_metrics,
+        'cache': cache,
+        'controller': controller,
+        'agent_deadline': agent_deadline,
+        'stale_cycles': stale_cycles,
+        'load_shedding': load_shedding,
+        'clusters': others,
+    }
+    return (mesos, carbon, singularity, carbon_pickle, options)
 
-    while True:
+
+def cycle_loop(group, sender, stop, exit_codes):
+    ''' Collects and sends the metrics of one tier group, forever '''
+    scheduler = group.scheduler
+    metrics_queue = group.queue
+    payloads = group.payloads
+    while not stop.is_set():
+        ok = False
         try:
-            wait_until_beginning_of_clock_minute()
-            with Timer("Entire collect and send cycle"):
-                timestamp = time.time()
+            timestamp = scheduler.wait()
+            cycle_timeout = scheduler.deadline(timestamp)
+            group.start_cycle(timestamp)
+
+            def send(final=True):
+                group.phase('send')
+                sender.send(metrics_queue, timestamp, cycle_timeout, final,
+                            payloads)
+
+            with Timer("Entire %s collect and send cycle" % group.name):
                 now = datetime.fromtimestamp(timestamp)
                 log("Timestamp: %s (%s)" % (now, timestamp))
-                cycle_timeout = timestamp + 59.0
-                if singularity:
-                    with Timer("Singularity metrics collection"):
-                        singularity.reset()
-                        singularity.update()
-                        singularity_carbon.flush_all()
-                if mesos:
-                    with Timer("Mesos metrics collection"):
-                        mesos.reset()
-                        mesos.update()
-                        mesos_carbon.flush_all()
-                if not metrics_queue:
+                group.collect(timestamp, send)
+                if metrics_queue.empty() and not payloads:
                     log("No stats this time; sleeping")
+                    ok = True
                     continue
-
-                send_timeout = cycle_timeout - time.time()
-                log("Sending stats (timeout %ss)" % send_timeout)
-                with Timer("Sending stats to graphite"):
-                    carbon.send_metrics(metrics_queue, send_timeout)
+                sender.report_scheduler(metrics_queue, timestamp, group.name,
+                                        scheduler)
+                if group.memory_guard:
+                    sender.report_memory(metrics_queue, timestamp, group.name,
+                                         group.memory_guard)
+                send()
+                ok = True
         except MesosStatsException as e:
             log("%s" % e)
         except RuntimeError as e:
             log("%s" % e)
-            should_exit = True
-            sys.exit(1)
-            break
-        except (KeyboardInterrupt, SystemExit):
-            print("Bye!")
-            should_exit = True
-            sys.exit(0)
-            break
+            exit_codes.append(1)
+            stop.set()
+            return
         except Exception as e:
             traceback.print_exc()
             log("Unhandled exception: %s" % e)
@@ -136,16 +402,136 @@ def main_loop(mesos, carbon, singularity, pickle):
         else:
             log("Metrics sent successfully.")
         finally:
-            if should_exit:
-                return
+            group.end_cycle(ok)
+
+
+def main_loop(mesos, carbon, singularity, pickle, filters=(), state=None,
+              scheduler=None, tier_intervals=None, stagger_spread=0,
+              instrumentation=None, status_port=None, status_history=20,
+              profile_dir=None, profile_cycles=0, recorder=None,
+              memory_limit_mb=0, processes=1, tiers=TIERS,
+              agent_source='agent', framework_tasks=True, cache=None,
+              controller=None, agent_deadline=0, stale_cycles=0,
+              load_shedding=True, clusters=()):
+    scheduler = scheduler or Scheduler()
+    # self-monitoring
+    assert all([mesos, carbon])  # Mesos and Carbon is mandatory
+
+    if instrumentation:
+        instrumentation.install()
+        if cache:
+            instrumentation.sources.append(cache.datapoints)
+        if controller:
+            instrumentation.sources.append(controller.datapoints)
+        if isinstance(carbon, FanOut):
+            instrumentation.sources.append(carbon.datapoints)
+    namespace = 'collector'
+    if instrumentation:
+        namespace = instrumentation.namespace
+
+    def shedder():
+        return LoadShedder(namespace, pickle) if load_shedding else None
+    sender = Sender(carbon, pickle, filters, state, instrumentation,
+                    shedder())
+    # Peak RSS of every cycle, and the ceiling agent polling backs off at
+    guard = MemoryGuard(memory_limit_mb)
+
+    def cluster_groups(mesos, singularity, name=None):
+        return TierGroup.from_config(tier_intervals or {}, scheduler, mesos,
+                                     singularity, pickle, stagger_spread,
+                                     instrumentation, guard, processes,
+                                     tiers, agent_source, framework_tasks,
+                                     agent_deadline, stale_cycles, name)
+    groups = [(g, sender) for g in cluster_groups(mesos, singularity)]
+    # Other clusters send through the same Carbon connection, one at a
+    # time, under their own prefix. The collector's own series go out
+    # with the first cluster's.
+    for cluster in clusters:
+        cluster_sender = Sender(carbon, pickle, cluster.filters, state,
+                                shedder=shedder(), prefix=cluster.prefix,
+                                lock=sender.lock)
+        groups += [(g, cluster_sender) for g in cluster_groups(
+            cluster.mesos, cluster.singularity, cluster.name)]
+    status = None
+    if status_port:
+        status = CycleStatus(carbon, status_history)
+        status.install()
+    profiler = None
+    if profile_dir:
+        profiler = CycleProfiler(profile_dir, profile_cycles or 1)
+        # kill -USR1 profiles the next cycle(s) of every group
+        signal.signal(signal.SIGUSR1, profiler.handle_signal)
+    for group, _ in groups:
+        if cache:
+            group.observers.append(cache)
+        if recorder:
+            group.observers.append(recorder)
+            recorder.add_group(group)
+        if profiler:
+            group.observers.append(profiler)
+            profiler.add_group(group)
+        if status:
+            group.observers.append(status)
+            status.add_group(group)
+        log("Collecting %s every %ss%s" % (
+            ', '.join(group.tiers), group.scheduler.interval,
+            ' from ' + group.cluster if group.cluster else ''))
+        if state and 'executor' in group.tiers:
+            name = 'mesos_carbon'
+            if group.cluster:
+                name += '.' + group.cluster
+            state.register(name, group.mesos_carbon)
+
+    # Worker processes are forked before any thread is started, so they
+    # can't inherit a lock one of them holds
+    for group, group_sender in groups:
+        if group.shard_pool:
+            group.shard_pool.start(group.mesos_carbon,
+                                   group_sender.encoding())
+    if isinstance(carbon, FanOut):
+        carbon.start()
+
+    # Every group runs on its own thread so a slow tier can't hold up the
+    # others, the main thread just waits for a fatal error or a signal
+    if profiler and profile_cycles:
+        profiler.request()
+    if cache:
+        cache.clear_memo()  # what start up fetched on this thread
+    stop = threading.Event()
+    exit_codes = []
+    if status:
+        StatusServer(status, status_port).start()
+    for group, group_sender in groups:
+        t = threading.Thread(target=cycle_loop, name=group.name, daemon=True,
+                             args=(group, group_sender, stop, exit_codes))
+        t.start()
+    try:
+        stop.wait()
+    except (KeyboardInterrupt, SystemExit):
+        print("Bye!")
+    finally:
+        if state:
+            # Group threads may be in the middle of a send, changing the
+            # filters' state. Give them a moment to get out of it.
+            stop.set()
+            locked = sender.lock.acquire(timeout=SAVE_TIMEOUT)
+            try:
+                state.save()
+            finally:
+                if locked:
+                    sender.lock.release()
+    sys.exit(max(exit_codes or [0]))
 
 
 if __name__ == '__main__':
-    (mesos, carbon, singularity, pickle) = init_env()
+    (mesos, carbon, singularity, pickle, options) = init_env()
+    # Docker stops containers with SIGTERM, exit the same way as on Ctrl-C
+    # so the state snapshot gets written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     start_time = time.time()
     print("Start time: %s" % datetime.fromtimestamp(start_time))
     try:
-        main_loop(mesos, carbon, singularity, pickle)
+        main_loop(mesos, carbon, singularity, pickle, **options)
     except (KeyboardInterrupt, SystemExit):
         print("Bye!")
         sys.exit(0)
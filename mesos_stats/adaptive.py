@@ -0,0 +1,106 @@
+import threading
+from collections import deque
+from . import util
+from .instrument import percentile
+
+WINDOW = 200  # latest latencies kept per endpoint
+MIN_SAMPLES = 20  # before its timeout is derived from them
+TIMEOUT_MULTIPLIER = 3  # times the endpoint's p99
+BACKOFF_LATENCY = 2.0  # back off when a round's p90 is this times the p50
+BACKOFF_ERRORS = 0.05  # or this fraction of its requests failed
+
+
+class RequestController:
+    '''
+        Adapts requests to how the cluster is answering. Every endpoint's
+        timeout is TIMEOUT_MULTIPLIER times the p99 of its latest
+        latencies, within [min_timeout, max_timeout]. Requests that fail
+        count at the time they took, so a master stuck in a leader
+        election gets longer timeouts rather than endless ones.
+
+        How many agents are polled at once is adjusted AIMD style: after
+        every round of `limit` agent requests the limit goes up by one,
+        or is halved when the round was slow or failing.
+    '''
+    def __init__(self, min_timeout=1.0, max_timeout=60.0,
+                 max_concurrency=50, min_concurrency=1, concurrency=10):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(min(max(concurrency, min_concurrency),
+                               max_concurrency))
+        self.lock = threading.Lock()
+        self.slot = threading.Condition(self.lock)
+        self.in_flight = 0
+        self.latencies = {}  # endpoint -> deque of seconds
+        self.agent_latencies = deque(maxlen=WINDOW)  # of every agent request
+        self.round = []  # (seconds, ok) of the agent requests this round
+        self.backoffs = 0
+
+    def install(self):
+        util.controller = self
+        util.request_observers.append(self.observe)
+
+    def uninstall(self):
+        util.controller = None
+        util.request_observers.remove(self.observe)
+
+    def timeout(self, endpoint):
+        with self.lock:
+            latencies = self.latencies.get(endpoint)
+            if not latencies or len(latencies) < MIN_SAMPLES:
+                return min(max(util.DEFAULT_TIMEOUT, self.min_timeout),
+                           self.max_timeout)
+            p99 = percentile(sorted(latencies), 99)
+        return min(max(p99 * TIMEOUT_MULTIPLIER, self.min_timeout),
+                   self.max_timeout)
+
+    def observe(self, endpoint, url, seconds, nbytes, ok):
+        with self.lock:
+            latencies = self.latencies.get(endpoint)
+            if latencies is None:
+                latencies = self.latencies[endpoint] = deque(maxlen=WINDOW)
+            latencies.append(seconds)
+            if endpoint.startswith('agent.'):
+                self.agent_latencies.append(seconds)
+                self.round.append((seconds, ok))
+                if len(self.round) >= self.limit:
+                    self._adjust()
+
+    def _adjust(self):
+        ''' Ends a round of agent requests, with the lock held '''
+        seconds = sorted(s for s, _ in self.round)
+        errors = sum(1 for _, ok in self.round if not ok)
+        slow = percentile(seconds, 90) > \
+            BACKOFF_LATENCY * percentile(sorted(self.agent_latencies), 50)
+        if slow or errors > BACKOFF_ERRORS * len(self.round):
+            self.limit = max(self.limit / 2, self.min_concurrency)
+            self.backoffs += 1
+        else:
+            self.limit = min(self.limit + 1, self.max_concurrency)
+            self.slot.notify_all()
+        self.round = []
+
+    def acquire(self):
+        ''' Waits for a slot to poll an agent in '''
+        with self.slot:
+            while self.in_flight >= int(self.limit):
+                self.slot.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.slot:
+            self.in_flight -= 1
+            self.slot.notify()
+
+    def datapoints(self):
+        ''' The current limits as [(path, value)] '''
+        with self.lock:
+            endpoints = sorted(self.latencies)
+            res = [('adaptive.concurrency', int(self.limit)),
+                   ('adaptive.backoffs', self.backoffs)]
+            self.backoffs = 0
+        res += [('adaptive.timeout.{}'.format(e), self.timeout(e))
+                for e in endpoints]
+        return res
@@ -0,0 +1,105 @@
+import time
+import threading
+from . import util
+
+# Responses bigger than this aren't memoised, holding e.g. /frameworks
+# for the rest of the cycle costs more than fetching it twice would
+MEMO_MAX_BYTES = 64 * 1024
+# Endpoints memoised whatever their size: the ones fetched more than once
+# a cycle
+MEMO_ENDPOINTS = ('master.slaves', 'master.metrics_snapshot',
+                  'singularity.slaves_decommissioned')
+
+
+class ResponseCache:
+    '''
+        Caches what try_get_json decodes, two ways:
+        - `ttls` maps endpoint names (e.g. master.slaves) to how many
+          seconds their responses are reused for, by every tier group
+        - with `memo`, a cycle reuses any small response it already got,
+          and any of MEMO_ENDPOINTS, until the cycle ends. The memo
+          belongs to the thread running the cycle, so groups never see
+          each other's.
+        Agent endpoints are never cached. invalidate() drops entries,
+        Mesos calls it when the leading master changes.
+
+        Hits are the very object that was cached, handed to every caller,
+        so what's fetched through try_get_json must not be changed.
+    '''
+    def __init__(self, ttls=None, memo=True):
+        self.ttls = ttls or {}
+        self.memo = memo
+        self.lock = threading.Lock()
+        self.entries = {}  # url -> (expiry, endpoint, response)
+        self.local = threading.local()
+        self.stats = {}  # endpoint -> [hits, misses]
+
+    def install(self):
+        util.cache = self
+
+    def uninstall(self):
+        util.cache = None
+
+    def _memo(self):
+        memo = getattr(self.local, 'memo', None)
+        if memo is None:
+            memo = self.local.memo = {}
+        return memo
+
+    def get(self, endpoint, url):
+        ''' The cached response for url, or None '''
+        if endpoint.startswith('agent.'):
+            return None
+        res = self._memo().get(url) if self.memo else None
+        if res is None and endpoint in self.ttls:
+            with self.lock:
+                entry = self.entries.get(url)
+            if entry and entry[0] > time.time():
+                res = entry[2]
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, [0, 0])
+            stats[0 if res is not None else 1] += 1
+        return res
+
+    def put(self, endpoint, url, res, nbytes):
+        if endpoint.startswith('agent.'):
+            return
+        if self.memo and (nbytes <= MEMO_MAX_BYTES or
+                          endpoint in MEMO_ENDPOINTS):
+            self._memo()[url] = res
+        ttl = self.ttls.get(endpoint)
+        if ttl:
+            with self.lock:
+                self.entries[url] = (time.time() + ttl, endpoint, res)
+
+    def invalidate(self, prefix=''):
+        ''' Drops the entries of every endpoint starting with prefix '''
+        with self.lock:
+            for url, (_, endpoint, _) in list(self.entries.items()):
+                if endpoint.startswith(prefix):
+                    del self.entries[url]
+        # only the calling cycle's memo, the others end soon enough
+        self.clear_memo()
+
+    def clear_memo(self):
+        ''' Forgets what the calling thread memoised '''
+        self._memo().clear()
+
+    def start_cycle(self, name, tick):
+        self.clear_memo()
+
+    def phase(self, name, phase):
+        pass
+
+    def end_cycle(self, name, ok=True):
+        self.clear_memo()
+
+    def datapoints(self):
+        ''' Hits and misses per endpoint since the last call '''
+        with self.lock:
+            stats, self.stats = self.stats, {}
+        res = []
+        for endpoint, (hits, misses) in sorted(stats.items()):
+            res += [('cache.{}.hits'.format(endpoint), hits),
+                    ('cache.{}.misses'.format(endpoint), misses)]
+        return res
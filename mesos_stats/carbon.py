@@ -1,12 +1,44 @@
 import socket
 import struct
-import pickle
+import pickle as _pickle
 import queue
 from mesos_stats.util import log
 
 CHUNK_SIZE = 500  # Maximum number of stats to send to Carbon in one go
 
 
+def format_metric(path, value, ts, pickle=False):
+    '''
+        Formats a datapoint the way it's queued for Carbon
+        The carbon plaintext protocol for metrics are
+        <metric path> <metric value> <metric timestamp>
+        The pickle protocol accepts a tuple
+        [(path, (timestamp, value)), ...]
+    '''
+    if pickle:
+        return (path, (ts, value))
+    return '{} {} {}'.format(path, value, ts)
+
+
+def parse_metric(metric, pickle=False):
+    ''' Splits a queued datapoint back into (path, value, timestamp) '''
+    if pickle:
+        return (metric[0], metric[1][1], metric[1][0])
+    path, value, ts = metric.split()
+    return (path, value, ts)
+
+
+def encode_metrics(metrics_list, pickle=False):
+    '''
+        What a list of queued datapoints is sent to Carbon as, a pickle
+        frame or plaintext lines
+    '''
+    if pickle:
+        payload = _pickle.dumps(metrics_list, protocol=2)
+        return struct.pack("!L", len(payload)) + payload
+    return ("\n".join(metrics_list) + '\n').encode()
+
+
 class Carbon:
     def __init__(self, host, prefix, pickle=False, port=2003,
                  pickle_port=2004, dry_run=False):
@@ -33,24 +65,32 @@ class Carbon:
             self.connect(port)
         elif self.port != port:
             self.close()
-            self.sock.connect(port)
+            self.connect(port)
 
     def close(self):
         if self.sock:
             self.sock.close()
             self.sock = None
 
-    def send_metrics(self, metrics, timeout):
+    def send_metrics(self, metrics, timeout, close=True, prefix=None):
+        '''
+            Sends everything in the queue, pass close=False to keep the
+            connection open for more sends to come and prefix to send
+            under another prefix than the connection's (e.g. another
+            cluster's).
+            Returns the number of datapoints and bytes sent
+        '''
         self.timeout = timeout
         iterations = 1
         total = 0
+        nbytes = 0
         while True:
-            chunk = self._get_chunk_from_queue(metrics, CHUNK_SIZE)
-            if not self.dry_run:
+            chunk = self._get_chunk_from_queue(metrics, CHUNK_SIZE, prefix)
+            if chunk and not self.dry_run:
                 if self.pickle:
-                    self.send_metrics_pickle(chunk)
+                    nbytes += self.send_metrics_pickle(chunk)
                 else:
-                    self.send_metrics_plaintext(chunk)
+                    nbytes += self.send_metrics_plaintext(chunk)
             iterations += 1
             total += len(chunk)
             if len(chunk) < CHUNK_SIZE:
@@ -58,29 +98,50 @@ class Carbon:
         if iterations != 1:
             log("INFO: Send took %s iterations" % iterations)
         log('Sent {} datapoints to Carbon'.format(total))
-        self.close()
+        if close:
+            self.close()
+        return (total, nbytes)
+
+    def send_payloads(self, payloads, timeout, close=True):
+        '''
+            Sends the Payloads encoded by worker processes as they are.
+            Returns the number of datapoints and bytes sent
+        '''
+        self.timeout = timeout
+        total = 0
+        nbytes = 0
+        for p in payloads:
+            if not self.dry_run:
+                nbytes += self.send_payload(p.data)
+            total += p.datapoints
+        log('Sent {} encoded datapoints to Carbon'.format(total))
+        if close:
+            self.close()
+        return (total, nbytes)
 
-    def _add_prefix(self, metric):
+    def _add_prefix(self, metric, prefix=None):
+        prefix = self.prefix if prefix is None else prefix
         if self.pickle:
-            return ('{}.{}'.format(self.prefix, metric[0]),
+            return ('{}.{}'.format(prefix, metric[0]),
                     (metric[1][0], metric[1][1]))
         else:
-            return '{}.{}'.format(self.prefix, metric)
+            return '{}.{}'.format(prefix, metric)
 
-    def _get_chunk_from_queue(self, q, n):
+    def _get_chunk_from_queue(self, q, n, prefix=None):
         '''
         returns list with n number of metrics from queue
         if queue has less than n metrics, it will return everything
         optionally adds a prefix to the metric name
         '''
+        prefix = self.prefix if prefix is None else prefix
         res = []
         while True:
             try:
                 m = q.get(block=False)
             except queue.Empty:
                 break
-            if self.prefix:
-                m = self._add_prefix(m)
+            if prefix:
+                m = self._add_prefix(m, prefix)
             res.append(m)
             if len(res) == n:
                 break
@@ -88,35 +149,32 @@ class Carbon:
 
     def send_metrics_plaintext(self, metrics_list):
         log('Sending {} metrics via Plaintext'.format(len(metrics_list)))
-        self.ensure_connected(self.port)
-
-        data = []
-        data = "\n".join(metrics_list) + '\n'
-        try:
-            sent = self.sock.sendall(data.encode())
-        except BrokenPipeError as e:
-            log('ERROR: Broken Pipe Error during send')
-            raise RuntimeError("BrokenPipe Error")
-        except socket.error as e:
-            # This will kill the task via a runtime error
-            # every time we get a socket error
-            log('ERROR: Socket  error during send')
-            raise RuntimeError("socket connection broken")
-        return sent
+        return self.send_payload(encode_metrics(metrics_list))
 
     def send_metrics_pickle(self, metrics_list):
         log('Send metrics via Pickle')
-        self.ensure_connected(self.pickle_port)
         assert(isinstance(metrics_list[0], tuple))
-        payload = pickle.dumps(metrics_list, protocol=2)
-        header = struct.pack("!L", len(payload))
-        message = header + payload
+        return self.send_payload(encode_metrics(metrics_list, True))
+
+    def send_payload(self, data):
+        '''
+            Writes already encoded datapoints to the connection, opening
+            it on the port of the encoding if needed. Returns the bytes sent
+        '''
+        self.ensure_connected(self.pickle_port if self.pickle else self.port)
         try:
-            sent = self.sock.send(message)
+            self.sock.sendall(data)
         except BrokenPipeError as e:
             log('ERROR: Broken Pipe Error during send')
             raise RuntimeError("BrokenPipe Error")
         except socket.error as e:
+            # This will kill the task via a runtime error
+            # every time we get a socket error
             log('ERROR: Socket  error during send')
             raise RuntimeError("socket connection broken")
-        return sent
+        return len(data)
+
+    def status(self):
+        ''' Where the datapoints go, for the status page '''
+        return {'host': self.host, 'port': self.port,
+                'connected': self.sock is not None}
@@ -0,0 +1,24 @@
+class Cluster:
+    '''
+        Another Mesos cluster collected by the same process: its masters,
+        its Singularity if any, the Graphite prefix its series go under and
+        the queue filters they go through. It gets tier groups of its own,
+        so a slow cluster doesn't hold up the others.
+    '''
+    def __init__(self, name, mesos, singularity=None, prefix=None,
+                 filters=()):
+        self.name = name
+        self.mesos = mesos
+        self.singularity = singularity
+        self.prefix = prefix
+        self.filters = filters
+
+
+def cluster_names(s):
+    ''' Parses "prod-b,prod-c" into ['prod-b', 'prod-c'] '''
+    return [name.strip() for name in s.split(',') if name.strip()]
+
+
+def env_suffix(name):
+    ''' What a cluster's environment variables end with, e.g. _PROD_B '''
+    return '_' + name.upper().replace('-', '_').replace('.', '_')
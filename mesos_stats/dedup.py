@@ -0,0 +1,90 @@
+from .util import log, drain_queue, refill_queue
+from .carbon import format_metric, parse_metric
+
+
+class ChangeSuppressor:
+    '''
+        Sits between the flushers and Carbon and drops datapoints whose value
+        hasn't changed since the series was last sent. Every series is
+        re-sent at least once every `heartbeat` cycles so gaps in whisper
+        stay bounded.
+
+        Cycles are counted per series, so series collected at different
+        rates each get their own heartbeat. Series that haven't been seen
+        for `ttl` seconds are forgotten.
+    '''
+    def __init__(self, heartbeat, pickle=False, ttl=None,
+                 namespace='collector'):
+        self.heartbeat = heartbeat
+        self.namespace = namespace
+        self.pickle = pickle
+        self.ttl = ttl or heartbeat * 60
+        self.last_expire = None
+        # path -> (value, times suppressed since last sent, last seen)
+        self.last_sent = {}
+        self.suppressed = 0
+        self.sent = 0
+
+    def dump_state(self):
+        return {'last_sent': [[path] + list(v)
+                              for path, v in self.last_sent.items()]}
+
+    def load_state(self, state):
+        self.last_sent = {e[0]: tuple(e[1:])
+                          for e in state.get('last_sent', [])}
+
+    def filter(self, metrics, timestamp):
+        ''' Drains the queue and puts back only the datapoints to send '''
+        now = int(timestamp)
+        kept = []
+        suppressed = 0
+        for m in drain_queue(metrics):
+            path, value, _ = parse_metric(m, self.pickle)
+            last = self.last_sent.get(path)
+            if last is not None and last[0] == value and \
+                    last[1] < self.heartbeat - 1:
+                self.last_sent[path] = (value, last[1] + 1, now)
+                suppressed += 1
+                continue
+            self.last_sent[path] = (value, 0, now)
+            kept.append(m)
+        refill_queue(metrics, kept)
+        self._expire(now)
+        self.suppressed += suppressed
+        self.sent += len(kept)
+
+    def forget(self, metrics, timestamp):
+        '''
+            Forgets having sent datapoints that were let through but never
+            made it to Carbon, their series are sent again next time
+        '''
+        for m in metrics:
+            path = parse_metric(m, self.pickle)[0]
+            last = self.last_sent.get(path)
+            if last is not None and last[1] == 0:
+                del self.last_sent[path]
+                self.sent -= 1
+
+    def report(self, metrics, timestamp):
+        ''' Queues the suppression stats since the last report '''
+        total = self.sent + self.suppressed
+        ratio = 100.0 * self.suppressed / total if total else 0.0
+        log('Suppressed {} of {} unchanged datapoints'
+            .format(self.suppressed, total))
+        for name, value in [('suppressed', self.suppressed),
+                            ('sent', self.sent),
+                            ('percent', ratio)]:
+            metrics.put(format_metric(self.namespace + '.dedup.' + name,
+                                      value, int(timestamp), self.pickle))
+        self.suppressed = self.sent = 0
+
+    def _expire(self, now):
+        ''' Forget series that stopped reporting so the table can't grow '''
+        if self.last_expire is None:
+            self.last_expire = now
+        if now - self.last_expire < self.ttl:
+            return
+        self.last_expire = now
+        cutoff = now - self.ttl
+        self.last_sent = {k: v for k, v in self.last_sent.items()
+                          if v[2] > cutoff}
@@ -0,0 +1,127 @@
+import time
+import threading
+from . import util
+from .carbon import format_metric
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(ordered, p):
+    ''' Nearest-rank percentile of an already sorted list '''
+    if not ordered:
+        return 0.0
+    rank = max(int(round(p / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Instrumentation:
+    '''
+        Collects stats about the collector itself: request latencies and
+        bytes received per endpoint, agent successes and failures, flusher
+        datapoint counts and durations, queue high-water mark and send
+        throughput. report() queues everything gathered since the last
+        report under the `namespace` prefix (e.g. collector.*) so it goes
+        out with the regular datapoints.
+    '''
+    def __init__(self, namespace='collector', pickle=False):
+        self.namespace = namespace
+        self.pickle = pickle
+        self.lock = threading.Lock()
+        # callables returning more [(path, value)] to report, e.g. the
+        # response cache's hits and misses
+        self.sources = []
+        self._reset()
+
+    def _reset(self):
+        self.requests = {}  # endpoint -> [latencies, bytes, errors]
+        self.agents = {'ok': 0, 'failed': 0}
+        self.flushers = {}  # name -> [datapoints, seconds]
+        self.queue_hwm = 0
+        self.sent = [0, 0, 0.0]  # datapoints, bytes, seconds
+
+    def install(self):
+        ''' Starts observing every request made through try_get_json '''
+        util.request_observers.append(self.observe_request)
+
+    def uninstall(self):
+        util.request_observers.remove(self.observe_request)
+
+    def observe_request(self, endpoint, url, seconds, nbytes, ok):
+        with self.lock:
+            stats = self.requests.setdefault(endpoint, [[], 0, 0])
+            stats[0].append(seconds)
+            stats[1] += nbytes
+            if not ok:
+                stats[2] += 1
+            if endpoint.startswith('agent.'):
+                self.agents['ok' if ok else 'failed'] += 1
+
+    def observe_flush(self, name, datapoints, seconds):
+        with self.lock:
+            stats = self.flushers.setdefault(name, [0, 0.0])
+            stats[0] += datapoints
+            stats[1] += seconds
+
+    def observe_queue(self, q):
+        depth = q.qsize()
+        with self.lock:
+            self.queue_hwm = max(self.queue_hwm, depth)
+
+    def observe_send(self, datapoints, nbytes, seconds):
+        with self.lock:
+            self.sent[0] += datapoints
+            self.sent[1] += nbytes
+            self.sent[2] += seconds
+
+    def flush(self, name, q, fn, *args):
+        '''
+            Runs flusher fn(*args), recording how many datapoints it queued
+            and how long it took
+        '''
+        n = q.qsize()
+        t = time.time()
+        res = fn(*args)
+        self.observe_flush(name, q.qsize() - n, time.time() - t)
+        return res
+
+    def datapoints(self):
+        ''' Everything gathered since the last call as [(path, value)] '''
+        with self.lock:
+            requests, agents = self.requests, self.agents
+            flushers, queue_hwm, sent = self.flushers, self.queue_hwm, \
+                self.sent
+            self._reset()
+
+        res = []
+        for endpoint, (latencies, nbytes, errors) in requests.items():
+            path = 'http.{}.'.format(endpoint)
+            latencies.sort()
+            res += [(path + 'count', len(latencies)),
+                    (path + 'errors', errors),
+                    (path + 'bytes', nbytes),
+                    (path + 'latency.max', latencies[-1])]
+            res += [(path + 'latency.p{}'.format(p), percentile(latencies, p))
+                    for p in PERCENTILES]
+        res.append(('http.bytes', sum(r[1] for r in requests.values())))
+        res += [('agents.ok', agents['ok']),
+                ('agents.failed', agents['failed'])]
+        for name, (datapoints, seconds) in flushers.items():
+            res += [('flush.{}.datapoints'.format(name), datapoints),
+                    ('flush.{}.seconds'.format(name), seconds)]
+        res.append(('queue.high_water_mark', queue_hwm))
+        datapoints, nbytes, seconds = sent
+        res += [('send.datapoints', datapoints),
+                ('send.bytes', nbytes),
+                ('send.seconds', seconds),
+                ('send.datapoints_per_second',
+                 datapoints / seconds if seconds else 0.0)]
+        for source in self.sources:
+            res += source()
+        return res
+
+    def report(self, metrics, timestamp):
+        ''' Queues everything gathered since the last report '''
+        ts = int(timestamp)
+        for path, value in self.datapoints():
+            metrics.put(format_metric(self.namespace + '.' + path, value, ts,
+                                      self.pickle))
@@ -0,0 +1,86 @@
+import sys
+import resource
+from .util import log
+
+MB = 1024.0 * 1024.0
+PAGE_SIZE = resource.getpagesize()
+LOW_WATER = 0.9  # of the ceiling RSS has to fall under to stop holding back
+HELD_QUEUE = 10000  # datapoints collection queues at most while held back
+
+
+def peak_rss_mb():
+    ''' Peak resident memory of the process since it started '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # bytes there, KiB elsewhere
+        return rss / MB
+    return rss / 1024.0
+
+
+def rss_mb():
+    ''' Current resident memory, or the peak where that isn't available '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / MB
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+
+
+class MemoryGuard:
+    '''
+        Samples the resident memory while the tier groups collect, keeping
+        the peak of every group's cycle. With a `limit_mb` ceiling, over()
+        tells the collection loop to stop fetching until what has been
+        queued so far is sent.
+
+        CPython doesn't always give freed memory back to the OS, so the
+        RSS can stay over the ceiling long after the queue was sent. Once
+        over it, collection is held back until the RSS falls under
+        LOW_WATER of the ceiling, and meanwhile the queue is sent whenever
+        `held_queue` datapoints are waiting rather than after every agent.
+    '''
+    def __init__(self, limit_mb=0, held_queue=HELD_QUEUE):
+        self.limit_mb = limit_mb
+        self.held_queue = held_queue
+        self.held = False
+        self.peaks = {}  # group name -> peak RSS seen during its cycle
+        self.pauses = {}  # group name -> times collection was held back
+
+    def sample(self, name):
+        rss = rss_mb()
+        if rss > self.peaks.get(name, 0):
+            self.peaks[name] = rss
+        return rss
+
+    def over(self, name, queued=0):
+        '''
+            True when collection is held back and `queued` datapoints are
+            enough to be sent
+        '''
+        if not self.limit_mb:
+            return False
+        rss = self.sample(name)
+        if rss > self.limit_mb:
+            self.held = True
+        elif rss < self.limit_mb * LOW_WATER:
+            self.held = False
+        return self.held and queued >= self.held_queue
+
+    def pause(self, name):
+        self.pauses[name] = self.pauses.get(name, 0) + 1
+
+    def start_cycle(self, name, tick):
+        self.peaks[name] = 0
+        self.pauses[name] = 0
+        self.sample(name)
+
+    def phase(self, name, phase):
+        self.sample(name)
+
+    def end_cycle(self, name, ok=True):
+        if name not in self.peaks:
+            return
+        self.sample(name)
+        log('Peak RSS during the {} cycle: {:.1f}MB{}'.format(
+            name, self.peaks[name],
+            ', held back {} times'.format(self.pauses[name])
+            if self.pauses.get(name) else ''))
@@ -1,23 +1,115 @@
 import time
 import re
+import queue
+import zlib
+import hashlib
+import threading
 import requests
 from concurrent import futures
+from . import util
 from .util import log, try_get_json
+from .carbon import format_metric
 
 POOL_SIZE = 10  # Number of parallel threads to query Mesos
+# Agent responses fetched but not yet consumed by poll_slaves' caller
+MAX_PENDING = 2 * POOL_SIZE
+
+
+class InFlight:
+    ''' Counts the agent requests under way, for the status page '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def add(self, n):
+        with self.lock:
+            self.count += n
+
+
+agent_requests = InFlight()
+
+
+# The executor statistics that are flushed, in the order ExecutorRecord
+# keeps their values
+EXECUTOR_STATS = ('cpus_system_time_secs', 'cpus_user_time_secs',
+                  'cpus_limit', 'mem_limit_bytes', 'mem_rss_bytes')
+
+
+class ExecutorRecord:
+    '''
+        What's kept of an executor from /monitor/statistics.json: its ids,
+        its name cleaned up for metric paths and the values of
+        EXECUTOR_STATS, None where the agent didn't report one
+    '''
+    __slots__ = ('executor_id', 'framework_id', 'name', 'values')
+
+    def __init__(self, executor_id, framework_id, values):
+        self.executor_id = executor_id
+        self.framework_id = framework_id
+        self.name = executor_id.replace('.', '_').replace(' ', '_')
+        self.values = values
+
+
+def parse_executors(executors):
+    '''
+        Turns the executors of an agent's /monitor/statistics.json into
+        ExecutorRecords so the decoded JSON can be dropped. Records, and
+        falsy responses, are returned as they are.
+    '''
+    if not executors or isinstance(executors[0], ExecutorRecord):
+        return executors
+    res = []
+    for e in executors:
+        stats = e['statistics']
+        res.append(ExecutorRecord(e['executor_id'], e['framework_id'],
+                                  tuple(stats.get(k)
+                                        for k in EXECUTOR_STATS)))
+    return res
+
+
+def stagger_offset(key, window):
+    ''' Stable offset in [0, window) seconds derived from key '''
+    return (zlib.crc32(key.encode()) % 10000) / 10000.0 * window
+
+
+def shard_of(key, count):
+    '''
+        Which of `count` shards owns key, by rendezvous hashing: every
+        shard scores the key and the highest score wins. Keys coming and
+        going don't move any others, adding a shard only moves the keys
+        it now wins, about 1/count of them.
+    '''
+    if count <= 1:
+        return 0
+    return max(range(count), key=lambda i: hashlib.md5(
+        '{}/{}'.format(key, i).encode()).digest())
 
 
 class Mesos:
     '''
-        Mesos class to retrieve and store metrics
+        Mesos class to retrieve and store metrics. With more than one
+        of `shards`, only the agents owned by shard `shard` are kept.
     '''
-    def __init__(self, master_list):
+    def __init__(self, master_list, discover=True, shard=0, shards=1):
         self.master_list = master_list
-        self.master = self._get_master()
-        self.slaves = try_get_json("http://%s/slaves" % self.master)\
-            .get('slaves', None)
+        self.shard = shard
+        self.shards = shards
+        self.master = None
+        self.slaves = None
         self.slave_metrics = {}
         self.executors = []
+        # Discovery can be deferred to the first update, e.g. when the
+        # master and roster have been restored from a state snapshot
+        if discover:
+            self.master = self._get_master()
+            self.slaves = self._get_slaves()
+
+    def dump_state(self):
+        return {'master': self.master, 'slaves': self.slaves}
+
+    def load_state(self, state):
+        self.master = state.get('master')
+        self.slaves = state.get('slaves')
 
     def _get_master(self):
         ''' Get a working master hostname '''
@@ -25,11 +117,15 @@ class Mesos:
             # Let's test each master host in turn to get a working one
             try:
                 url = "http://{}/metrics/snapshot".format(master)
-                res = try_get_json(url)
+                res = try_get_json(url, endpoint='master.metrics_snapshot')
                 try:
                     if res['master/elected']:
+                        if self.master not in (None, master) and \
+                                util.cache is not None:
+                            # what the old leader said is out of date
+                            util.cache.invalidate('master.')
                         return master
-                except KeyError:
+                except (KeyError, TypeError):
                     pass
             except requests.exceptions.RequestException as e:
                 print(str(e))
@@ -37,30 +133,95 @@ class Mesos:
         else:  # We've failed to reach all masters, quit.
             raise MesosStatsException('Unable to reach Mesos Masters')
 
-    def update(self):
-        ''' Retrieves slave and master metrics '''
-        self.cluster_metrics = self._get_cluster_metrics()
+    def update(self, timestamp=None):
+        '''
+            Retrieves slave and master metrics, timestamp is the scheduled
+            time of the cycle and is what the datapoints get stamped with
+        '''
+        self.update_cluster()
+        self.update_frameworks()
+        self.update_slaves()
+        self.update_ts = int(timestamp or time.time())
+        if self.slaves:
+            self.update_slave_metrics()
+            self.update_executors()
+
+    def update_cluster(self):
+        ''' Retrieves master metrics, following the leader if it moved '''
+        if self.master is None:
+            self.master = self._get_master()
+        try:
+            self.cluster_metrics = self._get_cluster_metrics()
+        except requests.exceptions.RequestException:
+            self.cluster_metrics = {}
         # Let's make sure we are still connected to the master
-        if not self.cluster_metrics['master/elected']:
-            self._get_master()
+        if not (self.cluster_metrics and
+                self.cluster_metrics.get('master/elected')):
+            self.master = self._get_master()
             self.cluster_metrics = self._get_cluster_metrics()
 
-        self.framework_metrics = self._get_framework_metrics()
-
-        self.slaves = try_get_json("http://%s/slaves" % self.master)\
-            .get('slaves', None)
-        self.update_ts = int(time.time())
-        if self.slaves:
-            self.slave_metrics = self._get_slave_metrics()
-            self.executors = self._get_executors()
-            log('Total number of executors = {}'.format(sum(len(e)
-                for e in self.executors)))
+    def update_frameworks(self, tasks=True):
+        '''
+            Retrieves the frameworks, with their tasks only when `tasks`
+            is set: /frameworks embeds every task, /state-summary just has
+            the framework totals
+        '''
+        if self.master is None:
+            self.master = self._get_master()
+        if tasks:
+            self.framework_metrics = self._get_framework_metrics()
+        else:
+            self.framework_metrics = self._get_framework_summary()
+
+    def update_slaves(self):
+        ''' Refreshes the agent roster '''
+        if self.master is None:
+            self.master = self._get_master()
+        try:
+            self.slaves = self._get_slaves()
+        except requests.exceptions.RequestException:
+            # Shards without the cluster tier don't follow the leader
+            # otherwise
+            self.master = self._get_master()
+            self.slaves = self._get_slaves()
+
+    def _get_slaves(self):
+        res = try_get_json("http://%s/slaves" % self.master,
+                           endpoint='master.slaves')
+        if not res:
+            raise requests.exceptions.RequestException(
+                'Unable to list agents from %s' % self.master)
+        slaves = res.get('slaves', None)
+        if slaves and self.shards > 1:
+            total = len(slaves)
+            slaves = [s for s in slaves
+                      if shard_of(s.get('id') or s['hostname'],
+                                  self.shards) == self.shard]
+            log('{} of {} agents in shard {}/{}'.format(
+                len(slaves), total, self.shard, self.shards))
+        return slaves
+
+    def update_slave_metrics(self):
+        self.slave_metrics = self._get_slave_metrics()
+
+    def update_executors(self):
+        self.executors = self._get_executors()
+        log('Total number of executors = {}'.format(sum(len(e or ())
+            for e in self.executors.values())))
 
     def _get_framework_metrics(self):
-        return try_get_json("http://{}/frameworks".format(self.master))
+        return try_get_json("http://{}/frameworks".format(self.master),
+                            endpoint='master.frameworks')
+
+    def _get_framework_summary(self):
+        res = try_get_json("http://{}/state-summary".format(self.master),
+                           endpoint='master.state_summary')
+        # the agents are in there too, only the frameworks are kept
+        return {'frameworks': res['frameworks']} if res else res
 
     def _get_cluster_metrics(self):
-        return try_get_json("http://{}/metrics/snapshot".format(self.master))
+        return try_get_json("http://{}/metrics/snapshot".format(self.master),
+                            endpoint='master.metrics_snapshot')
 
     def _get_slave_metrics(self):
         if not self.slaves:
@@ -68,7 +229,8 @@ class Mesos:
 
         def task(slave):
             metric = try_get_json("http://{}:{}/metrics/snapshot"
-                                  .format(slave['hostname'], slave['port']))
+                                  .format(slave['hostname'], slave['port']),
+                                  endpoint='agent.metrics_snapshot')
             return(slave.get('hostname'), metric)
 
         ex = futures.ThreadPoolExecutor(max_workers=POOL_SIZE)
@@ -81,13 +243,101 @@ class Mesos:
 
         def task(slave):
             executors = try_get_json("http://{}:{}/monitor/statistics.json"
-                                     .format(slave['hostname'], slave['port']))
+                                     .format(slave['hostname'], slave['port']),
+                                     endpoint='agent.statistics')
             return(slave.get('hostname'), executors)
 
         ex = futures.ThreadPoolExecutor(max_workers=POOL_SIZE)
         results = ex.map(task, self.slaves)
         return {r[0]: r[1] for r in results}
 
+    def poll_slaves(self, start, window, metrics=True, executors=True,
+                    deadline=None, on_sample=None, slaves=None):
+        '''
+            Polls every agent at its own stable offset within `window`
+            seconds of `start` rather than all at once, and yields
+            (hostname, metrics, executors) as each agent answers.
+            Agents that can't be reached yield None.
+
+            Agents that haven't answered by `deadline` are given up on,
+            the polls already under way finish in the background.
+            on_sample(hostname, metrics, executors) is called from the
+            poll threads as every agent answers, before or after then.
+
+            At most MAX_PENDING responses are held at once, fetching
+            stops while the caller is busy with the ones it was handed.
+            With a RequestController, it decides how many agents are
+            polled at once.
+
+            `slaves` is the roster to poll, the latest one by default. It's
+            taken once, update_slaves() may replace it meanwhile.
+        '''
+        if slaves is None:
+            slaves = self.slaves
+        controller = util.controller
+        workers = controller.max_concurrency if controller else POOL_SIZE
+        pending = threading.Semaphore(max(MAX_PENDING, 2 * workers))
+        closed = threading.Event()
+
+        def task(slave, offset):
+            delay = start + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            pending.acquire()
+            res = [slave.get('hostname'), None, None]
+            if closed.is_set():
+                return tuple(res)
+            base = "http://{}:{}".format(slave['hostname'], slave['port'])
+            if controller:
+                controller.acquire()
+            agent_requests.add(1)
+            try:
+                if metrics:
+                    res[1] = try_get_json(base + "/metrics/snapshot",
+                                          endpoint='agent.metrics_snapshot')
+                if executors:
+                    res[2] = parse_executors(try_get_json(
+                        base + "/monitor/statistics.json",
+                        endpoint='agent.statistics'))
+            except requests.exceptions.RequestException:
+                pass
+            finally:
+                agent_requests.add(-1)
+                if controller:
+                    controller.release()
+            if on_sample and (res[1] or res[2]):
+                on_sample(*res)
+            return tuple(res)
+
+        # Workers pick up agents in offset order, so they never sleep on
+        # an agent while an earlier one is waiting
+        schedule = sorted(
+            (stagger_offset(s.get('id') or s['hostname'], window), i)
+            for i, s in enumerate(slaves))
+        ex = futures.ThreadPoolExecutor(max_workers=workers)
+        fs = set(ex.submit(task, slaves[i], offset)
+                 for offset, i in schedule)
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - time.time(), 0)
+        try:
+            for f in futures.as_completed(fs, timeout):
+                # forget the future so its response can be freed once
+                # the caller is done with it
+                fs.discard(f)
+                yield f.result()
+                pending.release()
+        except futures.TimeoutError:
+            log('{} agents missed the deadline'.format(len(fs)))
+        finally:
+            # let blocked workers run out if the caller stopped early
+            closed.set()
+            for f in fs:
+                f.cancel()
+            for _ in range(workers):
+                pending.release()
+            ex.shutdown(wait=False)
+
     def reset(self):
         self.cluster_metrics = {}
         self.slaves = {}
@@ -146,6 +396,13 @@ class MesosCarbon:
         "system/mem_total_bytes":   "slave.{}.system.mem.total.bytes",
     }
 
+    # Agent series the master's /slaves has too, under resources and
+    # used_resources
+    master_resources = ('cpus', 'mem', 'disk')
+    master_resource_keys = frozenset(
+        'slave/{}_{}'.format(r, k) for r in master_resources
+        for k in ('total', 'used', 'percent'))
+
     eprefix = "slave.{}.executors.singularity.tasks.{}"
     executor_metric_mapping = {
         "cpus_system_time_secs": eprefix + ".cpus.system_time_secs",
@@ -155,6 +412,17 @@ class MesosCarbon:
         "mem_rss_bytes":         eprefix + ".mem.rss_bytes",
     }
 
+    # Used by send_alternate_executor_metrics, same as above but without
+    # the slave name in the path
+    aprefix = "tasks.{}"
+    alt_executor_metric_mapping = {
+        "cpus_system_time_secs": aprefix + ".cpus.system_time_secs",
+        "cpus_user_time_secs":   aprefix + ".cpus.user_time_secs",
+        "cpus_limit":            aprefix + ".cpus.limit",
+        "mem_limit_bytes":       aprefix + ".mem.limit_bytes",
+        "mem_rss_bytes":         aprefix + ".mem.rss_bytes",
+    }
+
     framework_metric_mapping = {
         "disk": "frameworks.{}.resources.disk",
         "mem":  "frameworks.{}.resources.mem",
@@ -172,6 +440,19 @@ class MesosCarbon:
         self.pickle = pickle
         self.queue = queue
         self.singularity = singularity
+        self.task_names = {}  # executor id -> resolved task name
+        # Skip the series flush_slave_resources covers when flushing what
+        # the agents report
+        self.resources_from_master = False
+        # Timestamp for the datapoints, defaults to the one of the last
+        # Mesos.update when not set
+        self.update_ts = None
+
+    def dump_state(self):
+        return {'task_names': self.task_names}
+
+    def load_state(self, state):
+        self.task_names = state.get('task_names', {})
 
     def _convert(self, metric_name, value):
         ''' We use this to clean up or do any custom conversions '''
@@ -184,8 +465,9 @@ class MesosCarbon:
         self.flush_cluster_metrics()
         self.flush_slave_metrics()
         if self.singularity:
-            self.send_alternate_executor_metrics()
-        self.flush_executor_metrics()
+            self.flush_all_executors()
+        else:
+            self.flush_executor_metrics()
         self.flush_framework_metrics()
         self.flush_framework_task_metrics()
 
@@ -196,18 +478,73 @@ class MesosCarbon:
     def flush_slave_metrics(self):
         counter = 0
         for slave_name, metrics in self.mesos.slave_metrics.items():
-            for k, v in metrics.items():
-                slave_name = self._clean_metric_name(slave_name)
+            counter += self.flush_slave(slave_name, metrics)
+        log('flushed {} slave metrics'.format(counter))
+        self.mesos.slave_metrics = None
+
+    def flush_slave(self, slave_name, metrics):
+        ''' Flushes the metrics of one agent, returns how many were queued '''
+        if not metrics:
+            return 0
+        counter = 0
+        slave_name = self._clean_metric_name(slave_name)
+        skip = self.master_resource_keys if self.resources_from_master \
+            else ()
+        for k, v in metrics.items():
+            try:
+                metric_name = self.slave_metric_mapping[k]\
+                                .format(slave_name)
+            except KeyError:  # Skip metrics that are not defined above
+                continue
+            if k in skip:
+                continue
+            (metric_name, v) = self._convert(metric_name, v)
+            self._add_to_queue(metric_name, v)
+            counter += 1
+        return counter
+
+    def flush_slave_stale(self, slave_name, age):
+        ''' Marks an agent's samples as `age` cycles old '''
+        self._add_to_queue('slave.{}.stale'.format(
+            self._clean_metric_name(slave_name)), age)
+
+    def slave_resources(self, slave):
+        '''
+            The resource metrics of an agent from its entry in the master's
+            /slaves, named as the agent's /metrics/snapshot names them
+        '''
+        total = slave.get('resources') or {}
+        used = slave.get('used_resources') or {}
+        res = {}
+        for r in self.master_resources:
+            if r not in total:
+                continue
+            res['slave/{}_total'.format(r)] = total[r]
+            res['slave/{}_used'.format(r)] = used.get(r, 0)
+            res['slave/{}_percent'.format(r)] = \
+                used.get(r, 0) / total[r] if total[r] else 0.0
+        return res
+
+    def flush_slave_resources(self, slaves):
+        '''
+            Flushes the resource metrics of every agent in the master's
+            /slaves, returns how many were queued
+        '''
+        counter = 0
+        for slave in slaves:
+            # not through flush_slave, it skips these with
+            # resources_from_master set
+            slave_name = self._clean_metric_name(slave['hostname'])
+            for k, v in self.slave_resources(slave).items():
                 try:
                     metric_name = self.slave_metric_mapping[k]\
                                     .format(slave_name)
-                except KeyError:  # Skip metrics that are not defined above
+                except KeyError:
                     continue
                 (metric_name, v) = self._convert(metric_name, v)
                 self._add_to_queue(metric_name, v)
                 counter += 1
-        log('flushed {} slave metrics'.format(counter))
-        self.mesos.slave_metrics = None
+        return counter
 
     def flush_cluster_metrics(self):
         counter = 0
@@ -225,20 +562,81 @@ class MesosCarbon:
     def flush_executor_metrics(self):
         counter = 0
         for slave_name, executors in self.mesos.executors.items():
-            for e in executors:
-                for k, v in e['statistics'].items():
-                    task_name = self._clean_metric_name(e['executor_id'])
-                    sn = self._clean_metric_name(slave_name)
-                    try:
-                        metric_name = self.executor_metric_mapping[k]\
-                                .format(sn, task_name)
-                    except KeyError:
-                        continue
-                    self._add_to_queue(metric_name, v)
-                counter += 1
+            counter += self.flush_slave_executors(slave_name, executors)
         log('flushed {} executor metrics'.format(counter))
         self.mesos.executor_metrics = None
 
+    def flush_slave_executors(self, slave_name, executors):
+        ''' Flushes the executors of one agent, returns how many there were '''
+        return self.flush_executors(slave_name, executors)
+
+    def flush_executors(self, slave_name, executors, sing_lookup=None,
+                        task_names=None):
+        '''
+            Flushes the executors of one agent in a single pass, under the
+            agent (executor_metric_mapping) and, given a Singularity
+            lookup, under their task names too (alt_executor_metric_mapping,
+            see send_alternate_executor_metrics) with the task names
+            resolved along the way added to task_names.
+            Returns how many executors there were
+        '''
+        executors = parse_executors(executors)
+        if not executors:
+            return 0
+        by_slave = slave_name is not None
+        if by_slave:
+            sn = self._clean_metric_name(slave_name)
+        by_task = sing_lookup is not None
+        slave_paths, task_paths = self._executor_paths()
+        ts = self.update_ts or self.mesos.update_ts
+        pickle = self.pickle
+        known = self.task_names
+        batch = []
+        add = batch.append
+        for e in executors:
+            if by_slave:
+                base = self.eprefix.format(sn, e.name)
+                for suffix, v in zip(slave_paths, e.values):
+                    if v is not None:
+                        add(format_metric(base + suffix, v, ts, pickle))
+            if by_task:
+                task_name = known.get(e.executor_id)
+                if task_name is None:
+                    task_name, guessed = self._resolve_task_name(
+                        e, sing_lookup)
+                    # guesses are made again until Singularity knows the
+                    # task
+                    if not guessed:
+                        task_names[e.executor_id] = task_name
+                else:
+                    task_names[e.executor_id] = task_name
+                base = self.aprefix.format(task_name)
+                for suffix, v in zip(task_paths, e.values):
+                    if v is not None:
+                        add(format_metric(base + suffix, v, ts, pickle))
+        # the agent's datapoints go on the queue under one lock
+        if isinstance(self.queue, queue.Queue):
+            util.refill_queue(self.queue, batch)
+        else:
+            for d in batch:
+                self.queue.put(d)
+        return len(executors)
+
+    @classmethod
+    def _executor_paths(cls):
+        '''
+            What the executor mappings add to their prefix for each of
+            EXECUTOR_STATS, worked out once
+        '''
+        paths = cls.__dict__.get('_paths')
+        if paths is None:
+            paths = cls._paths = (
+                [cls.executor_metric_mapping[k][len(cls.eprefix):]
+                 for k in EXECUTOR_STATS],
+                [cls.alt_executor_metric_mapping[k][len(cls.aprefix):]
+                 for k in EXECUTOR_STATS])
+        return paths
+
     def flush_framework_metrics(self):
         counter = 0
         for framework in self.mesos.framework_metrics['frameworks']:
@@ -316,47 +714,62 @@ class MesosCarbon:
             shortened to just their Singularity request name and their
             respective instance numbers
         '''
-        mapping = {}
-        for k, v in self.executor_metric_mapping.items():
-            mapping[k] = v.replace('slave.{}.executors.singularity.tasks.{}',
-                                   'tasks.{}')
-
         sing_lookup = self.singularity.get_singularity_lookup()
         counter = 0
+        task_names = {}
         for slave_name, executors in self.mesos.executors.items():
-            for e in executors:
-                if e['framework_id'] == 'Singularity':
-                    task_name = sing_lookup.get(e['executor_id'], None)
-                    if not task_name or '---' in task_name:
-                        log('Could not match task name: {}'
-                            .format(e['executor_id']))
-                        task_name = self._best_guess_req_name(e['executor_id'])
-                else:  # Use mesos task names for non singularity tasks
-                    log('Non Singularity tasks : {}'.format(e['executor_id']))
-                    task_name = e['executor_id']
-
-                task_name = self._clean_metric_name(task_name)
-                # have instance numbers be a separate directory
-                # this converts task_name_3 to task_name.3
-                task_name = re.sub('_(\d+$)', '.\g<1>', task_name)
-
-                for k, v in e['statistics'].items():
-                    try:
-                        metric_name = mapping[k].format(task_name)
-                    except KeyError:
-                        continue
-                    self._add_to_queue(metric_name, v)
-                counter += 1
+            counter += self.send_alternate_slave_executors(
+                executors, sing_lookup, task_names)
+        # Only keep resolutions for executors that are still around
+        self.task_names = task_names
         log('Sent {} alternate executor metrics'.format(counter))
 
+    def flush_all_executors(self):
+        '''
+            flush_executor_metrics and send_alternate_executor_metrics in
+            one pass over the executors
+        '''
+        sing_lookup = self.singularity.get_singularity_lookup()
+        counter = 0
+        task_names = {}
+        for slave_name, executors in self.mesos.executors.items():
+            counter += self.flush_executors(slave_name, executors,
+                                            sing_lookup, task_names)
+        self.task_names = task_names
+        log('flushed {} executor metrics'.format(counter))
+        self.mesos.executor_metrics = None
+
+    def send_alternate_slave_executors(self, executors, sing_lookup,
+                                       task_names):
+        '''
+            send_alternate_executor_metrics for the executors of one agent,
+            task names resolved along the way are added to task_names
+        '''
+        return self.flush_executors(None, executors, sing_lookup, task_names)
+
+    def _resolve_task_name(self, e, sing_lookup):
+        '''
+            The task name of an executor, and whether it's only a guess
+            made from the executor id
+        '''
+        guessed = False
+        if e.framework_id == 'Singularity':
+            task_name = sing_lookup.get(e.executor_id, None)
+            if not task_name or '---' in task_name:
+                log('Could not match task name: {}'
+                    .format(e.executor_id))
+                task_name = self._best_guess_req_name(e.executor_id)
+                guessed = True
+        else:  # Use mesos task names for non singularity tasks
+            log('Non Singularity tasks : {}'.format(e.executor_id))
+            task_name = e.executor_id
+
+        task_name = self._clean_metric_name(task_name)
+        # have instance numbers be a separate directory
+        # this converts task_name_3 to task_name.3
+        return re.sub('_(\d+$)', '.\g<1>', task_name), guessed
+
     def _add_to_queue(self, metric_name, metric_value):
-        # The carbon plaintext protocol for metrics are
-        # <metric path> <metric value> <metric timestamp>
-        # The pickle protocol accepts a tuple
-        # [(path, (timestamp, value)), ...]
-        if not self.pickle:
-            self.queue.put('{} {} {}'.format(metric_name, metric_value,
-                                             self.mesos.update_ts))
-        else:
-            self.queue.put((metric_name,
-                            (self.mesos.update_ts, metric_value)))
+        ts = self.update_ts or self.mesos.update_ts
+        self.queue.put(format_metric(metric_name, metric_value, ts,
+                                     self.pickle))
@@ -0,0 +1,223 @@
+import os
+import io
+import sys
+import time
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from collections import Counter
+from .util import log
+
+TOP = 30  # entries per report section
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+SNAPSHOT_EVERY = 1.0  # minimum seconds between allocation snapshots
+TRACE_FRAMES = 5
+
+
+def _site(traceback):
+    '''
+        Where an allocation happened, along with the innermost collector
+        frame leading to it when the allocation is in a library
+    '''
+    frames = list(traceback)  # oldest first
+    site = '{}:{}'.format(frames[-1].filename, frames[-1].lineno)
+    if _ours(frames[-1]):
+        return site
+    for frame in reversed(frames[:-1]):
+        if _ours(frame):
+            return '{} via {}:{}'.format(site, frame.filename, frame.lineno)
+    return site
+
+
+def _ours(frame):
+    return os.sep + 'mesos_stats' in frame.filename
+
+
+class StackSampler:
+    '''
+        Samples the stacks of every thread but its own, so work done on
+        the agent poll pool (HTTP, JSON decode) is seen too, which cProfile
+        running on the cycle thread misses
+    '''
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampler',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(
+                        os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        ''' Folded stacks, one "frame;frame;frame count" per line '''
+        return ''.join('{} {}\n'.format(stack, n)
+                       for stack, n in self.stacks.most_common())
+
+    def top(self, n=TOP):
+        ''' Functions by the number of samples they were on top of a stack '''
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return ''.join('{:6.2f}% {:7d}  {}\n'.format(100.0 * c / total, c, f)
+                       for f, c in leaves.most_common(n))
+
+
+class CycleProfiler:
+    '''
+        Profiles whole collection cycles on request, one tier group at a
+        time. For every profiled cycle it writes to `directory`:
+
+        - <group>-<tick>.prof: cProfile stats of the cycle thread, which
+          runs the flushers and the Carbon encoding, readable with pstats
+          or snakeviz, plus a .cprofile.txt summary
+        - <group>-<tick>.stacks.txt: sampled stacks of all threads
+          including the poll pool, collapsed for flamegraph.pl, plus a
+          .sampled.txt top of the sampled functions
+        - <group>-<tick>.alloc.txt: top allocating lines per phase
+
+        Allocation snapshots are taken on phase changes at most every
+        SNAPSHOT_EVERY seconds, allocations of phases that were too short
+        to get their own snapshot are reported together (e.g. under
+        "mesos+flush" with staggered agents).
+    '''
+    def __init__(self, directory, cycles=1):
+        self.directory = directory
+        self.cycles = cycles
+        self.lock = threading.Lock()
+        self.pending = {}  # group name -> cycles left to profile
+        self.groups = []
+        self.active = None
+        self._reset()
+
+    def _reset(self):
+        self.profile = None
+        self.sampler = None
+        self.tick = None
+        self.current_phase = None
+        self.phases = []  # phases gone through since the last snapshot
+        self.snapshot = None
+        self.snapshot_ts = 0
+        self.allocations = {}  # phase -> Counter of bytes by traceback
+
+    def add_group(self, group):
+        self.groups.append(group.name)
+
+    def request(self, cycles=None):
+        ''' Profiles the next `cycles` cycles of every group '''
+        cycles = cycles or self.cycles
+        log('Profiling the next {} cycle(s) of {}'
+            .format(cycles, ', '.join(self.groups)))
+        for name in self.groups:
+            self.pending[name] = cycles
+
+    def handle_signal(self, signum, frame):
+        self.request()
+
+    def start_cycle(self, name, tick):
+        with self.lock:
+            if self.active or not self.pending.get(name):
+                return
+            self.active = name
+        self.tick = int(tick)
+        tracemalloc.start(TRACE_FRAMES)
+        self.snapshot = self._take_snapshot()
+        self.snapshot_ts = time.time()
+        self.current_phase = 'start'
+        self.phases = ['start']
+        self.sampler = StackSampler()
+        self.sampler.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def phase(self, name, phase):
+        if self.active != name or phase == self.current_phase:
+            return
+        if time.time() - self.snapshot_ts >= SNAPSHOT_EVERY:
+            self._diff_allocations()
+        self.current_phase = phase
+        if phase not in self.phases:
+            self.phases.append(phase)
+
+    def end_cycle(self, name, ok=True):
+        if self.active != name:
+            return
+        self.profile.disable()
+        self.sampler.stop()
+        self._diff_allocations()
+        tracemalloc.stop()
+        try:
+            self._write(name)
+        except OSError as e:
+            log('ERROR: Could not write profile to {}: {}'
+                .format(self.directory, e))
+        self.pending[name] -= 1
+        self._reset()
+        self.active = None
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),))
+
+    def _diff_allocations(self):
+        snapshot = self._take_snapshot()
+        # phases too short to get their own snapshot share one
+        allocated = self.allocations.setdefault('+'.join(self.phases),
+                                                Counter())
+        for stat in snapshot.compare_to(self.snapshot, 'traceback'):
+            if stat.size_diff > 0:
+                allocated[stat.traceback] += stat.size_diff
+        self.snapshot = snapshot
+        self.snapshot_ts = time.time()
+        self.phases = []
+
+    def _write(self, name):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, '{}-{}'.format(name, self.tick))
+
+        self.profile.dump_stats(base + '.prof')
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats('cumulative').print_stats(TOP)
+        stats.sort_stats('tottime').print_stats(TOP)
+        with open(base + '.cprofile.txt', 'w') as f:
+            f.write(out.getvalue())
+
+        with open(base + '.stacks.txt', 'w') as f:
+            f.write(self.sampler.collapsed())
+        with open(base + '.sampled.txt', 'w') as f:
+            f.write('{} samples every {}s\n'.format(
+                self.sampler.samples, self.sampler.interval))
+            f.write(self.sampler.top())
+
+        with open(base + '.alloc.txt', 'w') as f:
+            for phase, allocated in self.allocations.items():
+                f.write('== {}: {} KiB allocated\n'.format(
+                    phase, sum(allocated.values()) // 1024))
+                for tb, size in allocated.most_common(TOP):
+                    f.write('{:10d} B  {}\n'.format(size, _site(tb)))
+        log('Wrote cycle profile to {}.*'.format(base))
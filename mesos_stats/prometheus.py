@@ -0,0 +1,144 @@
+import re
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+from .util import log
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+SERIES_TTL = 600  # seconds a series is served for after its last datapoint
+
+# How Graphite paths map to Prometheus metrics: what the metric name
+# starts with and the labels the path's segments go in. The last group is
+# the rest of the name. Paths no rule matches keep their name, dots made
+# underscores, and have no labels. `instance` and `job` are left to
+# Prometheus, which sets them to the scrape target.
+RULES = [
+    (re.compile(r'slave\.([^.]+)\.executors\.singularity\.tasks\.([^.]+)'
+                r'\.(.+)$'), 'mesos_executor_', ('agent', 'task')),
+    (re.compile(r'slave\.([^.]+)\.(.+)$'), 'mesos_slave_', ('agent',)),
+    (re.compile(r'tasks\.([^.]+)\.(\d+)\.(.+)$'), 'singularity_task_',
+     ('request', 'task_instance')),
+    (re.compile(r'tasks\.([^.]+)\.(.+)$'), 'singularity_task_',
+     ('request',)),
+    (re.compile(r'frameworks\.([^.]+)\.tasks\.([^.]+)\.(.+)$'),
+     'mesos_framework_task_', ('framework', 'task')),
+    (re.compile(r'frameworks\.([^.]+)\.(.+)$'), 'mesos_framework_',
+     ('framework',)),
+    (re.compile(r'cluster\.(.+)$'), 'mesos_cluster_', ()),
+]
+INVALID = re.compile('[^a-zA-Z0-9_]')
+
+
+def _label_value(v):
+    return v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_series(path, prefix=None):
+    '''
+        The Prometheus metric name and rendered labels of a Graphite path,
+        e.g. slave.a1.cpus.total -> ('mesos_slave_cpus_total', 'agent="a1"').
+        The Graphite prefix goes in a `prefix` label.
+    '''
+    labels = []
+    for regex, name, label_names in RULES:
+        m = regex.match(path)
+        if m:
+            groups = m.groups()
+            name += groups[-1]
+            labels = list(zip(label_names, groups[:-1]))
+            break
+    else:
+        name = path
+    name = INVALID.sub('_', name)
+    if name[0].isdigit():
+        name = '_' + name
+    if prefix:
+        labels.append(('prefix', prefix))
+    return name, ','.join('{}="{}"'.format(k, _label_value(v))
+                          for k, v in labels)
+
+
+class Exposition:
+    '''
+        The latest value of every series in the Prometheus text format.
+        Datapoints are taken in the queue's pickle form and the text is
+        rendered, and gzipped, only when render() is called at the end of
+        a cycle, scrapes are served what was rendered last. Series that
+        haven't had a datapoint for `ttl` seconds are left out.
+    '''
+    def __init__(self, ttl=SERIES_TTL):
+        self.ttl = ttl
+        # (prefix, path) -> [value, timestamp, name, line start]
+        self.series = {}
+        self.rendered = (b'', gzip.compress(b''))
+        self.renders = 0
+
+    def update(self, batch, prefix=None):
+        series = self.series
+        for path, (ts, v) in batch:
+            s = series.get((prefix, path))
+            if s is None:
+                name, labels = to_series(path, prefix)
+                series[(prefix, path)] = [
+                    v, ts, name,
+                    '{}{{{}}} '.format(name, labels) if labels
+                    else name + ' ']
+            else:
+                s[0] = v
+                s[1] = ts
+
+    def render(self):
+        ''' Renders what's been updated into the text scrapes are served '''
+        newest = max((s[1] for s in self.series.values()), default=0)
+        by_name = {}
+        for key, (v, ts, name, start) in list(self.series.items()):
+            if ts < newest - self.ttl:
+                del self.series[key]
+                continue
+            by_name.setdefault(name, []).append('{}{}\n'.format(start, v))
+        out = []
+        for name in sorted(by_name):
+            out.append('# TYPE {} gauge\n'.format(name))
+            out += by_name[name]
+        text = ''.join(out).encode()
+        self.rendered = (text, gzip.compress(text, 1))
+        self.renders += 1
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    ''' /metrics  the last rendered exposition '''
+    def do_GET(self):
+        if urlparse(self.path).path != '/metrics':
+            self.send_error(404)
+            return
+        text, gzipped = self.server.exposition.rendered
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self.send_header('Content-Encoding', 'gzip')
+            text = gzipped
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    ''' Serves an Exposition from a daemon thread '''
+    daemon_threads = True
+
+    def __init__(self, exposition, port, host=''):
+        HTTPServer.__init__(self, (host, port), MetricsHandler)
+        self.exposition = exposition
+
+    def start(self):
+        log('Serving Prometheus metrics on port {}'.format(
+            self.server_address[1]))
+        t = threading.Thread(target=self.serve_forever, name='metrics',
+                             daemon=True)
+        t.start()
+        return t
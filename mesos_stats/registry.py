@@ -0,0 +1,186 @@
+from array import array
+from .util import log, drain_queue, refill_queue
+from .carbon import format_metric, parse_metric
+
+FREE = float('inf')  # last_seen marker for an unused slot
+
+
+class SeriesRegistry:
+    '''
+        Keeps track of every series path we emit along with the time it was
+        first and last seen, and enforces a cardinality budget per path
+        prefix. New series over budget are either dropped or folded into a
+        `<prefix>.other.*` bucket, and series that haven't been seen for
+        `ttl` seconds expire and give their room back to the budget. Expiry
+        goes through every series, so it's done once a cycle by report()
+        rather than on every filter() call. Folded values add up over the
+        cycle's partial sends and go out once, with the report.
+
+        Paths map to slots in flat arrays so a million series costs little
+        more than the dict holding them.
+    '''
+    def __init__(self, budgets=None, ttl=86400, fold=True, pickle=False,
+                 namespace='collector'):
+        self.namespace = namespace
+        self.budgets = budgets or {}  # path prefix -> max number of series
+        self.ttl = ttl
+        self.fold = fold
+        self.pickle = pickle
+        self._slots = {}  # path -> slot
+        self._paths = []  # slot -> path
+        self._first = array('d')
+        self._last = array('d')
+        self._budgeted = bytearray()  # slot -> counts against a budget
+        self._free = []
+        self._counts = {prefix: 0 for prefix in self.budgets}
+        self._folded = {}  # (fold path, ts) -> sum so far this cycle
+        self.stats = dict.fromkeys(('new', 'expired', 'dropped', 'folded'), 0)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, path):
+        return path in self._slots
+
+    def first_seen(self, path):
+        return self._first[self._slots[path]]
+
+    def last_seen(self, path):
+        return self._last[self._slots[path]]
+
+    def dump_state(self):
+        live = [i for i, p in enumerate(self._paths) if p is not None]
+        return {'paths': [self._paths[i] for i in live],
+                'first': [self._first[i] for i in live],
+                'last': [self._last[i] for i in live],
+                'budgeted': [self._budgeted[i] for i in live]}
+
+    def load_state(self, state):
+        for path, first, last, budgeted in zip(state.get('paths', []),
+                                               state.get('first', []),
+                                               state.get('last', []),
+                                               state.get('budgeted', [])):
+            if path in self._slots:
+                continue
+            prefix = self._budget_prefix(path) if budgeted else None
+            self._add(path, first, prefix)
+            self._last[self._slots[path]] = last
+
+    def filter(self, metrics, timestamp):
+        ''' Drains the queue, registering each series as it goes '''
+        now = float(timestamp)
+        kept = []
+        folded = self._folded
+        new = dropped = 0
+        for m in drain_queue(metrics):
+            path, value, ts = parse_metric(m, self.pickle)
+            slot = self._slots.get(path)
+            if slot is not None:
+                self._last[slot] = now
+                kept.append(m)
+                continue
+            prefix = self._budget_prefix(path)
+            if prefix is None or self._counts[prefix] < self.budgets[prefix]:
+                self._add(path, now, prefix)
+                new += 1
+                kept.append(m)
+            elif self.fold:
+                key = (self._fold_path(prefix, path), ts)
+                folded[key] = folded.get(key, 0) + float(value)
+            else:
+                dropped += 1
+        refill_queue(metrics, kept)
+        self.stats['new'] += new
+        self.stats['dropped'] += dropped
+
+    def forget(self, metrics, timestamp):
+        '''
+            Unregisters the series first seen at timestamp whose datapoints
+            never made it to Carbon
+        '''
+        now = float(timestamp)
+        for m in metrics:
+            path = parse_metric(m, self.pickle)[0]
+            slot = self._slots.get(path)
+            if slot is None or self._first[slot] != now:
+                continue
+            self._remove(slot)
+            self.stats['new'] -= 1
+
+    def report(self, metrics, timestamp):
+        '''
+            Expires the series that are due, then queues the cycle's folded
+            series and the registry stats since the last report
+        '''
+        now = float(timestamp)
+        self.stats['expired'] += self.expire(now)
+        for (path, ts), value in self._folded.items():
+            if path not in self._slots:
+                self._add(path, now, None)
+            self._last[self._slots[path]] = now
+            metrics.put(format_metric(path, value, ts, self.pickle))
+        self.stats['folded'] += len(self._folded)
+        self._folded = {}
+        log('Series registry: {} series, {} new, {} expired, {} dropped, '
+            '{} folded'.format(len(self), self.stats['new'],
+                               self.stats['expired'], self.stats['dropped'],
+                               self.stats['folded']))
+        ts = int(timestamp)
+        prefix = self.namespace + '.registry.'
+        metrics.put(format_metric(prefix + 'series', len(self), ts,
+                                  self.pickle))
+        for k, v in self.stats.items():
+            metrics.put(format_metric(prefix + k, v, ts, self.pickle))
+            self.stats[k] = 0
+
+    def expire(self, now):
+        ''' Forgets series that haven't been seen for `ttl` seconds '''
+        cutoff = now - self.ttl
+        stale = [i for i, t in enumerate(self._last) if t < cutoff]
+        for slot in stale:
+            self._remove(slot)
+        return len(stale)
+
+    def _remove(self, slot):
+        path = self._paths[slot]
+        if self._budgeted[slot]:
+            self._counts[self._budget_prefix(path)] -= 1
+        del self._slots[path]
+        self._paths[slot] = None
+        self._last[slot] = FREE
+        self._free.append(slot)
+
+    def _add(self, path, now, prefix):
+        if self._free:
+            slot = self._free.pop()
+            self._paths[slot] = path
+            self._first[slot] = now
+            self._last[slot] = now
+            self._budgeted[slot] = prefix is not None
+        else:
+            slot = len(self._paths)
+            self._paths.append(path)
+            self._first.append(now)
+            self._last.append(now)
+            self._budgeted.append(prefix is not None)
+        self._slots[path] = slot
+        if prefix is not None:
+            self._counts[prefix] += 1
+
+    def _budget_prefix(self, path):
+        ''' Returns the longest budgeted prefix covering path, if any '''
+        if not self.budgets:
+            return None
+        match = None
+        end = path.find('.')
+        while end != -1:
+            if path[:end] in self.budgets:
+                match = path[:end]
+            end = path.find('.', end + 1)
+        return match
+
+    def _fold_path(self, prefix, path):
+        # Keep the measurement (e.g. cpus.limit) so the bucket stays a sum
+        # of like values
+        leaf = path[len(prefix) + 1:].split('.')[-2:]
+        return '.'.join([prefix, 'other'] + leaf)
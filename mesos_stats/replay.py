@@ -0,0 +1,151 @@
+import os
+import gzip
+import json
+import time
+import threading
+import requests
+from . import util
+from .util import log
+
+ARCHIVE_VERSION = 1
+
+
+class Recorder:
+    '''
+        Records the raw responses to every request made through
+        try_get_json, with their url, status and latency, from start up
+        until every tier group has gone through `cycles` cycles. The
+        archive is a gzipped JSON lines file: a header line, then one line
+        per request in the order they completed.
+    '''
+    def __init__(self, path, cycles=1):
+        self.path = path
+        self.cycles = cycles
+        self.lock = threading.Lock()
+        self.entries = []
+        self.remaining = {}  # group name -> cycles left to record
+        self.wrapped = None
+
+    def install(self):
+        self.wrapped = util.transport
+        util.transport = self.get
+
+    def uninstall(self):
+        util.transport = self.wrapped
+
+    def add_group(self, group):
+        self.remaining[group.name] = self.cycles
+
+    def get(self, url, timeout=None):
+        t = time.time()
+        entry = {'url': url}
+        try:
+            response = self.wrapped(url, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            entry['error'] = type(e).__name__
+            entry['message'] = str(e)
+            raise
+        else:
+            entry['status'] = response.status_code
+            entry['body'] = response.text
+            return response
+        finally:
+            entry['seconds'] = time.time() - t
+            with self.lock:
+                self.entries.append(entry)
+
+    def start_cycle(self, name, tick):
+        pass
+
+    def phase(self, name, phase):
+        pass
+
+    def end_cycle(self, name, ok=True):
+        with self.lock:
+            if not self.remaining.get(name):
+                return
+            self.remaining[name] -= 1
+            if any(self.remaining.values()):
+                return
+        self.uninstall()
+        self.save()
+
+    def save(self):
+        tmp = '{}.tmp'.format(self.path)
+        try:
+            with gzip.open(tmp, 'wt', compresslevel=6) as f:
+                header = {'version': ARCHIVE_VERSION,
+                          'recorded_at': int(time.time())}
+                f.write(json.dumps(header) + '\n')
+                for entry in self.entries:
+                    f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log('ERROR: Could not save recording: {}'.format(e))
+            return
+        log('Recorded {} requests to {}'.format(len(self.entries),
+                                                self.path))
+
+
+class ReplayResponse:
+    ''' Just enough of requests.Response for try_get_json '''
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode()
+
+
+class Replayer:
+    '''
+        Serves try_get_json from an archive written by Recorder, without
+        touching the network. Responses to a url are played back in the
+        order they were recorded, the last one is repeated once they run
+        out. Every response takes its recorded latency multiplied by
+        `latency_scale`, 0 returns them straight away. Scaled latencies
+        longer than the request timeout time out.
+    '''
+    def __init__(self, path, latency_scale=1.0):
+        self.path = path
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.responses = {}  # url -> [entry, ...]
+        self.wrapped = None
+
+    def load(self):
+        with gzip.open(self.path, 'rt') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != ARCHIVE_VERSION:
+                raise ValueError('Unsupported recording version {}'
+                                 .format(header.get('version')))
+            for line in f:
+                entry = json.loads(line)
+                self.responses.setdefault(entry['url'], []).append(entry)
+        log('Replaying {} urls recorded at {} from {}'.format(
+            len(self.responses), header['recorded_at'], self.path))
+
+    def install(self):
+        self.wrapped = util.transport
+        util.transport = self.get
+
+    def uninstall(self):
+        util.transport = self.wrapped
+
+    def get(self, url, timeout=None):
+        with self.lock:
+            entries = self.responses.get(url)
+            if not entries:
+                raise requests.exceptions.ConnectionError(
+                    '{} is not in the recording'.format(url))
+            entry = entries.pop(0) if len(entries) > 1 else entries[0]
+        if self.latency_scale:
+            latency = entry['seconds'] * self.latency_scale
+            if timeout is not None and latency > timeout:
+                time.sleep(timeout)
+                raise requests.exceptions.Timeout(
+                    'Replayed {} timed out'.format(url))
+            time.sleep(latency)
+        if 'error' in entry:
+            error = getattr(requests.exceptions, entry['error'],
+                            requests.exceptions.RequestException)
+            raise error(entry['message'])
+        return ReplayResponse(entry['status'], entry['body'])
@@ -0,0 +1,75 @@
+import math
+import time
+from .util import log
+
+MIN_INTERVAL = 10  # seconds
+OVERRUN_POLICIES = ('skip', 'coalesce', 'late')
+
+
+class Scheduler:
+    '''
+        Ticks every `interval` seconds on boundaries aligned to the epoch
+        (so a 60s interval ticks at the start of every clock minute). The
+        tick times are computed from the boundaries rather than from when
+        the previous cycle ended, so the schedule doesn't drift.
+
+        When a cycle runs past the next boundary the missed ticks are
+        handled according to `overrun`:
+        - skip:     drop the missed ticks and wait for the next boundary
+        - coalesce: run once straight away for the latest missed tick
+        - late:     run every missed tick straight away, oldest first
+    '''
+    def __init__(self, interval=60, overrun='skip'):
+        if interval < MIN_INTERVAL:
+            raise ValueError('Interval must be at least {}s'
+                             .format(MIN_INTERVAL))
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError('Overrun policy must be one of {}'
+                             .format(', '.join(OVERRUN_POLICIES)))
+        self.interval = interval
+        self.overrun = overrun
+        self.next_tick = None
+        self.overruns = 0
+        self.skipped = 0
+        self.lag = 0.0  # how late the last tick started
+
+    def _boundary(self, t):
+        ''' Latest tick boundary at or before t '''
+        return math.floor(t / self.interval) * self.interval
+
+    def wait(self):
+        ''' Sleeps until the next tick is due and returns its timestamp '''
+        now = time.time()
+        if self.next_tick is None:
+            self.next_tick = self._boundary(now) + self.interval
+        elif now >= self.next_tick:
+            latest = self._boundary(now)
+            missed = int(round((latest - self.next_tick) / self.interval)) + 1
+            self.overruns += 1
+            if self.overrun == 'skip':
+                self.skipped += missed
+                self.next_tick = latest + self.interval
+            elif self.overrun == 'coalesce':
+                self.skipped += missed - 1
+                self.next_tick = latest
+            log('Cycle overran by {} tick(s), overrun policy: {}'
+                .format(missed, self.overrun))
+
+        tick = self.next_tick
+        self._sleep_until(tick)
+        self.next_tick = tick + self.interval
+        self.lag = time.time() - tick
+        return tick
+
+    def deadline(self, tick):
+        ''' Time by which the cycle started at tick should be done '''
+        return tick + self.interval - 1.0
+
+    def _sleep_until(self, t):
+        sleep_time = t - time.time()
+        if sleep_time > 0:
+            log("Sleeping for %ss" % sleep_time)
+        # sleep() may wake up early, keep going until we're there
+        while sleep_time > 0:
+            time.sleep(sleep_time)
+            sleep_time = t - time.time()
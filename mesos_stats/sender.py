@@ -0,0 +1,122 @@
+import time
+import threading
+from .util import log, Timer
+from .carbon import Carbon, format_metric
+
+MIN_SEND_TIMEOUT = 5  # seconds a send gets even once the deadline's passed
+
+
+class Sender:
+    '''
+        Pushes the datapoints queued by the tier groups through the queue
+        filters and on to Carbon. Shared by every group, sends are
+        serialised so the filters and the Carbon connection only ever see
+        one queue at a time.
+
+        Every cluster collected has its own Sender, with its own filters
+        and Graphite `prefix`, sharing the Carbon connection and `lock` of
+        the first cluster's.
+    '''
+    def __init__(self, carbon, pickle=False, filters=(), state=None,
+                 instrumentation=None, shedder=None, prefix=None,
+                 lock=None):
+        self.carbon = carbon
+        self.pickle = pickle
+        self.filters = filters
+        self.state = state
+        self.instrumentation = instrumentation
+        self.shedder = shedder
+        self.prefix = prefix
+        self.lock = lock or threading.Lock()
+
+    def encoding(self):
+        '''
+            What worker processes can encode this sender's datapoints in,
+            (pickle, prefix), when they go straight to a Carbon connection
+            with no filter to go through. None when they can't
+        '''
+        if self.filters or not isinstance(self.carbon, Carbon) or \
+                self.carbon.pickle != self.pickle:
+            return None
+        return (self.pickle, self.prefix or self.carbon.prefix)
+
+    def send(self, metrics, timestamp, deadline, final=True, payloads=None):
+        '''
+            Sends what's in the metrics queue, then the payloads encoded by
+            worker processes, which are emptied. final is False for partial
+            sends made while the cycle is still collecting.
+            Returns the number of datapoints and bytes sent
+        '''
+        with self.lock:
+            instrumentation = self.instrumentation
+            if instrumentation:
+                instrumentation.observe_queue(metrics)
+                if final:
+                    instrumentation.report(metrics, timestamp)
+            for f in self.filters:
+                f.filter(metrics, timestamp)
+            if self.shedder:
+                dropped = [] if self.filters else None
+                self.shedder.order(metrics, deadline,
+                                   timestamp if final else None, payloads,
+                                   dropped)
+                # the filters took what was shed for sent, it never was
+                for f in self.filters if dropped else ():
+                    f.forget(dropped, timestamp)
+            # reported once they know what's sent, they're never shed
+            if final:
+                for f in self.filters:
+                    f.report(metrics, timestamp)
+            # what wasn't shed has to go out, the cluster family always
+            send_timeout = max(deadline - time.time(), MIN_SEND_TIMEOUT)
+            if final:
+                log("Sending stats (timeout %ss)" % send_timeout)
+            t = time.time()
+            kwargs = {'prefix': self.prefix} if self.prefix else {}
+            with Timer("Sending stats to graphite"):
+                datapoints, nbytes = self.carbon.send_metrics(
+                    metrics, send_timeout, close=final and not payloads,
+                    **kwargs)
+                if payloads:
+                    sent = self.carbon.send_payloads(payloads, send_timeout,
+                                                     close=final)
+                    datapoints += sent[0]
+                    nbytes += sent[1]
+                    del payloads[:]
+            if instrumentation:
+                instrumentation.observe_send(datapoints, nbytes,
+                                             time.time() - t)
+            if self.shedder:
+                self.shedder.observe(datapoints, time.time() - t)
+            if final and self.state:
+                self.state.cycle_done()
+            return (datapoints, nbytes)
+
+    def report_scheduler(self, metrics, timestamp, name, scheduler):
+        ''' Queues the overrun counters of a tier group's scheduler '''
+        namespace = 'collector'
+        if self.instrumentation:
+            namespace = self.instrumentation.namespace
+        prefix = '{}.scheduler.{}.'.format(namespace, name)
+        for k, v in [('overruns', scheduler.overruns),
+                     ('skipped', scheduler.skipped),
+                     ('lag', scheduler.lag)]:
+            metrics.put(format_metric(prefix + k, v, int(timestamp),
+                                      self.pickle))
+
+    def report_memory(self, metrics, timestamp, name, guard):
+        '''
+            Queues the peak RSS of a tier group's cycle so far and how many
+            times its collection was held back by the memory ceiling
+        '''
+        namespace = 'collector'
+        if self.instrumentation:
+            namespace = self.instrumentation.namespace
+        prefix = '{}.memory.'.format(namespace)
+        ts = int(timestamp)
+        for k, v in [('{}.peak_mb'.format(name), guard.peaks.get(name, 0)),
+                     ('{}.backpressure_pauses'.format(name),
+                      guard.pauses.get(name, 0)),
+                     ('rss_mb', guard.sample(name))]:
+            metrics.put(format_metric(prefix + k, round(v, 1), ts,
+                                      self.pickle))
@@ -0,0 +1,259 @@
+import os
+import time
+import pickle
+import tempfile
+import multiprocessing
+from . import util
+from .util import log
+from .carbon import encode_metrics, CHUNK_SIZE
+from .mesos import MesosCarbon, stagger_offset
+from .shedding import FAMILIES, family_of
+
+SHARD_SIZE = 50  # agents a worker process fetches and flushes per task
+SHARD_TIMEOUT = 120  # seconds shards get without an agent deadline
+
+# What a worker process was started with: the group's MesosCarbon and
+# the encoding of its sender, (pickle, prefix) or None
+_context = None
+# What a worker loaded of the cycle it's working on, (path, context)
+_cycle = None
+
+
+class Batch(list):
+    ''' A list standing in for the queue MesosCarbon flushes into '''
+    put = list.append
+    qsize = list.__len__
+
+
+class Payload:
+    '''
+        Datapoints of one family a worker encoded for Carbon, ready to
+        send as they are. `family` is their index in FAMILIES
+    '''
+    __slots__ = ('family', 'datapoints', 'data')
+
+    def __init__(self, family, datapoints, data):
+        self.family = family
+        self.datapoints = datapoints
+        self.data = data
+
+
+def encode_batch(batch, pickle=False, prefix=None):
+    '''
+        A worker's datapoints as [Payload, ...], one per family, framed
+        CHUNK_SIZE datapoints at a time like Carbon.send_metrics does
+    '''
+    buckets = [[] for _ in FAMILIES]
+    add = [b.append for b in buckets]
+    if pickle:
+        for m in batch:
+            add[family_of(m[0])](m)
+    else:
+        for m in batch:
+            add[family_of(m)](m)
+    payloads = []
+    for family, bucket in enumerate(buckets):
+        if not bucket:
+            continue
+        if prefix and pickle:
+            bucket = [('{}.{}'.format(prefix, m[0]), m[1]) for m in bucket]
+        elif prefix:
+            bucket = ['{}.{}'.format(prefix, m) for m in bucket]
+        data = b''.join(encode_metrics(bucket[i:i + CHUNK_SIZE], pickle)
+                        for i in range(0, len(bucket), CHUNK_SIZE))
+        payloads.append(Payload(family, len(bucket), data))
+    return payloads
+
+
+def shard_slaves(slaves, window, size=SHARD_SIZE):
+    '''
+        Splits the agents into shards of `size`, in the order poll_slaves
+        would poll them so staggered agents keep their place in the window
+    '''
+    ordered = sorted(slaves, key=lambda s: stagger_offset(
+        s.get('id') or s['hostname'], window))
+    return [ordered[i:i + size] for i in range(0, len(ordered), size)]
+
+
+def _timed(flushers, name, fn, *args):
+    t = time.time()
+    res = fn(*args)
+    stats = flushers.setdefault(name, [0, 0.0])
+    stats[1] += time.time() - t
+    return res
+
+
+def _start_worker(mesos_carbon, encoding):
+    ''' Gives a forked worker its context and connections of its own '''
+    global _context
+    _context = (mesos_carbon, encoding)
+    # the parent's observers are handed what the worker requested, only
+    # the worker's request controller goes by it here, limiting its polls
+    util.request_observers[:] = \
+        [util.controller.observe] if util.controller else []
+    # the parent's pooled connections aren't shared, even from under a
+    # recording or replay
+    inherited = util.session.get
+    util.session = util.new_session()
+    _rebind_transport(inherited, util.session.get)
+
+
+def _rebind_transport(old, new):
+    ''' Swaps old for new in util.transport, or what it wraps '''
+    if util.transport == old:
+        util.transport = new
+        return
+    wrapper = getattr(util.transport, '__self__', None)
+    while wrapper is not None and hasattr(wrapper, 'wrapped'):
+        if wrapper.wrapped == old:
+            wrapper.wrapped = new
+            return
+        wrapper = getattr(wrapper.wrapped, '__self__', None)
+
+
+def _load_cycle(path):
+    ''' The cycle's context a worker is handed, loaded once a cycle '''
+    global _cycle
+    if _cycle is None or _cycle[0] != path:
+        with open(path, 'rb') as f:
+            _cycle = (path, pickle.load(f))
+    return _cycle[1]
+
+
+def collect_shard(slaves, cycle, timestamp, window, deadline=None):
+    '''
+        Runs in a worker process: polls a shard of agents and flushes them
+        into a Batch. Returns (datapoints, [Payload, ...], agent datapoint
+        count, resolved task names, [request observations], {flusher:
+        [datapoints, secs]}), the datapoints are encoded into payloads
+        when the group's sender takes them
+    '''
+    parent, encoding = _context
+    sing_lookup, task_names, agent, executor = _load_cycle(cycle)
+    mesos = parent.mesos
+    requests = []
+
+    def observe(*args):
+        requests.append(args)
+
+    batch = Batch()
+    mc = MesosCarbon(mesos, batch, pickle=parent.pickle)
+    mc.update_ts = int(timestamp)
+    mc.task_names = task_names
+    mc.resources_from_master = parent.resources_from_master
+    resolved = {}
+    flushers = {}
+    counter = 0
+    util.request_observers.append(observe)
+    try:
+        for hostname, metrics, executors in mesos.poll_slaves(
+                timestamp, window, agent, executor, deadline,
+                slaves=slaves):
+            n = len(batch)
+            if agent:
+                counter += _timed(flushers, 'agent', mc.flush_slave,
+                                  hostname, metrics)
+                flushers['agent'][0] += len(batch) - n
+                n = len(batch)
+            if executor:
+                _timed(flushers, 'executor', mc.flush_executors, hostname,
+                       executors, sing_lookup, resolved)
+                flushers['executor'][0] += len(batch) - n
+    finally:
+        util.request_observers.remove(observe)
+    if encoding:
+        return [], encode_batch(batch, *encoding), counter, resolved, \
+            requests, flushers
+    return list(batch), [], counter, resolved, requests, flushers
+
+
+class ShardPool:
+    '''
+        Collects agents across worker processes, so decoding the responses
+        and formatting the datapoints isn't serialised on the collector's
+        GIL. The pool is forked once by start(), before the collector's
+        threads are, so workers don't inherit locks held by them. Workers
+        keep the transport they were forked with (e.g. a replay archive)
+        on connections of their own. What changes every cycle, the
+        Singularity lookup and task name cache, is written to a file they
+        each load once a cycle.
+
+        Given an encoding, (pickle, prefix), workers send back their
+        datapoints encoded for Carbon. At most two shards per process are
+        in flight, results are handed out in the order they complete, and
+        the shards not back by the deadline are given up on.
+    '''
+    def __init__(self, processes):
+        self.processes = processes
+        self.pool = None
+
+    def start(self, mesos_carbon, encoding=None):
+        ctx = multiprocessing.get_context('fork')
+        self.pool = ctx.Pool(self.processes, _start_worker,
+                             (mesos_carbon, encoding))
+
+    def close(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def collect(self, mesos_carbon, timestamp, window, agent, executor,
+                sing_lookup=None, deadline=None, slaves=None):
+        '''
+            Yields (datapoints, payloads, agent datapoint count, resolved
+            task names, requests, flushers) for every shard of `slaves`,
+            the latest roster by default, as it completes, until
+            `deadline` or SHARD_TIMEOUT seconds from now
+        '''
+        if self.pool is None:
+            self.start(mesos_carbon)
+        if slaves is None:
+            slaves = mesos_carbon.mesos.slaves
+        shards = shard_slaves(slaves, window)
+        if deadline is None:
+            deadline = time.time() + SHARD_TIMEOUT
+        fd, cycle = tempfile.mkstemp(prefix='mesos-stats-shards-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((sing_lookup, mesos_carbon.task_names, agent,
+                             executor), f, pickle.HIGHEST_PROTOCOL)
+            pending = []
+            missed = 0
+            for i, shard in enumerate(shards):
+                if time.time() >= deadline:
+                    missed = len(shards) - i
+                    break
+                pending.append(self.pool.apply_async(
+                    collect_shard, (shard, cycle, timestamp, window,
+                                    deadline)))
+                while len(pending) >= 2 * self.processes:
+                    res = self._next(pending, deadline)
+                    if res is None:
+                        break
+                    yield res
+            while pending:
+                res = self._next(pending, deadline)
+                if res is None:
+                    break
+                yield res
+            # what's still running is left to finish in the background
+            missed += len(pending)
+            if missed:
+                log('{} agent shards missed the deadline'.format(missed))
+        finally:
+            os.unlink(cycle)
+
+    @staticmethod
+    def _next(pending, deadline):
+        '''
+            Waits for whichever pending shard completes first, None once
+            the deadline has passed
+        '''
+        while True:
+            for i, res in enumerate(pending):
+                if res.ready():
+                    return pending.pop(i).get()
+            if time.time() >= deadline:
+                return None
+            pending[0].wait(0.01)
@@ -0,0 +1,123 @@
+import time
+from . import util
+from .carbon import format_metric, CHUNK_SIZE
+
+# Metric families in the order they're sent, the last ones are shed first.
+# The first family is never shed.
+FAMILIES = ('cluster', 'agent', 'framework', 'executor')
+HEADROOM = 0.8  # of what Carbon is expected to take before the deadline
+RATE_WEIGHT = 0.3  # of the latest send in the throughput estimate
+
+
+def family_of(path):
+    '''
+        Index in FAMILIES of a datapoint's path. cluster.*, singularity.*
+        and the collector's own series, along with anything unknown, go
+        out first
+    '''
+    if path.startswith('slave.'):
+        return 3 if '.executors.' in path else 1
+    if path.startswith('tasks.'):
+        return 3
+    if path.startswith('frameworks.'):
+        return 2
+    return 0
+
+
+class LoadShedder:
+    '''
+        Puts the queue in FAMILIES order before it's sent, and drops the
+        lowest families first when Carbon isn't expected to take all of it
+        before the cycle's deadline. How many datapoints a second Carbon
+        takes is learnt from the sends, until the first one nothing is
+        shed. What was shed goes out as <namespace>.sender.shed.<family>
+        with the final send of every cycle.
+    '''
+    def __init__(self, namespace='collector', pickle=False,
+                 headroom=HEADROOM):
+        self.namespace = namespace
+        self.pickle = pickle
+        self.headroom = headroom
+        self.rate = None  # datapoints per second
+        self.shed = [0] * len(FAMILIES)  # since the last report
+
+    def observe(self, datapoints, seconds):
+        ''' Updates the throughput estimate with a send '''
+        # small sends are mostly connecting
+        if datapoints < CHUNK_SIZE or seconds <= 0:
+            return
+        rate = datapoints / seconds
+        if self.rate is None:
+            self.rate = rate
+        else:
+            self.rate += RATE_WEIGHT * (rate - self.rate)
+
+    def capacity(self, budget):
+        ''' How many datapoints can be sent in budget seconds, None if all '''
+        if self.rate is None:
+            return None
+        return int(self.rate * max(budget, 0) * self.headroom)
+
+    def order(self, metrics, deadline, timestamp=None, payloads=None,
+              dropped=None):
+        '''
+            Reorders the metrics queue by family and sheds what won't make
+            the deadline. Given a timestamp, the shed counters are reported
+            at the front of the queue. Encoded payloads go out after the
+            queue, ordered by family too, and are shed whole. The shed
+            datapoints of the queue are added to the `dropped` list if
+            there's one. Returns how many datapoints were shed
+        '''
+        items = util.drain_queue(metrics)
+        buckets = [[] for _ in FAMILIES]
+        add = [b.append for b in buckets]
+        if self.pickle:
+            for m in items:
+                add[family_of(m[0])](m)
+        else:
+            for m in items:
+                add[family_of(m)](m)
+        del items
+        capacity = self.capacity(deadline - time.time())
+        kept = buckets[0]
+        shed = 0
+        for i in range(1, len(FAMILIES)):
+            b = buckets[i]
+            if capacity is not None and len(b) > capacity - len(kept):
+                room = max(capacity - len(kept), 0)
+                self.shed[i] += len(b) - room
+                shed += len(b) - room
+                if dropped is not None:
+                    dropped.extend(b[room:])
+                del b[room:]
+            kept.extend(b)
+        if payloads:
+            payloads.sort(key=lambda p: p.family)
+            room = None if capacity is None else capacity - len(kept)
+            keep = []
+            for p in payloads:
+                if room is None or p.datapoints <= room:
+                    keep.append(p)
+                    if room is not None:
+                        room -= p.datapoints
+                elif p.family:
+                    self.shed[p.family] += p.datapoints
+                    shed += p.datapoints
+                else:
+                    keep.append(p)
+            payloads[:] = keep
+        if timestamp is not None:
+            util.refill_queue(metrics, self.report(timestamp))
+        util.refill_queue(metrics, kept)
+        if shed:
+            util.log('Shed {} datapoints to make the deadline'.format(shed))
+        return shed
+
+    def report(self, timestamp):
+        ''' The shed counters as datapoints, resets them '''
+        prefix = '{}.sender.shed.'.format(self.namespace)
+        ts = int(timestamp)
+        res = [format_metric(prefix + f, self.shed[i], ts, self.pickle)
+               for i, f in enumerate(FAMILIES) if i]
+        self.shed = [0] * len(FAMILIES)
+        return res
@@ -1,23 +1,28 @@
 import time
-from .util import log, try_get_json
+from .util import log, try_get_json, endpoint_name
+from .carbon import format_metric
 
 
 class Singularity:
-    def __init__(self, host):
+    def __init__(self, host, update=True):
         self.host = host
         self.state = {}
         self.active_requests = []
         self.disaster_stats = {}
         self.active_tasks = []
-        self.update()
+        self.update_ts = None
+        if update:
+            self.update()
 
     def reset(self):
         self.state = {}
         self.active_requests = []
         self.disasters_stats = {}
         self.active_tasks = []
+        self.update_ts = None
 
-    def update(self):
+    def update(self, timestamp=None):
+        self.update_ts = int(timestamp or time.time())
         self.state = self.get_state()
         self.active_requests = self.get_active_requests()
         self.disasters_stats = self.get_disasters_stats()
@@ -27,7 +32,8 @@ class Singularity:
         return self._get("/disasters/stats")
 
     def get_state(self):
-        state = self._get("/state")
+        # a copy, the response may be cached and handed to others
+        state = dict(self._get("/state"))
         state['decommissionedSlaves'] = len(self.get_decommisioned_slaves())
         return state
 
@@ -45,7 +51,7 @@ class Singularity:
 
     def _get(self, uri):
         url = "http://%s/api%s" % (self.host, uri)
-        return try_get_json(url)
+        return try_get_json(url, endpoint='singularity.' + endpoint_name(uri))
 
     def get_singularity_lookup(self):
         '''
@@ -101,28 +107,22 @@ class SingularityCarbon:
                 metric_name = self.metric_mapping[k]
             except KeyError:
                 continue
-            ts = int(time.time())
-            self._add_to_queue(metric_name, v, ts)
+            self._add_to_queue(metric_name, v, self.singularity.update_ts)
             counter += 1
         # flush disaster metrics
+        # Disaster stats carry their own timestamp (in ms), stamp them with
+        # the cycle's like everything else so series line up
         latest_stat = self.singularity.disasters_stats.get('stats')[0]
-        ts = latest_stat.get('timestamp')
         for k, v in latest_stat.items():
             try:
                 metric_name = self.metric_mapping[k]
             except KeyError:
                 continue
-            self._add_to_queue(metric_name, v, ts)
+            self._add_to_queue(metric_name, v, self.singularity.update_ts)
             counter += 1
 
         log('flushed {} singularity metrics'.format(counter))
 
     def _add_to_queue(self, metric_name, metric_value, ts):
-        # The carbon plaintext protocol for metrics are
-        # <metric path> <metric value> <metric timestamp>
-        # The pickle protocol accepts a tuple
-        # [(path, (timestamp, value)), ...]
-        if not self.pickle:
-            self.queue.put('{} {} {}'.format(metric_name, metric_value, ts))
-        else:
-            self.queue.put((metric_name, (ts, metric_value)))
+        self.queue.put(format_metric(metric_name, metric_value, ts,
+                                     self.pickle))
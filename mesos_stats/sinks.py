@@ -0,0 +1,347 @@
+import re
+import queue
+import pickle
+import socket
+import struct
+import threading
+from urllib.parse import urlparse
+from . import util
+from .util import log
+from .carbon import Carbon
+from .prometheus import Exposition, MetricsServer
+
+SINK_BATCH = 5000  # datapoints encoded and written at a time
+SINK_BUFFER = 2000000  # datapoints a sink holds while it's behind
+STATSD_PACKET = 1400  # bytes per StatsD datagram
+
+# Sinks are handed batches of datapoints in the queue's pickle form,
+# [(path, (timestamp, value)), ...], and encode them in their format
+
+
+def encode_plaintext(batch, prefix=None):
+    ''' Carbon plaintext, "<path> <value> <timestamp>" lines '''
+    p = prefix + '.' if prefix else ''
+    return ''.join('{}{} {} {}\n'.format(p, path, v, ts)
+                   for path, (ts, v) in batch).encode()
+
+
+def encode_pickle(batch, prefix=None):
+    ''' Carbon pickle, the pickled batch behind its length '''
+    if prefix:
+        batch = [('{}.{}'.format(prefix, path), tv) for path, tv in batch]
+    payload = pickle.dumps(batch, protocol=2)
+    return struct.pack("!L", len(payload)) + payload
+
+
+def encode_statsd(batch, prefix=None):
+    '''
+        StatsD gauges, "<path>:<value>|g" lines packed into datagrams of up
+        to STATSD_PACKET bytes. StatsD stamps them itself. It takes a
+        signed value for a change to the gauge, so negative values are
+        sent as the gauge set to 0 then changed by them, in one datagram.
+    '''
+    p = prefix + '.' if prefix else ''
+    packets = []
+    lines = []
+    size = 0
+    for path, (ts, v) in batch:
+        line = '{}{}:{}|g'.format(p, path, v)
+        if str(v).startswith('-'):
+            line = '{}{}:0|g\n{}'.format(p, path, line)
+        line = line.encode()
+        if lines and size + len(line) + 1 > STATSD_PACKET:
+            packets.append(b'\n'.join(lines))
+            lines = []
+            size = 0
+        lines.append(line)
+        size += len(line) + 1
+    if lines:
+        packets.append(b'\n'.join(lines))
+    return packets
+
+
+def encode_influx(batch, prefix=None):
+    '''
+        InfluxDB line protocol, a measurement per path with its value in
+        the `value` field, timestamps in seconds
+    '''
+    p = prefix + '.' if prefix else ''
+    return ''.join('{}{} value={} {}\n'.format(
+        p, path.replace(',', '\\,').replace(' ', '\\ '), v, ts)
+        for path, (ts, v) in batch).encode()
+
+
+def encode_prometheus(batch, prefix=None):
+    '''
+        Nothing, the Prometheus exposition is rendered from the batches
+        once a cycle (see prometheus.py)
+    '''
+    return (prefix, batch)
+
+
+ENCODERS = {
+    'plaintext': encode_plaintext,
+    'pickle': encode_pickle,
+    'statsd': encode_statsd,
+    'influx': encode_influx,
+    'prometheus': encode_prometheus,
+}
+
+
+class Sink:
+    '''
+        A destination for the datapoints, written to from a thread of its
+        own out of its own buffer. When it falls `buffer` datapoints
+        behind, the oldest batches are dropped rather than holding up the
+        sends, and so are the batches it fails to write. end_cycle() has
+        the thread call flush() once it has written the cycle's batches,
+        however far behind it is.
+    '''
+    format = None
+
+    def __init__(self, name, buffer=SINK_BUFFER):
+        self.name = name
+        self.buffer = queue.Queue(max(buffer // SINK_BATCH, 1))
+        # dropped is counted from the producers' threads and the sink's
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        threading.Thread(target=self._run, name='sink ' + self.name,
+                         daemon=True).start()
+
+    def put(self, payload, datapoints):
+        '''
+            Hands an encoded batch over to the sink's thread, or None for
+            the end of a cycle. When the buffer's full its oldest batch is
+            dropped, the ends of cycles never are.
+        '''
+        buffer = self.buffer
+        with buffer.mutex:
+            items = buffer.queue
+            if len(items) >= buffer.maxsize:
+                for i, (queued, n) in enumerate(items):
+                    if queued is not None:
+                        del items[i]
+                        self.drop(n)
+                        break
+            items.append((payload, datapoints))
+            buffer.unfinished_tasks += 1
+            buffer.not_empty.notify()
+
+    def end_cycle(self):
+        self.put(None, 0)
+
+    def _run(self):
+        while True:
+            payload, datapoints = self.buffer.get()
+            try:
+                if payload is None:
+                    self.flush()
+                    continue
+                self.write(payload)
+                self.sent += datapoints
+            except Exception as e:
+                log('ERROR: {} sink failed, dropped {} datapoints: {}'
+                    .format(self.name, datapoints, e))
+                self.errors += 1
+                self.drop(datapoints)
+                self.close()
+
+    def drop(self, datapoints):
+        with self.lock:
+            self.dropped += datapoints
+
+    def write(self, payload):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def status(self):
+        return {'format': self.format, 'backlog': self.buffer.qsize(),
+                'sent': self.sent, 'dropped': self.dropped,
+                'errors': self.errors}
+
+
+class CarbonSink(Sink):
+    ''' Carbon's plaintext or pickle receiver, over TCP '''
+    def __init__(self, host, port, pickle=False, buffer=SINK_BUFFER):
+        Sink.__init__(self, 'carbon{}://{}:{}'.format(
+            '+pickle' if pickle else '', host, port), buffer)
+        self.format = 'pickle' if pickle else 'plaintext'
+        self.carbon = Carbon(host, None, pickle, port=port, pickle_port=port)
+
+    def write(self, payload):
+        self.carbon.send_payload(payload)
+
+    def close(self):
+        self.carbon.close()
+
+
+class StatsdSink(Sink):
+    ''' A StatsD server, over UDP '''
+    format = 'statsd'
+
+    def __init__(self, host, port, buffer=SINK_BUFFER):
+        Sink.__init__(self, 'statsd://{}:{}'.format(host, port), buffer)
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def write(self, packets):
+        for packet in packets:
+            self.sock.sendto(packet, self.address)
+
+
+class InfluxSink(Sink):
+    ''' An InfluxDB database, through its HTTP /write endpoint '''
+    format = 'influx'
+
+    def __init__(self, host, port, database, buffer=SINK_BUFFER):
+        Sink.__init__(self, 'influx://{}:{}/{}'.format(host, port,
+                                                       database), buffer)
+        self.url = 'http://{}:{}/write?db={}&precision=s'.format(
+            host, port, database)
+
+    def write(self, payload):
+        res = util.session.post(self.url, data=payload,
+                                timeout=util.DEFAULT_TIMEOUT)
+        if res.status_code != 204:
+            raise RuntimeError('HTTP {}: {}'.format(res.status_code,
+                                                    res.text[:200]))
+
+
+class PrometheusSink(Sink):
+    '''
+        Serves the latest value of every series on /metrics for Prometheus
+        to scrape, rendered once a cycle so scrapes cost next to nothing
+    '''
+    format = 'prometheus'
+
+    def __init__(self, host, port, buffer=SINK_BUFFER):
+        Sink.__init__(self, 'prometheus://{}:{}'.format(host, port), buffer)
+        self.exposition = Exposition()
+        self.server = MetricsServer(self.exposition, port, host)
+
+    def start(self):
+        self.server.start()
+        Sink.start(self)
+
+    def write(self, payload):
+        prefix, batch = payload
+        self.exposition.update(batch, prefix)
+
+    def flush(self):
+        self.exposition.render()
+
+
+def sink_from_url(url, buffer=SINK_BUFFER):
+    '''
+        Builds a sink from carbon://host:2003, carbon+pickle://host:2004,
+        statsd://host:8125, influx://host:8086/database or
+        prometheus://:9273, the address /metrics is served on
+    '''
+    parsed = urlparse(url)
+    host = parsed.hostname
+    if parsed.scheme in ('carbon', 'carbon+pickle'):
+        pickled = parsed.scheme == 'carbon+pickle'
+        return CarbonSink(host, parsed.port or (2004 if pickled else 2003),
+                          pickled, buffer)
+    if parsed.scheme == 'statsd':
+        return StatsdSink(host, parsed.port or 8125, buffer)
+    if parsed.scheme == 'influx':
+        database = parsed.path.strip('/')
+        if not database:
+            raise ValueError('No database in {}'.format(url))
+        return InfluxSink(host, parsed.port or 8086, database, buffer)
+    if parsed.scheme == 'prometheus':
+        return PrometheusSink(host or '', parsed.port or 9273, buffer)
+    raise ValueError('Unknown sink: {}'.format(url))
+
+
+class FanOut:
+    '''
+        Stands in for Carbon to send to several sinks in parallel. The
+        queue is taken SINK_BATCH datapoints at a time, each batch is
+        encoded once per format the sinks use and handed to their buffers
+        for their threads to write. Sends don't wait for the sinks, so
+        what they return is what was handed over. The final send of a
+        cycle ends the sinks' cycle too. The sinks' threads are started by
+        start(), or by the first send.
+    '''
+    def __init__(self, sinks, prefix=None, dry_run=False):
+        self.sinks = sinks
+        self.prefix = prefix
+        self.dry_run = dry_run
+        self.started = False
+        self.reported = {}  # sink name -> (sent, dropped) last reported
+        self.formats = {}  # format -> [sink, ...]
+        for sink in sinks:
+            self.formats.setdefault(sink.format, []).append(sink)
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            for sink in self.sinks:
+                sink.start()
+
+    def send_metrics(self, metrics, timeout, close=True, prefix=None):
+        '''
+            Hands everything in the queue to the sinks, in the pickle
+            form. Returns the number of datapoints and bytes encoded
+        '''
+        self.start()
+        prefix = self.prefix if prefix is None else prefix
+        total = 0
+        nbytes = 0
+        while True:
+            batch = []
+            while len(batch) < SINK_BATCH:
+                try:
+                    batch.append(metrics.get(block=False))
+                except queue.Empty:
+                    break
+            if batch and not self.dry_run:
+                for fmt, sinks in self.formats.items():
+                    payload = ENCODERS[fmt](batch, prefix)
+                    if isinstance(payload, bytes):
+                        nbytes += len(payload)
+                    elif fmt == 'statsd':
+                        nbytes += sum(len(p) for p in payload)
+                    for sink in sinks:
+                        sink.put(payload, len(batch))
+            total += len(batch)
+            if len(batch) < SINK_BATCH:
+                break
+        if close:
+            for sink in self.sinks:
+                sink.end_cycle()
+        log('Handed {} datapoints to {} sinks'.format(total,
+                                                      len(self.sinks)))
+        return (total, nbytes)
+
+    def status(self):
+        ''' Every sink's backlog and counters, for the status page '''
+        return {'sinks': {s.name: s.status() for s in self.sinks}}
+
+    def datapoints(self):
+        '''
+            What every sink wrote and dropped since the last call, and its
+            backlog, as [(path, value)]
+        '''
+        res = []
+        for sink in self.sinks:
+            name = re.sub('[^A-Za-z0-9]+', '_', sink.name)
+            sent, dropped = sink.sent, sink.dropped
+            last = self.reported.get(sink.name, (0, 0))
+            self.reported[sink.name] = (sent, dropped)
+            res += [('sinks.{}.sent'.format(name), sent - last[0]),
+                    ('sinks.{}.dropped'.format(name), dropped - last[1]),
+                    ('sinks.{}.backlog'.format(name),
+                     sink.buffer.qsize() * SINK_BATCH)]
+        return res
@@ -0,0 +1,65 @@
+import threading
+
+
+class SampleStore:
+    '''
+        Keeps the last good /metrics/snapshot and /monitor/statistics.json
+        of every agent. An agent that fails or misses the cycle's deadline
+        has its last sample flushed again instead of leaving a gap, for up
+        to `cycles` cycles. update() is called from the poll threads, also
+        for polls finishing after the deadline, so a late answer still
+        replaces the sample for the next cycle.
+    '''
+    def __init__(self, cycles):
+        self.cycles = cycles
+        self.lock = threading.Lock()
+        self.cycle = 0
+        # hostname -> [metrics, executors, cycle of metrics, of executors]
+        self.samples = {}
+
+    def start_cycle(self):
+        with self.lock:
+            self.cycle += 1
+
+    def update(self, hostname, metrics, executors):
+        with self.lock:
+            sample = self.samples.get(hostname)
+            if sample is None:
+                sample = self.samples[hostname] = [None, None, 0, 0]
+            if metrics:
+                sample[0], sample[2] = metrics, self.cycle
+            if executors:
+                sample[1], sample[3] = executors, self.cycle
+
+    def stale(self, hostnames, metrics=(), executors=()):
+        '''
+            Returns [(hostname, metrics, executors, cycles old)] for the
+            agents in hostnames that weren't flushed fresh this cycle,
+            `metrics` and `executors` being the ones that were. Samples too
+            old and agents no longer around are forgotten.
+        '''
+        with self.lock:
+            for hostname in set(self.samples) - set(hostnames):
+                del self.samples[hostname]
+            res = []
+            for hostname in hostnames:
+                sample = self.samples.get(hostname)
+                if sample is None:
+                    continue
+                m = e = None
+                ages = []
+                if hostname not in metrics and sample[0] is not None:
+                    if self.cycle - sample[2] <= self.cycles:
+                        m = sample[0]
+                        ages.append(self.cycle - sample[2])
+                    else:
+                        sample[0] = None
+                if hostname not in executors and sample[1] is not None:
+                    if self.cycle - sample[3] <= self.cycles:
+                        e = sample[1]
+                        ages.append(self.cycle - sample[3])
+                    else:
+                        sample[1] = None
+                if ages:
+                    res.append((hostname, m, e, max(ages)))
+        return res
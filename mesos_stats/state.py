@@ -0,0 +1,85 @@
+import os
+import gzip
+import json
+import time
+from .util import log
+
+STATE_VERSION = 1
+SAVE_TIMEOUT = 5  # seconds the save on shutdown waits for sends under way
+
+
+class StateStore:
+    '''
+        Checkpoints the in-memory state of the collector (elected master,
+        agent roster, task name resolutions, filter state) to a gzipped
+        JSON file so a restarted collector can pick up where it left off.
+
+        Components are registered by name and need to implement
+        dump_state() and load_state(state). State read from disk is handed
+        to a component as soon as it registers.
+    '''
+    def __init__(self, path, checkpoint_cycles=10):
+        self.path = path
+        self.checkpoint_cycles = checkpoint_cycles
+        self.cycles = 0
+        self.components = {}
+        self.restored = {}
+
+    def register(self, name, component):
+        self.components[name] = component
+        if name in self.restored:
+            component.load_state(self.restored.pop(name))
+
+    def load(self):
+        ''' Reads the snapshot from disk, returns True if one was found '''
+        try:
+            with gzip.open(self.path, 'rt') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            log('No state snapshot at {}, starting cold'.format(self.path))
+            return False
+        except (OSError, ValueError) as e:
+            log('Ignoring unreadable state snapshot {}: {}'
+                .format(self.path, e))
+            return False
+        if snapshot.get('version') != STATE_VERSION:
+            log('Ignoring state snapshot with version {}'
+                .format(snapshot.get('version')))
+            return False
+        log('Restoring state saved at {}'.format(snapshot['saved_at']))
+        self.restored = snapshot['components']
+        for name, component in self.components.items():
+            if name in self.restored:
+                component.load_state(self.restored.pop(name))
+        return True
+
+    def cycle_done(self):
+        ''' Saves a snapshot every `checkpoint_cycles` cycles '''
+        self.cycles += 1
+        if self.checkpoint_cycles and \
+                self.cycles % self.checkpoint_cycles == 0:
+            self.save()
+
+    def save(self):
+        '''
+            Writes the snapshot. Components are expected not to change
+            while it's taken, a snapshot that can't be taken or written is
+            logged and skipped
+        '''
+        # Write to a temporary file first so a crash mid-write can't leave
+        # a truncated snapshot behind
+        tmp = '{}.tmp'.format(self.path)
+        try:
+            snapshot = {
+                'version': STATE_VERSION,
+                'saved_at': int(time.time()),
+                'components': {name: c.dump_state()
+                               for name, c in self.components.items()},
+            }
+            with gzip.open(tmp, 'wt', compresslevel=6) as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except (OSError, TypeError, ValueError, RuntimeError) as e:
+            log('ERROR: Could not save state snapshot: {}'.format(e))
+            return
+        log('Saved state snapshot to {}'.format(self.path))
@@ -0,0 +1,212 @@
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+from . import util
+from .util import log
+from .mesos import POOL_SIZE, agent_requests
+
+PHASES = ('singularity', 'mesos', 'flush', 'send')
+# endpoint each tier polls agents through, used to pick the slowest agents
+AGENT_ENDPOINTS = {'agent': 'agent.metrics_snapshot',
+                   'executor': 'agent.statistics'}
+STALE_INTERVALS = 3  # a group is dead after this many intervals of silence
+
+
+class CycleStatus:
+    '''
+        Live view of the collection cycles for the status endpoint: the phase
+        every tier group is in, the timings of the last `history` cycles
+        split by phase, and the `slowest` agents of the last cycle.
+
+        Collector threads only record timings, the JSON for finished cycles
+        is rendered once at the end of a cycle and served as is.
+    '''
+    def __init__(self, carbon=None, history=20, slowest=10):
+        self.carbon = carbon
+        self.history = history
+        self.slowest = slowest
+        self.lock = threading.Lock()
+        self.groups = {}
+        self.current = {}  # group name -> {'phase', 'tick', 'since'}
+        self.cycles = {}  # group name -> deque of finished cycles
+        self.last_event = {}
+        self.last_ok = {}
+        self.agent_times = {e: {} for e in AGENT_ENDPOINTS.values()}
+        self._running = {}
+        self._rendered = b'{}'
+
+    def add_group(self, group):
+        self.groups[group.name] = group
+        self.current[group.name] = {'phase': 'idle'}
+        self.cycles[group.name] = deque(maxlen=self.history)
+        self.last_event[group.name] = time.time()
+        self.last_ok[group.name] = None
+
+    def install(self):
+        ''' Starts timing agent requests made through try_get_json '''
+        util.request_observers.append(self.observe_request)
+
+    def uninstall(self):
+        util.request_observers.remove(self.observe_request)
+
+    def observe_request(self, endpoint, url, seconds, nbytes, ok):
+        times = self.agent_times.get(endpoint)
+        if times is None:
+            return
+        host = urlparse(url).hostname
+        with self.lock:
+            times[host] = times.get(host, 0.0) + seconds
+
+    def start_cycle(self, name, tick):
+        now = time.time()
+        self._running[name] = {'tick': int(tick), 'started': now,
+                               'phases': dict.fromkeys(PHASES, 0.0),
+                               'phase': None, 'phase_started': now}
+        self.last_event[name] = now
+        self.current[name] = {'phase': 'starting', 'tick': int(tick),
+                              'since': now}
+
+    def phase(self, name, phase):
+        ''' Switches the group to `phase`, closing the running one '''
+        cycle = self._running.get(name)
+        if cycle is None or cycle['phase'] == phase:
+            return
+        now = time.time()
+        if cycle['phase']:
+            cycle['phases'][cycle['phase']] += now - cycle['phase_started']
+        cycle['phase'] = phase
+        cycle['phase_started'] = now
+        self.last_event[name] = now
+        # replaced rather than updated so readers never see it half written
+        self.current[name] = {'phase': phase, 'tick': cycle['tick'],
+                              'since': now}
+
+    def end_cycle(self, name, ok=True):
+        cycle = self._running.pop(name, None)
+        if cycle is None:
+            return
+        now = time.time()
+        if cycle['phase']:
+            cycle['phases'][cycle['phase']] += now - cycle['phase_started']
+        record = {'tick': cycle['tick'],
+                  'duration': now - cycle['started'],
+                  'ok': ok,
+                  'phases': cycle['phases']}
+        with self.lock:
+            self.cycles[name].append(record)
+            for tier, endpoint in AGENT_ENDPOINTS.items():
+                if tier in self.groups[name].tiers:
+                    record.setdefault('slowest_agents', []).extend(
+                        self._slowest(endpoint))
+                    self.agent_times[endpoint] = {}
+            self._render()
+        self.last_event[name] = now
+        if ok:
+            self.last_ok[name] = now
+        self.current[name] = {'phase': 'idle', 'tick': cycle['tick'],
+                              'since': now}
+
+    def _slowest(self, endpoint):
+        times = self.agent_times[endpoint]
+        ordered = sorted(times.items(), key=lambda i: i[1], reverse=True)
+        return [{'agent': host, 'endpoint': endpoint, 'seconds': seconds}
+                for host, seconds in ordered[:self.slowest]]
+
+    def _render(self):
+        self._rendered = json.dumps(
+            {name: list(cycles) for name, cycles in self.cycles.items()}
+        ).encode()
+
+    def alive(self, now=None):
+        ''' Every group has started, ended or switched phase recently '''
+        now = now or time.time()
+        return all(now - self.last_event[name] <
+                   STALE_INTERVALS * g.scheduler.interval
+                   for name, g in self.groups.items())
+
+    def ready(self, now=None):
+        ''' Alive, and every group has completed a cycle successfully '''
+        return self.alive(now) and \
+            all(t is not None for t in self.last_ok.values())
+
+    def pool_status(self):
+        '''
+            The agent requests under way, how many may be (the adaptive
+            limit when requests adapt) and the HTTP connection pools
+        '''
+        controller = util.controller
+        return {'in_flight': agent_requests.count,
+                'limit': int(controller.limit) if controller else POOL_SIZE,
+                'adaptive': controller is not None,
+                'http_pools': util.HTTP_POOLS,
+                'http_pool_size': util.HTTP_POOL_SIZE}
+
+    def status_json(self):
+        ''' The pre-rendered cycle history plus the live state '''
+        live = {
+            'alive': self.alive(),
+            'ready': self.ready(),
+            'current': self.current,
+            'queues': {name: g.queue.qsize()
+                       for name, g in self.groups.items()},
+            'pool': self.pool_status(),
+        }
+        if self.carbon:
+            live['carbon'] = self.carbon.status()
+        return json.dumps(live)[:-1].encode() + b', "cycles": ' + \
+            self._rendered + b'}'
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    '''
+        /status   cycle telemetry as JSON
+        /healthz  liveness, 200 as long as every group is cycling
+        /ready    readiness, 200 once every group has completed a cycle
+    '''
+    def do_GET(self):
+        status = self.server.status
+        path = urlparse(self.path).path
+        if path == '/status':
+            self._reply(200, status.status_json())
+        elif path == '/healthz':
+            self._check(status.alive())
+        elif path == '/ready':
+            self._check(status.ready())
+        else:
+            self._reply(404, b'{"error": "not found"}')
+
+    def _check(self, ok):
+        if ok:
+            self._reply(200, b'{"ok": true}')
+        else:
+            self._reply(503, b'{"ok": false}')
+
+    def _reply(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StatusServer(ThreadingMixIn, HTTPServer):
+    ''' Serves a CycleStatus from a daemon thread '''
+    daemon_threads = True
+
+    def __init__(self, status, port, host=''):
+        HTTPServer.__init__(self, (host, port), StatusHandler)
+        self.status = status
+
+    def start(self):
+        log('Serving status on port {}'.format(self.server_address[1]))
+        t = threading.Thread(target=self.serve_forever, name='status',
+                             daemon=True)
+        t.start()
+        return t
@@ -0,0 +1,325 @@
+import time
+import queue
+from . import util
+from .util import log, Timer
+from .mesos import MesosCarbon
+from .scheduler import Scheduler
+from .singularity import SingularityCarbon
+from .shards import ShardPool
+from .stale import SampleStore
+
+# Data sources that can be collected at their own rate
+#   cluster:     master /metrics/snapshot
+#   framework:   master /frameworks, or /state-summary without task metrics
+#   agent:       agent /metrics/snapshot
+#   executor:    agent /monitor/statistics.json
+#   singularity: Singularity /api/*
+TIERS = ('cluster', 'framework', 'agent', 'executor', 'singularity')
+# Where the agent tier's series come from
+#   agent:       every agent's /metrics/snapshot
+#   master:      resources from the master's /slaves, the rest from agents
+#   master_only: resources from the master's /slaves, no agent requests
+AGENT_SOURCES = ('agent', 'master', 'master_only')
+SEND_EVERY = 1.0  # seconds between sends while agents are being staggered
+
+
+def group_tiers(intervals, default, tiers=TIERS):
+    '''
+        Groups the tiers to collect sharing the same interval, tiers that
+        aren't listed in intervals are collected every `default` seconds.
+        Returns [(interval, [tier, ...]), ...]
+    '''
+    unknown = set(intervals) - set(TIERS)
+    if unknown:
+        raise ValueError('Unknown collection tier(s): {}'
+                         .format(', '.join(sorted(unknown))))
+    groups = {}
+    for tier in tiers:
+        groups.setdefault(intervals.get(tier, default), []).append(tier)
+    return sorted(groups.items())
+
+
+class TierGroup:
+    '''
+        A set of tiers collected together on one schedule into their own
+        queue. Every group flushes through its own MesosCarbon and
+        SingularityCarbon so datapoints carry the group's tick time.
+
+        Agents are streamed: each agent's response is flushed and dropped
+        as it comes in, and what's been flushed is sent every SEND_EVERY
+        seconds. With a `stagger` window agents are polled at stable
+        offsets spread over that many seconds after the tick. With a
+        MemoryGuard over its ceiling, polling waits for the queue to be
+        sent before going on. With more than one of `processes`, agents
+        are polled and flushed in shards by a pool of worker processes.
+
+        Agents that haven't answered `agent_deadline` seconds after the
+        tick are left out. With `stale_cycles`, those and the ones that
+        failed have their last good sample flushed again for up to that
+        many cycles, along with a slave.<agent>.stale datapoint.
+
+        Groups of another `cluster` than the first are named after it,
+        e.g. prod-b.agent_executor.
+    '''
+    def __init__(self, tiers, scheduler, mesos, singularity=None,
+                 pickle=False, stagger=0, instrumentation=None, observers=(),
+                 memory_guard=None, processes=1, refresh_tasks=False,
+                 agent_source='agent', framework_tasks=True,
+                 agent_deadline=0, stale_cycles=0, cluster=None):
+        if agent_source not in AGENT_SOURCES:
+            raise ValueError('Unknown agent metrics source: {}'
+                             .format(agent_source))
+        if stale_cycles and processes > 1:
+            raise ValueError('Stale agent samples are kept in the '
+                             'collector process, not in worker processes')
+        self.tiers = tiers
+        self.agent_source = agent_source
+        self.framework_tasks = framework_tasks
+        self.instrumentation = instrumentation
+        # notified of cycle starts, phase changes and ends, e.g. CycleStatus
+        self.observers = list(observers)
+        self.memory_guard = memory_guard
+        if memory_guard:
+            self.observers.append(memory_guard)
+        self.stagger = stagger
+        # Refresh Singularity's active tasks for executor names when no
+        # group collects the singularity tier
+        self.refresh_tasks = refresh_tasks
+        self.shard_pool = ShardPool(processes) if processes > 1 else None
+        self.agent_deadline = agent_deadline
+        self.samples = SampleStore(stale_cycles) if stale_cycles else None
+        self.name = 'all' if len(tiers) == len(TIERS) else '_'.join(tiers)
+        if cluster:
+            self.name = '{}.{}'.format(cluster, self.name)
+        self.cluster = cluster
+        self.scheduler = scheduler
+        self.mesos = mesos
+        self.singularity = singularity
+        self.queue = queue.Queue()
+        # what worker processes encoded for Carbon, sent after the queue
+        self.payloads = []
+        self.mesos_carbon = MesosCarbon(mesos, self.queue, singularity,
+                                        pickle)
+        self.mesos_carbon.resources_from_master = agent_source != 'agent'
+        if singularity:
+            self.singularity_carbon = SingularityCarbon(singularity,
+                                                        self.queue, pickle)
+
+    @classmethod
+    def from_config(cls, intervals, scheduler, mesos, singularity=None,
+                    pickle=False, stagger_spread=0, instrumentation=None,
+                    memory_guard=None, processes=1, tiers=TIERS,
+                    agent_source='agent', framework_tasks=True,
+                    agent_deadline=0, stale_cycles=0, cluster=None):
+        '''
+            Builds one group per distinct interval, stagger_spread is the
+            fraction of the interval agent polls are spread over and
+            agent_deadline the fraction agents have to answer in. Only
+            `tiers` are collected, e.g. the agent tiers on agent shards.
+        '''
+        refresh_tasks = 'singularity' not in tiers
+        return [cls(group, Scheduler(interval, scheduler.overrun), mesos,
+                    singularity, pickle, stagger=interval * stagger_spread,
+                    instrumentation=instrumentation,
+                    memory_guard=memory_guard, processes=processes,
+                    refresh_tasks=refresh_tasks, agent_source=agent_source,
+                    framework_tasks=framework_tasks,
+                    agent_deadline=interval * agent_deadline,
+                    stale_cycles=stale_cycles, cluster=cluster)
+                for interval, group in group_tiers(intervals,
+                                                   scheduler.interval,
+                                                   tiers)]
+
+    def collect(self, timestamp, send=None):
+        '''
+            Fetches and flushes every tier of the group, `send` is called to
+            push out what's been flushed so far while agents are staggered
+        '''
+        ts = int(timestamp)
+        self.mesos_carbon.update_ts = ts
+        if self.singularity and 'singularity' in self.tiers:
+            with Timer("Singularity metrics collection"):
+                self.phase('singularity')
+                self.singularity.update(timestamp)
+                self.phase('flush')
+                self._flush('singularity', self.singularity_carbon.flush_all)
+        if 'cluster' in self.tiers:
+            with Timer("Mesos cluster metrics collection"):
+                self.phase('mesos')
+                self.mesos.update_cluster()
+                self.phase('flush')
+                self._flush('cluster', self.mesos_carbon.flush_cluster_metrics)
+        if 'framework' in self.tiers:
+            with Timer("Mesos framework metrics collection"):
+                self.phase('mesos')
+                self.mesos.update_frameworks(self.framework_tasks)
+                self.phase('flush')
+                self._flush('framework',
+                            self.mesos_carbon.flush_framework_metrics)
+                if self.framework_tasks:
+                    self._flush('framework_task',
+                                self.mesos_carbon.flush_framework_task_metrics)
+                self.mesos.framework_metrics = None
+        if 'agent' in self.tiers or 'executor' in self.tiers:
+            self.phase('mesos')
+            self.mesos.update_slaves()
+            # groups share the roster, another one's update can replace it
+            # while this one's going through it
+            slaves = self.mesos.slaves
+            if slaves:
+                self._collect_agents(timestamp, send, slaves)
+
+    def start_cycle(self, tick):
+        for o in self.observers:
+            o.start_cycle(self.name, tick)
+
+    def phase(self, phase):
+        for o in self.observers:
+            o.phase(self.name, phase)
+
+    def end_cycle(self, ok=True):
+        for o in self.observers:
+            o.end_cycle(self.name, ok)
+
+    def _over_memory(self):
+        return self.memory_guard is not None and \
+            self.memory_guard.over(
+                self.name, self.queue.qsize() +
+                sum(p.datapoints for p in self.payloads))
+
+    def _flush(self, name, fn, *args):
+        if self.instrumentation:
+            return self.instrumentation.flush(name, self.queue, fn, *args)
+        return fn(*args)
+
+    def _collect_agents(self, timestamp, send, slaves):
+        mc = self.mesos_carbon
+        executor = 'executor' in self.tiers
+        agent = 'agent' in self.tiers
+        if agent and self.agent_source != 'agent':
+            self.phase('flush')
+            n = self._flush('agent_resources', mc.flush_slave_resources,
+                            slaves)
+            log('flushed {} slave resource metrics from the master'
+                .format(n))
+            # what's left of the agent tier is scraped from the agents
+            agent = self.agent_source == 'master'
+        if not (agent or executor):
+            return
+        sing_lookup = None
+        if executor and self.singularity:
+            if self.refresh_tasks:
+                self.phase('singularity')
+                self.singularity.active_tasks = \
+                    self.singularity.get_active_tasks()
+            sing_lookup = self.singularity.get_singularity_lookup()
+        deadline = None
+        if self.agent_deadline:
+            deadline = timestamp + self.agent_deadline
+        if self.shard_pool:
+            return self._collect_shards(timestamp, send, slaves, agent,
+                                        executor, sing_lookup, deadline)
+        samples = self.samples
+        on_sample = None
+        fresh = ([], [])  # agents whose metrics, executors were flushed
+        if samples:
+            samples.start_cycle()
+            on_sample = samples.update
+        task_names = {}
+        counter = 0
+        last_send = time.time()
+        with Timer("Mesos agent collection"):
+            self.phase('mesos')
+            for hostname, metrics, executors in self.mesos.poll_slaves(
+                    timestamp, self.stagger, agent, executor, deadline,
+                    on_sample, slaves):
+                self.phase('flush')
+                counter += self._flush_agent(hostname, metrics, executors,
+                                             agent, executor, sing_lookup,
+                                             task_names)
+                if metrics:
+                    fresh[0].append(hostname)
+                if executors:
+                    fresh[1].append(hostname)
+                last_send = self._partial_send(send, last_send)
+                self.phase('mesos')
+            if samples:
+                self.phase('flush')
+                hostnames = [s['hostname'] for s in slaves]
+                stale = samples.stale(hostnames, set(fresh[0]),
+                                      set(fresh[1]))
+                for hostname, metrics, executors, age in stale:
+                    counter += self._flush_agent(
+                        hostname, metrics, executors, agent, executor,
+                        sing_lookup, task_names)
+                    mc.flush_slave_stale(hostname, age)
+                log('flushed the last samples of {} agents'.format(
+                    len(stale)))
+        if sing_lookup is not None:
+            mc.task_names = task_names
+        log('flushed {} slave metrics'.format(counter))
+
+    def _flush_agent(self, hostname, metrics, executors, agent, executor,
+                     sing_lookup, task_names):
+        ''' Flushes one agent's answers, returns its agent datapoints '''
+        mc = self.mesos_carbon
+        counter = 0
+        if agent:
+            counter += self._flush('agent', mc.flush_slave, hostname,
+                                   metrics)
+        if executor:
+            self._flush('executor', mc.flush_executors, hostname,
+                        executors, sing_lookup, task_names)
+        return counter
+
+    def _collect_shards(self, timestamp, send, slaves, agent, executor,
+                        sing_lookup, deadline=None):
+        '''
+            _collect_agents through the shard pool: what the workers
+            flushed, requested and timed is merged in here
+        '''
+        mc = self.mesos_carbon
+        task_names = {}
+        counter = 0
+        last_send = time.time()
+        with Timer("Mesos agent collection in {} processes".format(
+                self.shard_pool.processes)):
+            self.phase('mesos')
+            for datapoints, payloads, n, resolved, requests, flushers in \
+                    self.shard_pool.collect(mc, timestamp, self.stagger,
+                                            agent, executor, sing_lookup,
+                                            deadline, slaves):
+                self.phase('flush')
+                util.refill_queue(self.queue, datapoints)
+                self.payloads += payloads
+                counter += n
+                task_names.update(resolved)
+                for args in requests:
+                    for observer in util.request_observers:
+                        observer(*args)
+                if self.instrumentation:
+                    for name, (count, seconds) in flushers.items():
+                        self.instrumentation.observe_flush(name, count,
+                                                           seconds)
+                last_send = self._partial_send(send, last_send)
+                self.phase('mesos')
+        if sing_lookup is not None:
+            mc.task_names = task_names
+        log('flushed {} slave metrics'.format(counter))
+
+    def _partial_send(self, send, last_send):
+        '''
+            Sends what's been flushed so far every SEND_EVERY seconds, or
+            right away when over the memory ceiling. Returns when the last
+            send happened
+        '''
+        if send and self._over_memory():
+            # Backpressure: agents stop being fetched while we wait for
+            # the queue to go out
+            self.memory_guard.pause(self.name)
+            send(final=False)
+            return time.time()
+        if send and time.time() - last_send >= SEND_EVERY:
+            send(final=False)
+            return time.time()
+        return last_send
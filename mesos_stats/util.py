@@ -2,30 +2,114 @@ import json
 import time
 import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
 
+HTTP_POOLS = 100  # hosts connections are kept open to
+HTTP_POOL_SIZE = 10  # connections kept open per host
 
-def try_get_json(url, timeout=20):
+
+def new_session():
+    '''
+        A requests session keeping connections open between requests,
+        shared by every cluster and thread
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOLS,
+                          pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Called with (endpoint, url, seconds, bytes received, success) after
+# every request made by try_get_json
+request_observers = []
+
+session = new_session()
+
+# What try_get_json fetches urls with, swapped out to record or replay
+# API traffic (see replay.py)
+transport = session.get
+
+# Where try_get_json looks for responses before fetching them, a
+# ResponseCache when enabled (see cache.py)
+cache = None
+
+# Sets request timeouts and agent concurrency when enabled, a
+# RequestController (see adaptive.py)
+controller = None
+
+DEFAULT_TIMEOUT = 20
+
+
+def endpoint_name(url):
+    ''' Metric friendly name for the endpoint of a url '''
+    parsed = urlparse(url)
+    name = parsed.path.strip('/').replace('/', '_').replace('.', '_')
+    if parsed.query:
+        name += '_' + parsed.query.split('=')[-1].lower()
+    return name or 'root'
+
+
+def try_get_json(url, timeout=None, endpoint=None):
+    endpoint = endpoint or endpoint_name(url)
+    if cache is not None:
+        res = cache.get(endpoint, url)
+        if res is not None:
+            return res
+    if timeout is None:
+        timeout = controller.timeout(endpoint) if controller is not None \
+            else DEFAULT_TIMEOUT
     t = time.time()
+    nbytes = 0
+    ok = False
     try:
-        response = requests.get(url, timeout=timeout)
-    except requests.exceptions.Timeout:
-        log("GET %s timed out after %s." % (url, time.time()-t))
-        raise
-    except requests.exceptions.MissingSchema:
-        log("%s is not a valid URL" % url)
-        raise
-    except requests.exceptions.ConnectionError as e:
-        log("GET %s failed: %s" % (url, e))
-        raise
-    except:
-        log("Unexpected error from %s : %s" % (url, sys.exc_info()[0]))
-        raise
-
-    if response.status_code == 200:
-        return json.loads(response.text)
-    else:
-        log("GET %s failed - Non 200 HTTP Error" % url)
-        return False
+        try:
+            response = transport(url, timeout=timeout)
+        except requests.exceptions.Timeout:
+            log("GET %s timed out after %s." % (url, time.time()-t))
+            raise
+        except requests.exceptions.MissingSchema:
+            log("%s is not a valid URL" % url)
+            raise
+        except requests.exceptions.ConnectionError as e:
+            log("GET %s failed: %s" % (url, e))
+            raise
+        except:
+            log("Unexpected error from %s : %s" % (url, sys.exc_info()[0]))
+            raise
+
+        nbytes = len(response.content)
+        if response.status_code == 200:
+            res = json.loads(response.text)
+            ok = True
+            if cache is not None:
+                cache.put(endpoint, url, res, nbytes)
+            return res
+        else:
+            log("GET %s failed - Non 200 HTTP Error" % url)
+            return False
+    finally:
+        for observer in request_observers:
+            observer(endpoint, url, time.time() - t, nbytes, ok)
+
+
+def drain_queue(q):
+    ''' Empties a queue.Queue in one go and returns its items as a list '''
+    with q.mutex:
+        items = list(q.queue)
+        q.queue.clear()
+        q.not_full.notify_all()
+    return items
+
+
+def refill_queue(q, items):
+    ''' Puts a list of items back on a queue.Queue in one go '''
+    with q.mutex:
+        q.queue.extend(items)
+        q.unfinished_tasks += len(items)
+        q.not_empty.notify_all()
 
 
 def log(message):
@@ -0,0 +1,85 @@
+import time
+import unittest
+import threading
+import requests_mock
+
+from mesos_stats import util
+from mesos_stats.adaptive import RequestController, MIN_SAMPLES
+from mesos_stats.mesos import Mesos
+
+
+class AdaptiveTest(unittest.TestCase):
+    def test_timeouts_follow_p99(self):
+        c = RequestController(min_timeout=1, max_timeout=30)
+        self.assertEqual(c.timeout('master.slaves'), util.DEFAULT_TIMEOUT)
+        for _ in range(MIN_SAMPLES):
+            c.observe('master.slaves', 'url', 2.0, 0, True)
+        self.assertEqual(c.timeout('master.slaves'), 6.0)
+        for _ in range(MIN_SAMPLES):
+            c.observe('master.state', 'url', 0.01, 0, True)
+            c.observe('singularity.state', 'url', 25, 0, False)
+        self.assertEqual(c.timeout('master.state'), 1)
+        self.assertEqual(c.timeout('singularity.state'), 30)
+
+    def test_aimd(self):
+        c = RequestController(max_concurrency=12, concurrency=10)
+        for _ in range(10):
+            c.observe('agent.statistics', 'url', 0.1, 0, True)
+        self.assertEqual(c.limit, 11)
+        for _ in range(11):
+            c.observe('agent.statistics', 'url', 0.1, 0, True)
+        self.assertEqual(c.limit, 12)  # the ceiling
+        for _ in range(12):
+            c.observe('agent.statistics', 'url', 0.1, 0, True)
+        self.assertEqual(c.limit, 12)
+
+        # errors halve it
+        for i in range(12):
+            c.observe('agent.statistics', 'url', 0.1, 0, i % 2)
+        self.assertEqual(c.limit, 6)
+        # and so does a round much slower than usual
+        for _ in range(6):
+            c.observe('agent.statistics', 'url', 1.0, 0, True)
+        self.assertEqual(c.limit, 3)
+        self.assertEqual(dict(c.datapoints())['adaptive.concurrency'], 3)
+        self.assertEqual(dict(c.datapoints())['adaptive.backoffs'], 0)
+
+    def test_acquire_waits_for_a_slot(self):
+        c = RequestController(concurrency=1)
+        c.acquire()
+        acquired = threading.Event()
+
+        def poll():
+            c.acquire()
+            acquired.set()
+        threading.Thread(target=poll, daemon=True).start()
+        self.assertFalse(acquired.wait(0.1))
+        c.release()
+        self.assertTrue(acquired.wait(1))
+
+    def test_poll_slaves_in_flight(self):
+        c = RequestController(concurrency=2, max_concurrency=2)
+        c.install()
+        self.addCleanup(c.uninstall)
+        peak = [0]
+
+        def agent(request, context):
+            peak[0] = max(peak[0], c.in_flight)
+            time.sleep(0.01)
+            return {}
+
+        mesos = Mesos(['mesos1'], discover=False)
+        mesos.slaves = [{'hostname': 'agent%d' % i, 'port': 5051}
+                        for i in range(10)]
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', requests_mock.ANY, json=agent)
+            res = list(mesos.poll_slaves(0, 0))
+        self.assertEqual(len(res), 10)
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(c.in_flight, 0)
+        self.assertIn('adaptive.timeout.agent.metrics_snapshot',
+                      dict(c.datapoints()))
+
+
+if __name__ == '__main__':
+    unittest.main()
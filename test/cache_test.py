@@ -0,0 +1,108 @@
+import unittest
+import threading
+import requests_mock
+
+from mesos_stats.cache import ResponseCache
+from mesos_stats.mesos import Mesos
+from mesos_stats.singularity import Singularity
+from mesos_stats.util import try_get_json
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache({'master.slaves': 300})
+        self.cache.install()
+        self.addCleanup(self.cache.uninstall)
+
+    def test_memo_lasts_a_cycle(self):
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://mesos1/metrics/snapshot',
+                           json={'master/elected': 1})
+            self.cache.start_cycle('cluster', 1000)
+            mesos = Mesos(['mesos1'], discover=False)
+            mesos.update_cluster()  # finds the master, then its metrics
+            self.assertEqual(m.call_count, 1)
+            self.cache.end_cycle('cluster')
+            mesos.update_cluster()
+            self.assertEqual(m.call_count, 2)
+        self.assertEqual(self.cache.datapoints(), [
+            ('cache.master.metrics_snapshot.hits', 1),
+            ('cache.master.metrics_snapshot.misses', 2)])
+        self.assertEqual(self.cache.datapoints(), [])
+
+    def test_memo_is_per_thread(self):
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://mesos1/state', json={'a': 1})
+            try_get_json('http://mesos1/state')
+            t = threading.Thread(target=try_get_json,
+                                 args=('http://mesos1/state',))
+            t.start()
+            t.join()
+            self.assertEqual(m.call_count, 2)
+
+    def test_ttl(self):
+        slaves = {'slaves': [{'id': 'S1', 'hostname': 'slave1'}]}
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://mesos1/slaves', json=slaves)
+            m.register_uri('GET', 'http://mesos1/metrics/snapshot',
+                           json={'master/elected': 1})
+            m.register_uri('GET', 'http://mesos2/metrics/snapshot',
+                           json={'master/elected': 1})
+            m.register_uri('GET', 'http://mesos2/slaves', json=slaves)
+            mesos = Mesos(['mesos1'], discover=False)
+            mesos.master = 'mesos1'
+            for _ in range(3):
+                mesos.update_slaves()
+                self.cache.end_cycle('agent')
+            self.assertEqual(m.call_count, 1)
+
+            # a new leader, the old one's roster is dropped
+            self.cache.entries['http://mesos2/slaves'] = \
+                (float('inf'), 'master.slaves', slaves)
+            mesos.master_list = ['mesos2']
+            mesos.master = mesos._get_master()
+            self.assertEqual(mesos.master, 'mesos2')
+            self.assertEqual(self.cache.entries, {})
+
+    def test_big_rosters_are_memoised(self):
+        slaves = {'slaves': [{'id': 'S%d' % i, 'hostname': 'slave%d' % i}
+                             for i in range(5000)]}
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://mesos1/slaves', json=slaves)
+            m.register_uri('GET', 'http://mesos1/frameworks', json=slaves)
+            for _ in range(2):
+                try_get_json('http://mesos1/slaves', endpoint='master.slaves')
+                try_get_json('http://mesos1/frameworks',
+                             endpoint='master.frameworks')
+            self.assertEqual(
+                [r.url for r in m.request_history],
+                ['http://mesos1/slaves', 'http://mesos1/frameworks',
+                 'http://mesos1/frameworks'])
+
+    def test_cached_responses_are_not_changed(self):
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://sing1/api/state',
+                           json={'activeTasks': 1})
+            m.register_uri('GET', 'http://sing1/api/slaves',
+                           json=[{'id': 'S1'}])
+            singularity = Singularity('sing1', update=False)
+            state = singularity.get_state()
+            self.assertEqual(state['decommissionedSlaves'], 1)
+            self.assertEqual(try_get_json('http://sing1/api/state'),
+                             {'activeTasks': 1})
+
+    def test_agents_and_failures_not_cached(self):
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://slave1:5051/metrics/snapshot',
+                           json={'slave/cpus_total': 1})
+            m.register_uri('GET', 'http://mesos1/slaves', status_code=503)
+            for _ in range(2):
+                try_get_json('http://slave1:5051/metrics/snapshot',
+                             endpoint='agent.metrics_snapshot')
+                self.assertFalse(try_get_json('http://mesos1/slaves',
+                                              endpoint='master.slaves'))
+            self.assertEqual(m.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
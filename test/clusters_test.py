@@ -0,0 +1,65 @@
+import time
+import threading
+import unittest
+
+from mesos_stats.carbon import Carbon
+from mesos_stats.clusters import cluster_names, env_suffix
+from mesos_stats.mesos import Mesos
+from mesos_stats.scheduler import Scheduler
+from mesos_stats.sender import Sender
+from mesos_stats.tiers import TierGroup
+from benchmarks.simulator import ClusterSpec, Simulator
+from benchmarks.carbon_sink import CarbonSink
+
+
+class ClustersTest(unittest.TestCase):
+    def test_config(self):
+        self.assertEqual(cluster_names(' prod-b, ,prod-c'),
+                         ['prod-b', 'prod-c'])
+        self.assertEqual(env_suffix('prod-b'), '_PROD_B')
+
+    def test_slow_cluster_does_not_hold_up_the_others(self):
+        fast = Simulator(ClusterSpec(agents=3, executors=1), port=0)
+        slow = Simulator(ClusterSpec(agents=3, executors=1, slow_agents=3,
+                                     slow_latency=1.0), port=0)
+        sink = CarbonSink()
+        for server in [fast, slow, sink]:
+            server.start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+
+        carbon = Carbon('127.0.0.1', 'a', port=sink.port)
+        first = Sender(carbon)
+        second = Sender(carbon, prefix='b', lock=first.lock)
+        groups = [TierGroup(['agent'], Scheduler(60), Mesos([fast.master])),
+                  TierGroup(['agent'], Scheduler(60), Mesos([slow.master]),
+                            cluster='b')]
+        self.assertEqual(groups[1].name, 'b.agent')
+        done = {}
+
+        def cycle(group, sender):
+            group.collect(1500000000)
+            sender.send(group.queue, 1500000000, time.time() + 60)
+            done[group.name] = time.time()
+
+        t = time.time()
+        threads = [threading.Thread(target=cycle, args=args)
+                   for args in zip(groups, [first, second])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(done['agent'] - t, 0.9)
+        self.assertGreater(done['b.agent'] - t, 0.9)
+
+        for _ in range(50):
+            if sink.stats.datapoints >= 90:
+                break
+            time.sleep(0.05)
+        self.assertEqual(sink.stats.datapoints, 90)  # 2 x 3 agents x 15
+        prefixes = set(p.split('.')[0] for p in sink.stats.paths)
+        self.assertEqual(prefixes, {'a', 'b'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import queue
+
+from mesos_stats.dedup import ChangeSuppressor
+
+
+def drain(q):
+    res = []
+    while not q.empty():
+        res.append(q.get())
+    return [m for m in res if not m.startswith('collector.')]
+
+
+class ChangeSuppressorTest(unittest.TestCase):
+    def test_suppresses_unchanged_values(self):
+        cs = ChangeSuppressor(heartbeat=10)
+        q = queue.Queue()
+        q.put('slave.s1.cpus.total 32 1000')
+        q.put('slave.s1.cpus.used 1 1000')
+        cs.filter(q, 1000)
+        self.assertEqual(len(drain(q)), 2)
+
+        q.put('slave.s1.cpus.total 32 1060')
+        q.put('slave.s1.cpus.used 2 1060')
+        cs.filter(q, 1060)
+        self.assertEqual(drain(q), ['slave.s1.cpus.used 2 1060'])
+
+    def test_heartbeat_resends(self):
+        cs = ChangeSuppressor(heartbeat=3)
+        sent = []
+        for i in range(7):
+            q = queue.Queue()
+            q.put('slave.s1.cpus.total 32 {}'.format(i))
+            cs.filter(q, i)
+            sent.append(len(drain(q)))
+        self.assertEqual(sent, [1, 0, 0, 1, 0, 0, 1])
+
+    def test_reports_suppression_metrics(self):
+        cs = ChangeSuppressor(heartbeat=10, pickle=True)
+        for ts in [1000, 1060]:
+            q = queue.Queue()
+            q.put(('cluster.cpus.total', (ts, 32)))
+            cs.filter(q, ts)
+        cs.report(q, 1060)
+        stats = {}
+        while not q.empty():
+            path, (ts, value) = q.get()
+            stats[path] = value
+        self.assertEqual(stats['collector.dedup.suppressed'], 1)
+        self.assertEqual(stats['collector.dedup.sent'], 1)
+        self.assertEqual(stats['collector.dedup.percent'], 50.0)
+
+        # Stats are reset after each report
+        q = queue.Queue()
+        cs.report(q, 1120)
+        path, (ts, value) = q.get()
+        self.assertEqual((path, value), ('collector.dedup.suppressed', 0))
@@ -0,0 +1,76 @@
+import unittest
+import queue
+
+import requests_mock
+
+from mesos_stats import util
+from mesos_stats.instrument import Instrumentation, percentile
+
+
+def drain(q):
+    res = {}
+    while not q.empty():
+        path, value, ts = q.get().split()
+        res[path] = float(value)
+    return res
+
+
+class InstrumentationTest(unittest.TestCase):
+    def test_percentile(self):
+        ordered = list(range(1, 101))
+        self.assertEqual(percentile(ordered, 50), 50)
+        self.assertEqual(percentile(ordered, 99), 99)
+        self.assertEqual(percentile([7], 90), 7)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_observes_requests(self):
+        i = Instrumentation()
+        i.install()
+        try:
+            with requests_mock.Mocker() as m:
+                m.get('http://agent1:5051/metrics/snapshot', text='{"a": 1}')
+                m.get('http://agent2:5051/metrics/snapshot', status_code=500)
+                util.try_get_json('http://agent1:5051/metrics/snapshot',
+                                  endpoint='agent.metrics_snapshot')
+                res = util.try_get_json('http://agent2:5051/metrics/snapshot',
+                                        endpoint='agent.metrics_snapshot')
+                self.assertFalse(res)
+        finally:
+            i.uninstall()
+        q = queue.Queue()
+        i.report(q, 1000)
+        res = drain(q)
+        prefix = 'collector.http.agent.metrics_snapshot.'
+        self.assertEqual(res[prefix + 'count'], 2)
+        self.assertEqual(res[prefix + 'errors'], 1)
+        self.assertEqual(res[prefix + 'bytes'], 8)
+        self.assertIn(prefix + 'latency.p99', res)
+        self.assertEqual(res['collector.agents.ok'], 1)
+        self.assertEqual(res['collector.agents.failed'], 1)
+
+    def test_flush_and_send(self):
+        i = Instrumentation(namespace='mesos_stats')
+        q = queue.Queue()
+
+        def flusher(n):
+            for k in range(n):
+                q.put('a.b{} 1 1000'.format(k))
+            return n
+
+        self.assertEqual(i.flush('agent', q, flusher, 3), 3)
+        i.observe_queue(q)
+        i.observe_send(3, 30, 0.5)
+        while not q.empty():
+            q.get()
+        i.report(q, 1000)
+        res = drain(q)
+        self.assertEqual(res['mesos_stats.flush.agent.datapoints'], 3)
+        self.assertEqual(res['mesos_stats.queue.high_water_mark'], 3)
+        self.assertEqual(res['mesos_stats.send.bytes'], 30)
+        self.assertEqual(res['mesos_stats.send.datapoints_per_second'], 6)
+
+        # Counters start over after every report
+        i.report(q, 1060)
+        res = drain(q)
+        self.assertNotIn('mesos_stats.flush.agent.datapoints', res)
+        self.assertEqual(res['mesos_stats.send.datapoints'], 0)
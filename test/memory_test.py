@@ -0,0 +1,135 @@
+import time
+import unittest
+import threading
+import requests_mock
+
+from mesos_stats.memory import MemoryGuard, rss_mb, peak_rss_mb
+from mesos_stats.mesos import Mesos
+from mesos_stats.scheduler import Scheduler
+from mesos_stats.sender import Sender
+from mesos_stats.tiers import TierGroup
+
+
+class FakeCarbon:
+    def __init__(self):
+        self.sent = []
+
+    def send_metrics(self, metrics, timeout, close=True):
+        n = 0
+        while not metrics.empty():
+            self.sent.append(metrics.get())
+            n += 1
+        return (n, 0)
+
+
+def agents(n):
+    return [{'id': 'S%d' % i, 'hostname': 'agent%d' % i, 'port': 5051}
+            for i in range(n)]
+
+
+def pool_threads():
+    return [t for t in threading.enumerate()
+            if t.name.startswith('ThreadPoolExecutor')]
+
+
+class MemoryTest(unittest.TestCase):
+    def test_rss(self):
+        self.assertGreater(rss_mb(), 0)
+        self.assertGreaterEqual(peak_rss_mb(), rss_mb() * 0.5)
+
+    def test_guard_keeps_peak_per_cycle(self):
+        guard = MemoryGuard()
+        guard.start_cycle('agent', 1000)
+        guard.phase('agent', 'mesos')
+        self.assertGreater(guard.peaks['agent'], 0)
+        self.assertFalse(guard.over('agent'))  # no ceiling
+        guard.end_cycle('agent')
+        guard.end_cycle('unknown')  # never started, ignored
+
+        guard.limit_mb = 1  # anything is over that
+        self.assertFalse(guard.over('agent', 10))
+        self.assertTrue(guard.over('agent', guard.held_queue))
+        # held back until well under the ceiling
+        rss = rss_mb()
+        guard.limit_mb = rss / 0.95
+        self.assertTrue(guard.over('agent', guard.held_queue))
+        guard.limit_mb = rss * 2
+        self.assertFalse(guard.over('agent', guard.held_queue))
+        guard.limit_mb = rss / 0.95
+        self.assertFalse(guard.over('agent', guard.held_queue))
+        guard.pause('agent')
+        self.assertEqual(guard.pauses['agent'], 1)
+        guard.start_cycle('agent', 1060)
+        self.assertEqual(guard.pauses['agent'], 0)
+
+    def test_poll_slaves_stops_early(self):
+        mesos = Mesos(master_list=['mesos1'], discover=False)
+        mesos.slaves = agents(100)
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', requests_mock.ANY, json={})
+            polls = mesos.poll_slaves(0, 0)
+            next(polls)
+            polls.close()
+            # the workers run out rather than block on the closed poll
+            deadline = time.time() + 5
+            while pool_threads() and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(pool_threads(), [])
+
+    def test_backpressure_sends_while_collecting(self):
+        mesos = Mesos(master_list=['mesos1'], discover=False)
+        mesos.master = 'mesos1'
+        guard = MemoryGuard(1, held_queue=2)
+        group = TierGroup(['agent'], Scheduler(60), mesos,
+                          memory_guard=guard)
+        self.assertIn(guard, group.observers)
+        carbon = FakeCarbon()
+        sender = Sender(carbon)
+        sends = []
+
+        def send(final=True):
+            sends.append(final)
+            sender.send(group.queue, 1000, time.time() + 60, final)
+
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', requests_mock.ANY,
+                           json={'slave/cpus_total': 32})
+            m.register_uri('GET', 'http://mesos1/slaves',
+                           json={'slaves': agents(5)})
+            group.start_cycle(1000)
+            group.collect(1000, send)
+            sender.report_memory(group.queue, 1000, group.name, guard)
+            send()
+            group.end_cycle()
+
+        # paused every other agent, sending what it had flushed
+        self.assertEqual(sends, [False] * 2 + [True])
+        self.assertEqual(guard.pauses['agent'], 2)
+        self.assertEqual(len([s for s in carbon.sent
+                              if s.startswith('slave.')]), 5)
+        self.assertIn('collector.memory.agent.backpressure_pauses 2 1000',
+                      carbon.sent)
+        self.assertTrue(any(s.startswith('collector.memory.agent.peak_mb ')
+                            for s in carbon.sent))
+
+    def test_no_ceiling_no_pauses(self):
+        mesos = Mesos(master_list=['mesos1'], discover=False)
+        mesos.master = 'mesos1'
+        guard = MemoryGuard()
+        group = TierGroup(['agent'], Scheduler(60), mesos,
+                          memory_guard=guard)
+        sends = []
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', requests_mock.ANY,
+                           json={'slave/cpus_total': 32})
+            m.register_uri('GET', 'http://mesos1/slaves',
+                           json={'slaves': agents(3)})
+            group.start_cycle(1000)
+            group.collect(1000, lambda final=True: sends.append(final))
+        self.assertEqual(sends, [])
+        self.assertEqual(guard.pauses['agent'], 0)
+        self.assertEqual(group.queue.qsize(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
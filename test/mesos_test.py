@@ -1,8 +1,10 @@
+import queue
 import unittest
 import multiprocessing
 import requests_mock
 
-from mesos_stats.mesos import Mesos, MesosStatsException, MesosCarbon
+from mesos_stats.mesos import Mesos, MesosStatsException, MesosCarbon, \
+    shard_of, parse_executors, ExecutorRecord
 from mesos_stats.singularity import Singularity
 
 '''
@@ -287,3 +289,163 @@ class MesosTest(unittest.TestCase):
                 pass
             a = q.get()
             self.assertTrue(a.split()[0].startswith('tasks.my-request.2.'))
+
+    def test_stagger_offset(self):
+        from mesos_stats.mesos import stagger_offset
+        a = stagger_offset('agent-1', 30)
+        self.assertEqual(a, stagger_offset('agent-1', 30))
+        self.assertTrue(0 <= a < 30)
+        offsets = set(stagger_offset('agent-%d' % i, 30) for i in range(50))
+        self.assertGreater(len(offsets), 40)
+
+    def test_poll_slaves(self):
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://slave1:5051/metrics/snapshot',
+                           json={'slave/cpus_total': 32})
+            m.register_uri('GET', 'http://slave1:5051/monitor/statistics.json',
+                           status_code=503)
+            mesos = Mesos(master_list=['mesos1'], discover=False)
+            mesos.slaves = self.slaves_api['slaves']
+            res = list(mesos.poll_slaves(0, 0.1))
+        self.assertEqual(res, [('slave1', {'slave/cpus_total': 32}, False)])
+
+        q = multiprocessing.Queue()
+        mc = MesosCarbon(mesos, q)
+        mc.update_ts = 1000
+        self.assertEqual(mc.flush_slave('slave1', res[0][1]), 1)
+        self.assertEqual(mc.flush_slave_executors('slave1', res[0][2]), 0)
+        self.assertEqual(q.get(), 'slave.slave1.cpus.total 32 1000')
+
+    def test_poll_slaves_keeps_its_roster(self):
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://slave1:5051/metrics/snapshot',
+                           json={'slave/cpus_total': 32})
+            mesos = Mesos(master_list=['mesos1'], discover=False)
+            polls = mesos.poll_slaves(0, 0, executors=False,
+                                      slaves=self.slaves_api['slaves'])
+            # another group's update_slaves() lands mid-poll
+            mesos.slaves = []
+            res = list(polls)
+        self.assertEqual(res, [('slave1', {'slave/cpus_total': 32}, None)])
+
+    def test_flush_executors(self):
+        executors = [
+            {'executor_id': 'my-request-3.1.0-1', 'framework_id': 'Singularity',
+             'statistics': {'cpus_limit': 1.1, 'mem_rss_bytes': 100,
+                            'mem_file_bytes': 20}},
+            {'executor_id': 'web app', 'framework_id': 'marathon',
+             'statistics': {'cpus_user_time_secs': 2.5}},
+        ]
+        records = parse_executors(executors)
+        self.assertIs(parse_executors(records), records)
+        self.assertFalse(parse_executors(False))
+        self.assertEqual(records[0].name, 'my-request-3_1_0-1')
+        self.assertEqual(records[0].values, (None, None, 1.1, None, 100))
+        self.assertFalse(hasattr(records[0], '__dict__'))
+        self.assertIsInstance(records[1], ExecutorRecord)
+
+        def flushed(fn, *args):
+            q = queue.Queue()
+            mc = MesosCarbon(Mesos(['mesos1'], discover=False), q)
+            mc.update_ts = 1000
+            fn(mc)(*args)
+            return set(q.queue)
+
+        lookup = {'my-request-3.1.0-1': 'my-request_2'}
+        by_slave = flushed(lambda mc: mc.flush_slave_executors, 'slave1',
+                           executors)
+        by_task = flushed(lambda mc: mc.send_alternate_slave_executors,
+                          executors, lookup, {})
+        self.assertEqual(by_slave, {
+            'slave.slave1.executors.singularity.tasks.my-request-3_1_0-1'
+            '.cpus.limit 1.1 1000',
+            'slave.slave1.executors.singularity.tasks.my-request-3_1_0-1'
+            '.mem.rss_bytes 100 1000',
+            'slave.slave1.executors.singularity.tasks.web_app'
+            '.cpus.user_time_secs 2.5 1000'})
+        self.assertIn('tasks.my-request.2.cpus.limit 1.1 1000', by_task)
+        self.assertEqual(len(by_task), 3)
+
+        task_names = {}
+        fused = flushed(lambda mc: mc.flush_executors, 'slave1', records,
+                        lookup, task_names)
+        self.assertEqual(fused, by_slave | by_task)
+        self.assertEqual(task_names, {'my-request-3.1.0-1': 'my-request.2',
+                                      'web app': 'web_app'})
+
+        # a guess isn't kept, the task is looked up again next cycle
+        task_names = {}
+        flushed(lambda mc: mc.flush_executors, None, records, {},
+                task_names)
+        self.assertEqual(task_names, {'web app': 'web_app'})
+        q = queue.Queue()
+        mc = MesosCarbon(Mesos(['mesos1'], discover=False), q)
+        mc.update_ts = 1000
+        mc.task_names = task_names
+        mc.flush_executors(None, records, lookup, {})
+        self.assertIn('tasks.my-request.2.cpus.limit 1.1 1000', set(q.queue))
+
+    def test_shard_of(self):
+        keys = ['agent-%d' % i for i in range(3000)]
+        self.assertEqual(set(shard_of(k, 1) for k in keys), {0})
+        three = [shard_of(k, 3) for k in keys]
+        for shard in range(3):
+            self.assertAlmostEqual(three.count(shard) / 3000.0, 1 / 3.0,
+                                   delta=0.05)
+        # a fourth shard only takes agents, about a quarter of them
+        four = [shard_of(k, 4) for k in keys]
+        moved = [(a, b) for a, b in zip(three, four) if a != b]
+        self.assertTrue(all(b == 3 for a, b in moved))
+        self.assertAlmostEqual(len(moved) / 3000.0, 0.25, delta=0.05)
+
+    def test_sharded_slaves(self):
+        slaves = [{'id': 'S%d' % i, 'hostname': 'agent%d' % i, 'port': 5051}
+                  for i in range(30)]
+        owned = []
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://mesos1/slaves',
+                           json={'slaves': slaves})
+            for shard in range(3):
+                mesos = Mesos(['mesos1'], discover=False, shard=shard,
+                              shards=3)
+                mesos.master = 'mesos1'
+                mesos.update_slaves()
+                owned += [s['id'] for s in mesos.slaves]
+        self.assertEqual(sorted(owned), sorted(s['id'] for s in slaves))
+
+    def test_update_slaves_follows_leader(self):
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://mesos1/slaves', status_code=503)
+            m.register_uri('GET', 'http://mesos1/metrics/snapshot',
+                           json={'master/elected': 0})
+            m.register_uri('GET', 'http://mesos2/metrics/snapshot',
+                           json={'master/elected': 1})
+            m.register_uri('GET', 'http://mesos2/slaves',
+                           json=self.slaves_api)
+            mesos = Mesos(['mesos1', 'mesos2'], discover=False)
+            mesos.master = 'mesos1'
+            mesos.update_slaves()
+        self.assertEqual(mesos.master, 'mesos2')
+        self.assertEqual(mesos.slaves, self.slaves_api['slaves'])
+
+    def test_flush_slave_resources(self):
+        q = multiprocessing.Queue()
+        mc = MesosCarbon(Mesos(['mesos1'], discover=False), q)
+        mc.update_ts = 1000
+        mc.resources_from_master = True
+        slave = {'hostname': 'slave.1',
+                 'resources': {'cpus': 32, 'mem': 1024, 'ports': '[1-2]'},
+                 'used_resources': {'cpus': 8}}
+        self.assertEqual(mc.slave_resources(slave), {
+            'slave/cpus_total': 32, 'slave/cpus_used': 8,
+            'slave/cpus_percent': 0.25, 'slave/mem_total': 1024,
+            'slave/mem_used': 0, 'slave/mem_percent': 0.0})
+        self.assertEqual(mc.flush_slave_resources([slave]), 6)
+        queued = set(q.get() for _ in range(6))
+        self.assertIn('slave.slave_1.cpus.percent 25.0 1000', queued)
+        self.assertIn('slave.slave_1.mem.total 1024 1000', queued)
+
+        # what the agent reports on top
+        self.assertEqual(mc.flush_slave('slave.1', {
+            'slave/cpus_total': 32, 'system/load_1min': 1.5}), 1)
+        self.assertEqual(q.get(), 'slave.slave_1.system.load.1min 1.5 1000')
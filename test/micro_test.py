@@ -0,0 +1,24 @@
+import unittest
+
+from benchmarks.micro import run_suite, compare
+from benchmarks.simulator import ClusterSpec
+
+
+class MicroTest(unittest.TestCase):
+    def test_suite_runs_every_stage(self):
+        results = run_suite(ClusterSpec(agents=5, executors=2,
+                                        tasks_per_framework=2), repeat=1)
+        self.assertEqual(len(results), 9)
+        # 5 agents x 15 metrics, 5 x 2 executors x 5 metrics
+        self.assertEqual(results['flush_slave_metrics']['datapoints'], 75)
+        self.assertEqual(results['flush_executor_metrics']['datapoints'], 50)
+        self.assertEqual(results['flush_all_executors']['datapoints'], 100)
+        self.assertEqual(results['carbon_send_pickle']['datapoints'], 125)
+        for r in results.values():
+            self.assertGreater(r['ns_per_dp'], 0)
+
+    def test_compare(self):
+        baselines = {'a': {'ns_per_dp': 100}, 'b': {'ns_per_dp': 100}}
+        results = {'a': {'ns_per_dp': 119}, 'b': {'ns_per_dp': 121},
+                   'c': {'ns_per_dp': 1000}}
+        self.assertEqual(compare(results, baselines, 0.2), ['b'])
@@ -0,0 +1,63 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from mesos_stats import profiling
+from mesos_stats.profiling import CycleProfiler
+
+
+class FakeGroup:
+    def __init__(self, name):
+        self.name = name
+
+
+class CycleProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.snapshot_every = profiling.SNAPSHOT_EVERY
+        profiling.SNAPSHOT_EVERY = 0
+
+    def tearDown(self):
+        profiling.SNAPSHOT_EVERY = self.snapshot_every
+        shutil.rmtree(self.dir)
+
+    def test_profiles_requested_cycles(self):
+        p = CycleProfiler(self.dir)
+        p.add_group(FakeGroup('cluster'))
+        p.add_group(FakeGroup('agent'))
+
+        # Nothing is profiled until asked for
+        p.start_cycle('cluster', 1000)
+        self.assertIsNone(p.active)
+        p.end_cycle('cluster')
+
+        p.request()
+        p.start_cycle('cluster', 1060)
+        # One group at a time, the other waits for its next cycle
+        p.start_cycle('agent', 1060)
+        self.assertEqual(p.active, 'cluster')
+        p.phase('cluster', 'mesos')
+        kept = [str(i) * 10 for i in range(1000)]
+        p.phase('cluster', 'flush')
+        p.end_cycle('cluster')
+        p.end_cycle('agent')
+        self.assertIsNone(p.active)
+        self.assertEqual(p.pending, {'cluster': 0, 'agent': 1})
+
+        files = sorted(os.listdir(self.dir))
+        self.assertEqual(files, ['cluster-1060.alloc.txt',
+                                 'cluster-1060.cprofile.txt',
+                                 'cluster-1060.prof',
+                                 'cluster-1060.sampled.txt',
+                                 'cluster-1060.stacks.txt'])
+        with open(os.path.join(self.dir, 'cluster-1060.alloc.txt')) as f:
+            alloc = f.read()
+        self.assertIn('== mesos:', alloc)
+        self.assertIn('profiling_test.py', alloc)
+        self.assertEqual(len(kept), 1000)
+
+        p.start_cycle('agent', 1120)
+        self.assertEqual(p.active, 'agent')
+        p.end_cycle('agent')
+        self.assertIn('agent-1120.prof', os.listdir(self.dir))
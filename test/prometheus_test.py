@@ -0,0 +1,93 @@
+import gzip
+import time
+import queue
+import unittest
+import requests
+
+from mesos_stats.prometheus import Exposition, to_series
+from mesos_stats.sinks import FanOut, sink_from_url
+
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        time.sleep(0.01)
+
+
+class PrometheusTest(unittest.TestCase):
+    def test_to_series(self):
+        self.assertEqual(to_series('slave.a1.cpus.total'),
+                         ('mesos_slave_cpus_total', 'agent="a1"'))
+        self.assertEqual(
+            to_series('slave.a1.executors.singularity.tasks.t1.mem.rss_bytes',
+                      'mesos.eu'),
+            ('mesos_executor_mem_rss_bytes',
+             'agent="a1",task="t1",prefix="mesos.eu"'))
+        self.assertEqual(to_series('tasks.my-request.2.cpus.limit'),
+                         ('singularity_task_cpus_limit',
+                          'request="my-request",task_instance="2"'))
+        self.assertEqual(to_series('tasks.web_app.cpus.limit'),
+                         ('singularity_task_cpus_limit', 'request="web_app"'))
+        self.assertEqual(to_series('frameworks.marathon.resources.cpus'),
+                         ('mesos_framework_resources_cpus',
+                          'framework="marathon"'))
+        self.assertEqual(to_series('frameworks.marathon.tasks.t1.mem'),
+                         ('mesos_framework_task_mem',
+                          'framework="marathon",task="t1"'))
+        self.assertEqual(to_series('cluster.cpus.total'),
+                         ('mesos_cluster_cpus_total', ''))
+        self.assertEqual(to_series('collector.http.master_state.p99'),
+                         ('collector_http_master_state_p99', ''))
+
+    def test_rendered_once_a_cycle(self):
+        e = Exposition(ttl=60)
+        e.update([('slave.a1.load', (1000, 1)), ('slave.a2.load', (1000, 2)),
+                  ('cluster.mem', (1000, 5))])
+        self.assertEqual(e.rendered[0], b'')
+        e.render()
+        text = e.rendered[0]
+        self.assertEqual(text, b'# TYPE mesos_cluster_mem gauge\n'
+                               b'mesos_cluster_mem 5\n'
+                               b'# TYPE mesos_slave_load gauge\n'
+                               b'mesos_slave_load{agent="a1"} 1\n'
+                               b'mesos_slave_load{agent="a2"} 2\n')
+        self.assertEqual(gzip.decompress(e.rendered[1]), text)
+
+        e.update([('slave.a1.load', (1100, 3)), ('cluster.mem', (1100, 6))])
+        self.assertIs(e.rendered[0], text)
+        e.render()
+        # a2 went quiet for over the ttl
+        self.assertEqual(e.rendered[0], b'# TYPE mesos_cluster_mem gauge\n'
+                                        b'mesos_cluster_mem 6\n'
+                                        b'# TYPE mesos_slave_load gauge\n'
+                                        b'mesos_slave_load{agent="a1"} 3\n')
+
+    def test_metrics_endpoint(self):
+        sink = sink_from_url('prometheus://127.0.0.1:0')
+        self.addCleanup(sink.server.server_close)
+        self.addCleanup(sink.server.shutdown)
+        fan_out = FanOut([sink])
+        url = 'http://127.0.0.1:{}/metrics'.format(
+            sink.server.server_address[1])
+
+        q = queue.Queue()
+        q.put(('slave.a1.load', (1500000000, 0.5)))
+        fan_out.send_metrics(q, 10, close=False)
+        wait_for(lambda: sink.sent)
+        self.assertEqual(requests.get(url).text, '')  # mid-cycle
+        q.put(('cluster.mem', (1500000000, 5)))
+        fan_out.send_metrics(q, 10)
+        wait_for(lambda: sink.exposition.renders)
+
+        res = requests.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(res.headers['Content-Type'].startswith('text/plain'))
+        self.assertIn('mesos_slave_load{agent="a1"} 0.5\n', res.text)
+        self.assertEqual(requests.get(url[:-len('metrics')]).status_code,
+                         404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import queue
+
+from mesos_stats.registry import SeriesRegistry
+
+
+def drain(q):
+    res = {}
+    while not q.empty():
+        path, value, ts = q.get().split()
+        res[path] = value
+    return res
+
+
+class SeriesRegistryTest(unittest.TestCase):
+    def test_tracks_first_and_last_seen(self):
+        r = SeriesRegistry()
+        for ts in [1000, 1060]:
+            q = queue.Queue()
+            q.put('cluster.cpus.total 32 {}'.format(ts))
+            r.filter(q, ts)
+            r.report(q, ts)
+        self.assertEqual(r.first_seen('cluster.cpus.total'), 1000)
+        self.assertEqual(r.last_seen('cluster.cpus.total'), 1060)
+        res = drain(q)
+        self.assertEqual(res['collector.registry.new'], '0')
+        self.assertEqual(res['collector.registry.series'], '1')
+
+    def test_folds_series_over_budget(self):
+        r = SeriesRegistry({'tasks': 1})
+        q = queue.Queue()
+        q.put('tasks.a.1.cpus.limit 1 1000')
+        q.put('tasks.b.1.cpus.limit 2 1000')
+        q.put('tasks.c.1.cpus.limit 3 1000')
+        q.put('cluster.cpus.total 32 1000')
+        r.filter(q, 1000)
+        r.report(q, 1000)
+        res = drain(q)
+        self.assertEqual(res['tasks.a.1.cpus.limit'], '1')
+        self.assertEqual(res['tasks.other.cpus.limit'], '5.0')
+        self.assertEqual(res['cluster.cpus.total'], '32')
+        self.assertNotIn('tasks.b.1.cpus.limit', res)
+        self.assertEqual(res['collector.registry.folded'], '1')
+
+    def test_folds_over_partial_sends(self):
+        r = SeriesRegistry({'tasks': 1})
+        sent = []
+        for paths in [['a', 'b', 'c'], ['d', 'e']]:
+            q = queue.Queue()
+            for p in paths:
+                q.put('tasks.{}.1.cpus.limit 1 1000'.format(p))
+            r.filter(q, 1000)
+            sent.extend(q.queue)
+        self.assertNotIn('tasks.other.cpus.limit 4.0 1000', sent)
+        q = queue.Queue()
+        r.report(q, 1000)
+        folded = [m for m in q.queue if m.startswith('tasks.other.')]
+        self.assertEqual(folded, ['tasks.other.cpus.limit 4.0 1000'])
+
+        # the next cycle starts over
+        q = queue.Queue()
+        q.put('tasks.b.1.cpus.limit 1 1060')
+        r.filter(q, 1060)
+        r.report(q, 1060)
+        self.assertEqual(drain(q)['tasks.other.cpus.limit'], '1.0')
+
+    def test_drops_series_over_budget(self):
+        r = SeriesRegistry({'tasks': 1}, fold=False)
+        q = queue.Queue()
+        q.put('tasks.a.1.cpus.limit 1 1000')
+        q.put('tasks.b.1.cpus.limit 2 1000')
+        r.filter(q, 1000)
+        r.report(q, 1000)
+        res = drain(q)
+        self.assertNotIn('tasks.b.1.cpus.limit', res)
+        self.assertEqual(res['collector.registry.dropped'], '1')
+
+    def test_expired_series_free_their_budget(self):
+        r = SeriesRegistry({'tasks': 1}, ttl=100)
+        q = queue.Queue()
+        q.put('tasks.a.1.cpus.limit 1 1000')
+        r.filter(q, 1000)
+        q = queue.Queue()
+        q.put('tasks.b.1.cpus.limit 1 1200')
+        r.filter(q, 1200)
+        r.report(q, 1200)
+        res = drain(q)
+        self.assertEqual(res['collector.registry.expired'], '1')
+        self.assertNotIn('tasks.a.1.cpus.limit', r)
+
+        q = queue.Queue()
+        q.put('tasks.b.1.cpus.limit 1 1260')
+        r.filter(q, 1260)
+        self.assertIn('tasks.b.1.cpus.limit', drain(q))
+
+    def test_expires_once_a_cycle(self):
+        r = SeriesRegistry(ttl=100)
+        q = queue.Queue()
+        q.put('tasks.a.1.cpus.limit 1 1000')
+        r.filter(q, 1000)
+        # partial sends don't go through every series
+        r.filter(queue.Queue(), 1200)
+        self.assertIn('tasks.a.1.cpus.limit', r)
+        r.report(queue.Queue(), 1200)
+        self.assertNotIn('tasks.a.1.cpus.limit', r)
@@ -0,0 +1,73 @@
+import unittest
+import os
+import shutil
+import tempfile
+import requests
+import requests_mock
+
+from mesos_stats import util
+from mesos_stats.mesos import Mesos
+from mesos_stats.replay import Recorder, Replayer
+
+
+class FakeGroup:
+    def __init__(self, name):
+        self.name = name
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cycle.jsonl.gz')
+        self.addCleanup(shutil.rmtree, self.dir)
+        transport = util.transport
+        self.addCleanup(setattr, util, 'transport', transport)
+
+    def record(self):
+        recorder = Recorder(self.path, cycles=1)
+        recorder.add_group(FakeGroup('all'))
+        recorder.install()
+        with requests_mock.Mocker() as m:
+            m.get('http://mesos1/metrics/snapshot',
+                  json={'master/elected': 1, 'master/cpus_total': 32})
+            m.get('http://mesos1/slaves',
+                  json={'slaves': [{'hostname': 's1', 'port': 5051}]})
+            m.get('http://s1:5051/metrics/snapshot',
+                  json={'slave/cpus_total': 8})
+            m.get('http://s1:5051/monitor/statistics.json',
+                  exc=requests.exceptions.ConnectTimeout)
+            mesos = Mesos(['mesos1'])
+            mesos.update_slave_metrics()
+            self.assertRaises(requests.exceptions.ConnectTimeout,
+                              mesos.update_executors)
+        recorder.end_cycle('all')
+        self.assertIs(util.transport, recorder.wrapped)
+        self.assertEqual(len(recorder.entries), 4)
+        return mesos
+
+    def test_replays_without_network(self):
+        recorded = self.record()
+
+        replayer = Replayer(self.path, latency_scale=0)
+        replayer.load()
+        replayer.install()
+        # No requests_mock here, anything missing from the recording fails
+        mesos = Mesos(['mesos1'])
+        self.assertEqual(mesos.master, 'mesos1')
+        self.assertEqual(mesos.slaves, recorded.slaves)
+        mesos.update_slave_metrics()
+        self.assertEqual(mesos.slave_metrics, recorded.slave_metrics)
+        self.assertRaises(requests.exceptions.ConnectTimeout,
+                          util.try_get_json,
+                          'http://s1:5051/monitor/statistics.json')
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          util.try_get_json, 'http://mesos2/slaves')
+
+    def test_scaled_latency_times_out(self):
+        self.record()
+        replayer = Replayer(self.path, latency_scale=1e9)
+        replayer.load()
+        replayer.install()
+        self.assertRaises(requests.exceptions.Timeout,
+                          util.try_get_json, 'http://mesos1/slaves',
+                          timeout=0.01)
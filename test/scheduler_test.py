@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+from mesos_stats.scheduler import Scheduler
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(1000.5)
+        patcher = mock.patch('mesos_stats.scheduler.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ticks_are_aligned(self):
+        s = Scheduler(interval=10)
+        self.assertEqual(s.wait(), 1010)
+        self.clock.now += 3.7  # cycle work
+        self.assertEqual(s.wait(), 1020)
+        self.assertEqual(s.overruns, 0)
+        self.assertEqual(s.deadline(1020), 1029)
+
+    def test_rejects_short_intervals(self):
+        self.assertRaises(ValueError, Scheduler, interval=5)
+        self.assertRaises(ValueError, Scheduler, overrun='whatever')
+
+    def test_overrun_skip(self):
+        s = Scheduler(interval=10, overrun='skip')
+        s.wait()
+        self.clock.now += 25  # overruns 1020 and 1030
+        self.assertEqual(s.wait(), 1040)
+        self.assertEqual((s.overruns, s.skipped), (1, 2))
+
+    def test_overrun_coalesce(self):
+        s = Scheduler(interval=10, overrun='coalesce')
+        s.wait()
+        self.clock.now += 25
+        self.assertEqual(s.wait(), 1030)
+        self.assertEqual(self.clock.now, 1035)  # didn't sleep
+        self.assertEqual((s.overruns, s.skipped), (1, 1))
+        self.assertEqual(s.wait(), 1040)
+
+    def test_overrun_late(self):
+        s = Scheduler(interval=10, overrun='late')
+        s.wait()
+        self.clock.now += 25
+        self.assertEqual(s.wait(), 1020)
+        self.assertEqual(s.wait(), 1030)
+        self.assertEqual(s.wait(), 1040)
+        self.assertEqual((s.overruns, s.skipped), (2, 0))
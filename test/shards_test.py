@@ -0,0 +1,142 @@
+import time
+import pickle
+import struct
+import unittest
+
+from mesos_stats import util
+from mesos_stats.adaptive import RequestController
+
+from mesos_stats.instrument import Instrumentation
+from mesos_stats.mesos import Mesos
+from mesos_stats.replay import Recorder
+from mesos_stats.scheduler import Scheduler
+from mesos_stats.shards import Batch, ShardPool, encode_batch, \
+    shard_slaves, _start_worker
+from mesos_stats.singularity import Singularity
+from mesos_stats.tiers import TIERS, TierGroup
+from benchmarks.simulator import ClusterSpec, Simulator
+
+
+class ShardsTest(unittest.TestCase):
+    def test_shard_slaves(self):
+        slaves = [{'id': 'S%d' % i, 'hostname': 'agent%d' % i}
+                  for i in range(120)]
+        shards = shard_slaves(slaves, 30)
+        self.assertEqual([len(s) for s in shards], [50, 50, 20])
+        self.assertEqual(sorted(s['id'] for shard in shards for s in shard),
+                         sorted(s['id'] for s in slaves))
+        # without a window the roster order is kept
+        self.assertEqual(shard_slaves(slaves, 0)[0], slaves[:50])
+
+    def test_batch(self):
+        b = Batch()
+        b.put('a 1 1000')
+        self.assertEqual(b.qsize(), 1)
+
+    def test_encode_batch(self):
+        batch = ['slave.a1.load 1 1000', 'cluster.cpus 2 1000',
+                 'slave.a2.load 3 1000']
+        payloads = encode_batch(batch, prefix='p')
+        self.assertEqual([(p.family, p.datapoints) for p in payloads],
+                         [(0, 1), (1, 2)])
+        self.assertEqual(payloads[1].data,
+                         b'p.slave.a1.load 1 1000\np.slave.a2.load 3 1000\n')
+
+        batch = [('slave.a%d.load' % i, (1000, i)) for i in range(600)]
+        payload, = encode_batch(batch, pickle=True)
+        # framed 500 datapoints at a time
+        n, = struct.unpack('!L', payload.data[:4])
+        self.assertEqual(pickle.loads(payload.data[4:4 + n]), batch[:500])
+        self.assertEqual(pickle.loads(payload.data[8 + n:]), batch[500:])
+
+    def test_deadline(self):
+        class Slow:
+            def ready(self):
+                return False
+
+            def wait(self, timeout):
+                time.sleep(timeout)
+        t = time.time()
+        self.assertIsNone(ShardPool._next([Slow()], time.time() + 0.05))
+        self.assertLess(time.time() - t, 1)
+
+    def test_worker_keeps_request_controller(self):
+        session, transport = util.session, util.transport
+        observers = list(util.request_observers)
+        instrumentation = Instrumentation()
+        controller = RequestController()
+        instrumentation.install()
+        controller.install()
+
+        def restore():
+            util.session, util.transport = session, transport
+            util.request_observers[:] = observers
+            util.controller = None
+        self.addCleanup(restore)
+        _start_worker(None, None)
+        # the parent's instrumentation is handed the worker's requests
+        self.assertEqual(util.request_observers, [controller.observe])
+
+    def test_worker_session_under_recorder(self):
+        session, transport = util.session, util.transport
+        self.addCleanup(setattr, util, 'session', session)
+        self.addCleanup(setattr, util, 'transport', transport)
+        observers = list(util.request_observers)
+        self.addCleanup(util.request_observers.extend, observers)
+        recorder = Recorder(None)
+        recorder.install()
+        _start_worker(None, None)
+        self.assertIsNot(util.session, session)
+        self.assertEqual(util.transport, recorder.get)
+        self.assertEqual(recorder.wrapped, util.session.get)
+
+    def test_same_datapoints_as_one_process(self):
+        simulator = Simulator(ClusterSpec(agents=120, executors=2,
+                                          frameworks=2,
+                                          tasks_per_framework=2), port=0)
+        simulator.start()
+        self.addCleanup(simulator.server_close)
+        self.addCleanup(simulator.shutdown)
+
+        def collect(processes, encoding=None):
+            mesos = Mesos([simulator.master])
+            singularity = Singularity(simulator.master, update=False)
+            instrumentation = Instrumentation()
+            group = TierGroup(list(TIERS), Scheduler(60), mesos,
+                              singularity, instrumentation=instrumentation,
+                              processes=processes)
+            if group.shard_pool:
+                group.shard_pool.start(group.mesos_carbon, encoding)
+                self.addCleanup(group.shard_pool.close)
+            instrumentation.install()
+            try:
+                group.collect(1500000000)
+            finally:
+                instrumentation.uninstall()
+            return group, instrumentation
+
+        single, _ = collect(1)
+        sharded, instrumentation = collect(3)
+        self.assertEqual(sorted(sharded.queue.queue),
+                         sorted(single.queue.queue))
+        self.assertEqual(sharded.mesos_carbon.task_names,
+                         single.mesos_carbon.task_names)
+        self.assertEqual(len(sharded.mesos_carbon.task_names), 240)
+        # what the workers requested and flushed is accounted for here
+        self.assertEqual(instrumentation.agents, {'ok': 240, 'failed': 0})
+        self.assertEqual(instrumentation.flushers['agent'][0], 120 * 15)
+
+        # workers encode what goes straight to Carbon
+        encoded, _ = collect(3, (False, 'p'))
+        lines = sorted(line.decode() for p in encoded.payloads
+                       for line in p.data.splitlines())
+        self.assertEqual(sum(p.datapoints for p in encoded.payloads),
+                         len(lines))
+        self.assertTrue(all(line.startswith('p.') for line in lines))
+        self.assertEqual(
+            sorted(list(encoded.queue.queue) + [l[2:] for l in lines]),
+            sorted(single.queue.queue))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import time
+import queue
+import unittest
+
+from mesos_stats.carbon import Carbon
+from mesos_stats.dedup import ChangeSuppressor
+from mesos_stats.sender import Sender, MIN_SEND_TIMEOUT
+from mesos_stats.registry import SeriesRegistry
+from mesos_stats.shards import Payload
+from mesos_stats.shedding import LoadShedder, family_of, FAMILIES
+from benchmarks.carbon_sink import CarbonSink
+
+
+class FakeCarbon:
+    def __init__(self):
+        self.sent = []
+
+    def send_metrics(self, metrics, timeout, close=True):
+        self.timeout = timeout
+        n = 0
+        while not metrics.empty():
+            self.sent.append(metrics.get())
+            n += 1
+        return (n, 0)
+
+
+def queued(paths):
+    q = queue.Queue()
+    for p in paths:
+        q.put('{} 1 1000'.format(p))
+    return q
+
+
+class SheddingTest(unittest.TestCase):
+    def test_family_of(self):
+        self.assertEqual(
+            [FAMILIES[family_of(p)] for p in [
+                'cluster.cpus.total', 'singularity.tasks.active',
+                'collector.sender.shed.agent', 'slave.a1.cpus.total',
+                'frameworks.marathon.resources.cpus',
+                'slave.a1.executors.singularity.tasks.t1.cpus.limit',
+                'tasks.my-request.2.cpus.limit']],
+            ['cluster', 'cluster', 'cluster', 'agent', 'framework',
+             'executor', 'executor'])
+
+    def test_order_without_estimate(self):
+        shedder = LoadShedder()
+        q = queued(['tasks.t1.mem', 'frameworks.f1.mem', 'slave.a1.load',
+                    'cluster.mem'])
+        self.assertEqual(shedder.order(q, time.time() + 60), 0)
+        self.assertEqual([m.split()[0] for m in q.queue], [
+            'cluster.mem', 'slave.a1.load', 'frameworks.f1.mem',
+            'tasks.t1.mem'])
+
+    def test_sheds_lowest_families_first(self):
+        shedder = LoadShedder(headroom=1)
+        shedder.observe(1000, 10.0)
+        self.assertEqual(shedder.rate, 100)
+        shedder.observe(10, 0.001)  # too small to go by
+        self.assertEqual(shedder.rate, 100)
+
+        paths = ['cluster.c%d' % i for i in range(3)] + \
+            ['slave.a%d.load' % i for i in range(4)] + \
+            ['frameworks.f%d.mem' % i for i in range(4)] + \
+            ['tasks.t%d.mem' % i for i in range(4)]
+        q = queued(paths[::-1])
+        # room for 9 datapoints: cluster, agents and two frameworks
+        self.assertEqual(shedder.order(q, time.time() + 0.095), 6)
+        self.assertEqual(sorted(m.split()[0] for m in q.queue),
+                         sorted(paths[:7] + paths[9:11]))
+
+        # the cluster family is never shed
+        q = queued(paths)
+        self.assertEqual(shedder.order(q, time.time() - 1, 1000), 12)
+        self.assertEqual(list(q.queue), [
+            'collector.sender.shed.agent 4 1000',
+            'collector.sender.shed.framework 6 1000',
+            'collector.sender.shed.executor 8 1000',
+            'cluster.c0 1 1000', 'cluster.c1 1 1000', 'cluster.c2 1 1000'])
+        self.assertEqual(shedder.shed, [0] * len(FAMILIES))
+
+    def test_sheds_whole_payloads(self):
+        shedder = LoadShedder(headroom=1)
+        shedder.observe(1000, 10.0)
+        payloads = [Payload(3, 2, b'e'), Payload(1, 4, b'a'),
+                    Payload(0, 5, b'c'), Payload(2, 3, b'f')]
+        q = queued(['cluster.c0'])
+        # room for 10 datapoints: the queue, the cluster and agent payloads
+        self.assertEqual(shedder.order(q, time.time() + 0.105, None,
+                                       payloads), 5)
+        self.assertEqual([p.data for p in payloads], [b'c', b'a'])
+        self.assertEqual(shedder.shed, [0, 0, 3, 2])
+
+    def test_sender(self):
+        carbon = FakeCarbon()
+        shedder = LoadShedder('collector', pickle=True)
+        sender = Sender(carbon, True, shedder=shedder)
+        q = queue.Queue()
+        for path in ['tasks.t1.mem', 'slave.a1.load', 'cluster.mem']:
+            q.put((path, (1000, 1)))
+        self.assertEqual(sender.send(q, 1000, time.time() + 60), (6, 0))
+        self.assertEqual([m[0] for m in carbon.sent], [
+            'collector.sender.shed.agent', 'collector.sender.shed.framework',
+            'collector.sender.shed.executor', 'cluster.mem',
+            'slave.a1.load', 'tasks.t1.mem'])
+
+    def test_sender_past_deadline(self):
+        carbon = FakeCarbon()
+        shedder = LoadShedder('collector', pickle=True)
+        shedder.observe(1000, 1.0)
+        sender = Sender(carbon, True, shedder=shedder)
+        q = queue.Queue()
+        for path in ['tasks.t1.mem', 'slave.a1.load', 'cluster.mem']:
+            q.put((path, (1000, 1)))
+        sender.send(q, 1000, time.time() - 1)
+        self.assertEqual(carbon.timeout, MIN_SEND_TIMEOUT)
+        self.assertIn('cluster.mem', [m[0] for m in carbon.sent])
+        self.assertNotIn('slave.a1.load', [m[0] for m in carbon.sent])
+
+        # and a real connection takes the timeout
+        sink = CarbonSink()
+        sink.start()
+        self.addCleanup(sink.server_close)
+        self.addCleanup(sink.shutdown)
+        shedder = LoadShedder()
+        shedder.observe(1000, 1.0)
+        sender = Sender(Carbon('127.0.0.1', None, port=sink.port),
+                        shedder=shedder)
+        q = queue.Queue()
+        for path in ['slave.a1.load', 'cluster.mem']:
+            q.put('{} 1 1500000000'.format(path))
+        sender.send(q, 1500000000, time.time() - 1)
+        for _ in range(50):
+            if 'cluster.mem' in sink.stats.paths:
+                break
+            time.sleep(0.05)
+        self.assertIn('cluster.mem', sink.stats.paths)
+        self.assertNotIn('slave.a1.load', sink.stats.paths)
+
+    def test_sender_filters_forget_shed(self):
+        carbon = FakeCarbon()
+        shedder = LoadShedder(headroom=1)
+        suppressor = ChangeSuppressor(heartbeat=5)
+        registry = SeriesRegistry()
+        sender = Sender(carbon, filters=[suppressor, registry],
+                        shedder=shedder)
+        shedder.observe(1000, 1.0)
+        q = queued(['cluster.mem', 'slave.a1.load'])
+        sender.send(q, 1000, time.time() - 1)
+        sent = [m.split()[0] for m in carbon.sent]
+        self.assertIn('cluster.mem', sent)
+        self.assertNotIn('slave.a1.load', sent)
+        self.assertIn('collector.dedup.sent 1 1000', carbon.sent)
+        self.assertIn('collector.registry.series 1 1000', carbon.sent)
+        self.assertNotIn('slave.a1.load', registry)
+
+        # once Carbon keeps up, the unchanged agent series isn't
+        # suppressed for having been sent
+        carbon.sent = []
+        shedder.rate = None
+        q = queued(['cluster.mem', 'slave.a1.load'])
+        sender.send(q, 1060, time.time() + 60)
+        sent = [m.split()[0] for m in carbon.sent]
+        self.assertIn('slave.a1.load', sent)
+        self.assertNotIn('cluster.mem', sent)
+        self.assertEqual(registry.first_seen('slave.a1.load'), 1060)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
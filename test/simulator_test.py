@@ -0,0 +1,55 @@
+import unittest
+import time
+
+from mesos_stats.carbon import Carbon
+from mesos_stats.mesos import Mesos
+from mesos_stats.scheduler import Scheduler
+from mesos_stats.sender import Sender
+from mesos_stats.singularity import Singularity
+from mesos_stats.tiers import TIERS, TierGroup
+from benchmarks.simulator import ClusterSpec, Simulator, agent_address
+from benchmarks.carbon_sink import CarbonSink
+
+
+class SimulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator = Simulator(ClusterSpec(agents=3, executors=2,
+                                               frameworks=2,
+                                               tasks_per_framework=2),
+                                   port=0)
+        self.simulator.start()
+        self.sink = CarbonSink()
+        self.sink.start()
+        for server in [self.simulator, self.sink]:
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+
+    def test_agent_address(self):
+        self.assertEqual(agent_address(0), '127.1.0.1')
+        self.assertEqual(agent_address(255), '127.1.1.0')
+
+    def test_full_cycle(self):
+        master = self.simulator.master
+        mesos = Mesos([master])
+        self.assertEqual(len(mesos.slaves), 3)
+        singularity = Singularity(master, update=False)
+        group = TierGroup(list(TIERS), Scheduler(60), mesos, singularity)
+        carbon = Carbon('127.0.0.1', 'sim', port=self.sink.port)
+        group.collect(1500000000)
+        queued = group.queue.qsize()
+        sent, nbytes = Sender(carbon).send(group.queue, 1500000000,
+                                           time.time() + 60)
+        self.assertEqual(sent, queued)
+        self.assertGreater(nbytes, 0)
+
+        # 3 agents x 15 metrics, 3 x 2 executors x 5 metrics twice (by
+        # agent and by task name), framework metrics and cluster metrics
+        self.assertGreater(sent, 45 + 60)
+        # the sink reads the connection on its own thread
+        for _ in range(50):
+            if self.sink.stats.datapoints >= sent:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.sink.stats.datapoints, sent)
+        self.assertEqual(self.sink.stats.invalid, 0)
+        self.assertIn('sim.tasks.task0.1.cpus.limit', self.sink.stats.paths)
@@ -0,0 +1,152 @@
+import time
+import queue
+import pickle
+import threading
+import unittest
+
+from mesos_stats import sinks
+from mesos_stats.carbon import format_metric
+from mesos_stats.sinks import Sink, FanOut, sink_from_url, SINK_BATCH
+from benchmarks.carbon_sink import CarbonSink as CarbonServer
+
+BATCH = [('cluster.cpus.total', (1000, 32)), ('slave.a1.load', (1000, 0.5))]
+
+
+class FakeSink(Sink):
+    def __init__(self, name, format, buffer=sinks.SINK_BUFFER):
+        Sink.__init__(self, name, buffer)
+        self.format = format
+        self.written = []
+        self.wait = threading.Event()
+        self.wait.set()
+
+    def write(self, payload):
+        self.wait.wait()
+        self.written.append(payload)
+
+
+def queued(n):
+    q = queue.Queue()
+    for i in range(n):
+        q.put(('slave.a{}.load'.format(i), (1500000000, i)))
+    return q
+
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        time.sleep(0.01)
+
+
+class SinksTest(unittest.TestCase):
+    def test_encoders(self):
+        self.assertEqual(
+            sinks.encode_plaintext(BATCH, 'p').decode(),
+            ''.join('p.{}\n'.format(format_metric(path, v, ts))
+                    for path, (ts, v) in BATCH))
+        payload = sinks.encode_pickle(BATCH)
+        self.assertEqual(pickle.loads(payload[4:]), BATCH)
+        self.assertEqual(sinks.encode_statsd(BATCH, 'p'),
+                         [b'p.cluster.cpus.total:32|g\np.slave.a1.load:0.5|g'])
+        self.assertEqual(sinks.encode_influx(BATCH), (
+            'cluster.cpus.total value=32 1000\n'
+            'slave.a1.load value=0.5 1000\n').encode())
+
+    def test_statsd_datagrams(self):
+        batch = [('slave.agent{:04d}.load'.format(i), (1000, 1))
+                 for i in range(200)]
+        packets = sinks.encode_statsd(batch)
+        self.assertGreater(len(packets), 1)
+        self.assertTrue(all(len(p) <= sinks.STATSD_PACKET for p in packets))
+        self.assertEqual(sum(p.count(b'|g') for p in packets), 200)
+
+        # a leading - changes a gauge, it's set to 0 first
+        self.assertEqual(sinks.encode_statsd([('cluster.lag', (1000, -5))]),
+                         [b'cluster.lag:0|g\ncluster.lag:-5|g'])
+
+    def test_sink_from_url(self):
+        self.assertEqual(sink_from_url('carbon+pickle://c1').format, 'pickle')
+        self.assertEqual(sink_from_url('statsd://s1:9125').address,
+                         ('s1', 9125))
+        self.assertEqual(sink_from_url('influx://i1/mesos').url,
+                         'http://i1:8086/write?db=mesos&precision=s')
+        self.assertRaises(ValueError, sink_from_url, 'influx://i1')
+        self.assertRaises(ValueError, sink_from_url, 'kafka://k1')
+
+    def test_fan_out(self):
+        slow = FakeSink('slow', 'plaintext', buffer=SINK_BATCH)
+        slow.wait.clear()
+        fast = FakeSink('fast', 'plaintext')
+        other = FakeSink('other', 'plaintext')
+        influx = FakeSink('influx', 'influx')
+        fan_out = FanOut([slow, fast, other, influx], 'p')
+
+        sent, nbytes = fan_out.send_metrics(queued(SINK_BATCH + 1), 10)
+        self.assertEqual(sent, SINK_BATCH + 1)
+        wait_for(lambda: len(fast.written) == 2 and len(influx.written) == 2)
+        # encoded once for both plaintext sinks
+        wait_for(lambda: len(other.written) == 2)
+        self.assertIs(fast.written[0], other.written[0])
+        self.assertTrue(influx.written[0].startswith(
+            b'p.slave.a0.load value=0 1500000000\n'))
+        self.assertGreater(nbytes, 0)
+
+        # the slow sink drops its oldest batches instead of holding up
+        fan_out.send_metrics(queued(SINK_BATCH), 10)
+        wait_for(lambda: len(fast.written) == 3)
+        self.assertEqual(len(fast.written), 3)
+        self.assertGreater(slow.dropped, 0)
+        slow.wait.set()
+        wait_for(lambda: not slow.buffer.qsize())
+        stats = dict(fan_out.datapoints())
+        self.assertEqual(stats['sinks.fast.sent'], 2 * SINK_BATCH + 1)
+        self.assertEqual(stats['sinks.slow.dropped'], slow.dropped)
+        self.assertEqual(dict(fan_out.datapoints())['sinks.fast.sent'], 0)
+
+    def test_drops_counted_from_every_thread(self):
+        sink = FakeSink('racy', 'plaintext', buffer=SINK_BATCH)
+
+        def put():
+            for _ in range(1000):
+                sink.put(b'x', 1)
+        threads = [threading.Thread(target=put) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # every batch but the one still buffered was dropped
+        self.assertEqual(sink.dropped + sink.buffer.qsize(), 4000)
+
+    def test_never_drops_cycle_ends(self):
+        sink = FakeSink('behind', 'plaintext', buffer=2 * SINK_BATCH)
+        flushes = []
+        sink.flush = lambda: flushes.append(True)
+        sink.put(b'a', 1)
+        sink.end_cycle()
+        sink.put(b'b', 1)
+        sink.put(b'c', 1)
+        self.assertEqual(sink.dropped, 2)
+        self.assertEqual(list(sink.buffer.queue), [(None, 0), (b'c', 1)])
+        sink.start()
+        wait_for(lambda: sink.written)
+        self.assertEqual((flushes, sink.written), ([True], [b'c']))
+
+    def test_carbon_sink(self):
+        server = CarbonServer()
+        server.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        fan_out = FanOut([sink_from_url('carbon://127.0.0.1:{}'.format(
+            server.port))], 'p')
+        fan_out.send_metrics(queued(10), 10)
+        wait_for(lambda: server.stats.datapoints >= 10)
+        self.assertEqual(server.stats.datapoints, 10)
+        self.assertIn('p.slave.a9.load', server.stats.paths)
+        self.assertEqual(fan_out.status()['sinks']['carbon://127.0.0.1:{}'
+                                                   .format(server.port)]
+                         ['sent'], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import time
+import unittest
+
+from mesos_stats.mesos import Mesos
+from mesos_stats.scheduler import Scheduler
+from mesos_stats.stale import SampleStore
+from mesos_stats.tiers import TierGroup
+from benchmarks.simulator import ClusterSpec, Simulator
+
+
+class StaleTest(unittest.TestCase):
+    def test_sample_store(self):
+        store = SampleStore(2)
+        store.start_cycle()
+        store.update('a1', {'m': 1}, [{'e': 1}])
+        store.update('a2', {'m': 2}, False)
+        self.assertEqual(store.stale(['a1', 'a2'], {'a1', 'a2'}, {'a1'}), [])
+
+        store.start_cycle()
+        store.update('a1', False, [{'e': 2}])
+        self.assertEqual(store.stale(['a1', 'a2'], set(), {'a1'}), [
+            ('a1', {'m': 1}, None, 1), ('a2', {'m': 2}, None, 1)])
+
+        store.start_cycle()
+        store.start_cycle()
+        self.assertEqual(store.stale(['a1'], set(), set()),
+                         [('a1', None, [{'e': 2}], 2)])
+        # too old or gone
+        self.assertEqual(store.samples, {'a1': [None, [{'e': 2}], 1, 2]})
+
+    def test_slow_agent_keeps_its_series(self):
+        simulator = Simulator(ClusterSpec(agents=4, executors=1,
+                                          slow_agents=1, slow_latency=1.0),
+                              port=0)
+        simulator.start()
+        self.addCleanup(simulator.server_close)
+        self.addCleanup(simulator.shutdown)
+        slow = simulator.cluster.slow.pop()
+        simulator.cluster.slow.add(slow)
+
+        mesos = Mesos([simulator.master])
+        group = TierGroup(['agent'], Scheduler(60), mesos, stale_cycles=2)
+        group.collect(int(time.time()))
+        first = set(d.split()[0] for d in group.queue.queue)
+        group.queue.queue.clear()
+
+        # the slow agent misses the deadline, its last sample stands in
+        group.agent_deadline = 0.3
+        tick = time.time()
+        group.collect(tick)
+        self.assertLess(time.time() - tick, 0.9)
+        second = list(group.queue.queue)
+        stale = 'slave.{}.stale'.format(slow.replace('.', '_'))
+        self.assertIn('{} 1 {}'.format(stale, int(tick)), second)
+        self.assertEqual(set(d.split()[0] for d in second) - {stale}, first)
+
+        # and is replaced once the poll finishes in the background
+        time.sleep(1.2)
+        self.assertEqual(group.samples.samples[slow][2], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mesos_stats.mesos import Mesos
+from mesos_stats.registry import SeriesRegistry
+from mesos_stats.state import StateStore
+
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'state.json.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_and_restore(self):
+        mesos = Mesos(['mesos1'], discover=False)
+        mesos.master = 'mesos1'
+        mesos.slaves = [{'hostname': 'slave1', 'port': '5051'}]
+        registry = SeriesRegistry({'tasks': 10})
+        registry._add('tasks.a.1.cpus.limit', 1000.0, 'tasks')
+
+        state = StateStore(self.path)
+        state.register('mesos', mesos)
+        state.register('registry', registry)
+        state.save()
+
+        mesos2 = Mesos(['mesos1'], discover=False)
+        registry2 = SeriesRegistry({'tasks': 10})
+        state2 = StateStore(self.path)
+        state2.register('mesos', mesos2)
+        self.assertTrue(state2.load())
+        # Components registering after the load get their state too
+        state2.register('registry', registry2)
+
+        self.assertEqual(mesos2.master, 'mesos1')
+        self.assertEqual(mesos2.slaves, mesos.slaves)
+        self.assertIn('tasks.a.1.cpus.limit', registry2)
+        self.assertEqual(registry2.first_seen('tasks.a.1.cpus.limit'), 1000)
+        self.assertEqual(registry2._counts['tasks'], 1)
+
+    def test_missing_or_corrupt_snapshot_starts_cold(self):
+        state = StateStore(self.path)
+        self.assertFalse(state.load())
+        with open(self.path, 'w') as f:
+            f.write('garbage')
+        self.assertFalse(state.load())
+
+    def test_snapshot_that_cannot_be_taken_is_skipped(self):
+        class Changing:
+            def dump_state(self):
+                raise RuntimeError('dictionary changed size during '
+                                   'iteration')
+        state = StateStore(self.path)
+        state.register('changing', Changing())
+        state.save()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_checkpoint_every_n_cycles(self):
+        state = StateStore(self.path, checkpoint_cycles=2)
+        state.cycle_done()
+        self.assertFalse(os.path.exists(self.path))
+        state.cycle_done()
+        self.assertTrue(os.path.exists(self.path))
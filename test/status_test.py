@@ -0,0 +1,94 @@
+import unittest
+import json
+import queue
+import urllib.request
+import urllib.error
+
+from mesos_stats import util
+from mesos_stats.adaptive import RequestController
+from mesos_stats.mesos import agent_requests
+from mesos_stats.scheduler import Scheduler
+from mesos_stats.status import CycleStatus, StatusServer
+
+
+class FakeGroup:
+    def __init__(self, name, tiers, interval=60):
+        self.name = name
+        self.tiers = tiers
+        self.scheduler = Scheduler(interval)
+        self.queue = queue.Queue()
+
+
+class CycleStatusTest(unittest.TestCase):
+    def test_records_cycles_by_phase(self):
+        status = CycleStatus(history=2)
+        status.add_group(FakeGroup('agent', ['agent']))
+        self.assertFalse(status.ready())
+
+        for tick in [1000, 1060, 1120]:
+            status.start_cycle('agent', tick)
+            status.phase('agent', 'mesos')
+            status.observe_request('agent.metrics_snapshot',
+                                   'http://s1:5051/metrics/snapshot', 2.0,
+                                   10, True)
+            status.observe_request('agent.metrics_snapshot',
+                                   'http://s2:5051/metrics/snapshot', 5.0,
+                                   10, True)
+            status.phase('agent', 'flush')
+            self.assertEqual(status.current['agent']['phase'], 'flush')
+            status.end_cycle('agent')
+
+        res = json.loads(status.status_json().decode())
+        self.assertTrue(res['ready'])
+        cycles = res['cycles']['agent']
+        self.assertEqual([c['tick'] for c in cycles], [1060, 1120])
+        self.assertEqual(sorted(cycles[0]['phases']),
+                         ['flush', 'mesos', 'send', 'singularity'])
+        self.assertEqual([a['agent'] for a in cycles[-1]['slowest_agents']],
+                         ['s2', 's1'])
+        self.assertEqual(cycles[-1]['slowest_agents'][0]['seconds'], 5.0)
+        self.assertEqual(res['current']['agent']['phase'], 'idle')
+
+    def test_pool(self):
+        status = CycleStatus()
+        pool = status.pool_status()
+        self.assertEqual(pool['in_flight'], 0)
+        self.assertFalse(pool['adaptive'])
+        self.assertEqual(pool['http_pools'], util.HTTP_POOLS)
+
+        controller = RequestController(concurrency=7)
+        controller.install()
+        self.addCleanup(controller.uninstall)
+        agent_requests.add(3)
+        self.addCleanup(agent_requests.add, -3)
+        pool = json.loads(status.status_json().decode())['pool']
+        self.assertEqual((pool['in_flight'], pool['limit'], pool['adaptive']),
+                         (3, 7, True))
+
+    def test_liveness(self):
+        status = CycleStatus()
+        status.add_group(FakeGroup('cluster', ['cluster'], 10))
+        now = status.last_event['cluster']
+        self.assertTrue(status.alive(now + 29))
+        self.assertFalse(status.alive(now + 31))
+        status.start_cycle('cluster', 1000)
+        status.end_cycle('cluster', ok=False)
+        self.assertFalse(status.ready())
+
+    def test_server(self):
+        status = CycleStatus()
+        status.add_group(FakeGroup('all', ['cluster']))
+        server = StatusServer(status, 0, '127.0.0.1')
+        server.start()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            res = json.loads(urllib.request.urlopen(url + '/status').read())
+            self.assertEqual(res['current']['all']['phase'], 'idle')
+            self.assertEqual(
+                urllib.request.urlopen(url + '/healthz').status, 200)
+            with self.assertRaises(urllib.error.HTTPError) as e:
+                urllib.request.urlopen(url + '/ready')
+            self.assertEqual(e.exception.code, 503)
+        finally:
+            server.shutdown()
+            server.server_close()
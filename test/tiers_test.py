@@ -0,0 +1,80 @@
+import unittest
+import requests_mock
+
+from mesos_stats.mesos import Mesos
+from mesos_stats.scheduler import Scheduler
+from mesos_stats.tiers import TierGroup, group_tiers
+
+
+class TiersTest(unittest.TestCase):
+    def test_group_tiers(self):
+        groups = group_tiers({'cluster': 10}, 60)
+        self.assertEqual(groups, [
+            (10, ['cluster']),
+            (60, ['framework', 'agent', 'executor', 'singularity']),
+        ])
+        self.assertEqual(group_tiers({}, 60)[0][0], 60)
+        self.assertRaises(ValueError, group_tiers, {'nope': 10}, 60)
+
+    def test_groups_collect_their_tiers(self):
+        mesos = Mesos(['mesos1'], discover=False)
+        groups = TierGroup.from_config({'cluster': 10}, Scheduler(60), mesos)
+        self.assertEqual([g.name for g in groups],
+                         ['cluster', 'framework_agent_executor_singularity'])
+        self.assertEqual([g.scheduler.interval for g in groups], [10, 60])
+
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://mesos1/metrics/snapshot',
+                           json={'master/elected': 1,
+                                 'master/cpus_total': 32})
+            groups[0].collect(1010)
+
+        self.assertEqual(groups[0].queue.get(), 'cluster.cpus.total 32 1010')
+        self.assertTrue(groups[0].queue.empty())
+        self.assertTrue(groups[1].queue.empty())
+
+    def test_agent_shard_groups(self):
+        mesos = Mesos(['mesos1'], discover=False)
+        groups = TierGroup.from_config({'executor': 30}, Scheduler(60),
+                                       mesos, tiers=('agent', 'executor'))
+        self.assertEqual([(g.name, g.scheduler.interval) for g in groups],
+                         [('executor', 30), ('agent', 60)])
+        self.assertTrue(all(g.refresh_tasks for g in groups))
+        groups = TierGroup.from_config({}, Scheduler(60), mesos)
+        self.assertFalse(groups[0].refresh_tasks)
+
+    def test_agent_resources_from_master(self):
+        slaves = {'slaves': [{'id': 'S1', 'hostname': 'slave1',
+                              'port': 5051, 'resources': {'cpus': 4},
+                              'used_resources': {'cpus': 1}}]}
+        mesos = Mesos(['mesos1'], discover=False)
+        mesos.master = 'mesos1'
+        self.assertRaises(ValueError, TierGroup, ['agent'], Scheduler(60),
+                          mesos, agent_source='nope')
+        group = TierGroup(['agent'], Scheduler(60), mesos,
+                          agent_source='master_only')
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://mesos1/slaves', json=slaves)
+            group.collect(1000)
+            # only the master was asked
+            self.assertEqual(m.call_count, 1)
+        self.assertEqual(sorted(group.queue.queue), [
+            'slave.slave1.cpus.percent 25.0 1000',
+            'slave.slave1.cpus.total 4 1000',
+            'slave.slave1.cpus.used 1 1000',
+        ])
+
+    def test_framework_totals_from_state_summary(self):
+        mesos = Mesos(['mesos1'], discover=False)
+        mesos.master = 'mesos1'
+        group = TierGroup(['framework'], Scheduler(60), mesos,
+                          framework_tasks=False)
+        with requests_mock.Mocker() as m:
+            m.register_uri('GET', 'http://mesos1/state-summary', json={
+                'slaves': [{'id': 'S1'}],
+                'frameworks': [{'id': 'F1', 'name': 'marathon',
+                                'used_resources': {'cpus': 2.5}}]})
+            group.collect(1000)
+        self.assertEqual(list(group.queue.queue),
+                         ['frameworks.marathon.resources.cpus 2.5 1000'])
+        self.assertIsNone(mesos.framework_metrics)